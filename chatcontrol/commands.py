@@ -0,0 +1,120 @@
+"""Table of chat commands, built once and looked up with one dict lookup.
+
+Commands can be typed in full, by an alias, or by any prefix that only one
+command starts with.
+
+table = commands.CommandTable()
+table.add(commands.Command('status', self.command_status, usage='[door]',
+    parseArgs=commands.optionalArg))
+command = table.get('st')
+"""
+
+import collections
+
+
+class ArgumentError(Exception):
+  """Raised by argument parsers; the message is the reply to the user."""
+
+
+def noArgs(args):
+  return ()
+
+
+def optionalArg(args):
+  """The first argument, or None."""
+  return (args[0] if args else None,)
+
+
+def allArgs(args):
+  """All the arguments, as a list."""
+  return (args,)
+
+
+class Command(object):
+
+  def __init__(self, name, handler, requiresAuth=True, parseArgs=noArgs,
+      usage='', aliases=()):
+    """
+    Constructor.
+
+    Args:
+      name: what the user types.
+      handler: called with the sender and the parsed arguments; returns the
+          reply.
+      requiresAuth: only subscribers may use it.
+      parseArgs: turns the list of (non-empty) words after the command into a
+          tuple of arguments for the handler. Raises ArgumentError to reply
+          with an error instead.
+      usage: argument summary for the help text.
+      aliases: other names for the command.
+    """
+    self.name = name
+    self.handler = handler
+    self.requiresAuth = requiresAuth
+    self.parseArgs = parseArgs
+    self.usage = usage
+    self.aliases = tuple(aliases)
+
+  def __call__(self, sender, args):
+    """Parse the args and call the handler.
+
+    Args:
+      sender: xmpp user string
+      args: list of words after the command; empty ones are skipped.
+    Returns:
+      string to reply to the user
+    """
+    try:
+      parsed = self.parseArgs([arg for arg in args if arg])
+    except ArgumentError as e:
+      return str(e)
+    return self.handler(sender, *parsed)
+
+  def helpText(self):
+    if self.usage:
+      return '%s %s' % (self.name, self.usage)
+    return self.name
+
+
+class CommandTable(object):
+
+  def __init__(self):
+    self._commands = collections.OrderedDict()
+    # Every name, alias and unambiguous prefix -> Command.
+    self._lookup = {}
+
+  def add(self, command):
+    for name in (command.name,) + command.aliases:
+      if name in self._commands or any(
+          name in other.aliases for other in self._commands.itervalues()):
+        raise ValueError('duplicate command name "%s"' % name)
+    self._commands[command.name] = command
+    self._index()
+
+  def _index(self):
+    names = {}
+    for command in self._commands.itervalues():
+      for name in (command.name,) + command.aliases:
+        names[name] = command
+    prefixes = {}
+    for name, command in names.iteritems():
+      for end in range(1, len(name)):
+        prefixes.setdefault(name[:end], set()).add(command)
+    self._lookup = dict((prefix, commands.pop())
+        for prefix, commands in prefixes.iteritems() if len(commands) == 1)
+    # Full names win over prefixes of longer names.
+    self._lookup.update(names)
+
+  def get(self, name):
+    """
+    Returns:
+      the Command name, an alias or a unique prefix refers to, or None.
+    """
+    return self._lookup.get(name)
+
+  def __iter__(self):
+    return self._commands.itervalues()
+
+  def helpText(self):
+    return 'commands: %s' % ', '.join(
+        command.helpText() for command in self._commands.itervalues())
@@ -0,0 +1,148 @@
+"""Broadcasters that send an alert once and let the XMPP server fan it out.
+
+MUCBroadcastProtocol posts to a multi-user chat room (XEP-0045) that the
+subscribers join, and PubSubBroadcastProtocol publishes to a pubsub node
+(XEP-0060) that they subscribe to. Either can replace
+xmpp.ChatBroadcastProtocol as the state machine's broadcaster; chat commands
+still go through xmpp.ChatCommandReceiverProtocol.
+
+broadcaster = fanout.MUCBroadcastProtocol(
+    jid.JID('gdoormon@conference.example.com'), 'gdoormon')
+broadcaster.setHandlerParent(xmppclient)
+"""
+
+import collections
+import time
+
+from twisted.python import log
+from twisted.words.xish import domish
+from wokkel import muc
+from wokkel import pubsub
+
+NS_ATOM = 'http://www.w3.org/2005/Atom'
+# Alerts to hold on to while not connected (or not in the room yet).
+MAX_PENDING = 20
+
+
+class PendingMixin:
+  """Holds broadcasts until the protocol is ready to send them."""
+
+  def initPending(self):
+    self.ready = False
+    self._pending = collections.deque(maxlen=MAX_PENDING)
+
+  def sendAllSubscribers(self, text):
+    if not self.ready:
+      log.msg('not ready to broadcast, holding message: %s' % text)
+      self._pending.append(text)
+      return
+    self.broadcast(text)
+
+  def setReady(self, ready):
+    self.ready = ready
+    while self.ready and self._pending:
+      self.broadcast(self._pending.popleft())
+
+
+class MUCBroadcastProtocol(PendingMixin, muc.MUCClient):
+
+  def __init__(self, roomJID, nick, reactor=None):
+    """
+    Args:
+      roomJID: jid.JID of the room to post alerts in.
+      nick: nick to join the room as.
+      reactor: reactor for testing.
+    """
+    muc.MUCClient.__init__(self, reactor)
+    self.roomJID = roomJID
+    self.nick = nick
+    self.initPending()
+
+  def connectionInitialized(self):
+    muc.MUCClient.connectionInitialized(self)
+    d = self.join(self.roomJID, self.nick)
+    d.addCallback(self._joinedRoom)
+    d.addErrback(self._joinFailed)
+
+  def connectionLost(self, reason):
+    self.setReady(False)
+    muc.MUCClient.connectionLost(self, reason)
+
+  def _joinedRoom(self, room):
+    log.msg('joined %s as %s' % (self.roomJID.full(), self.nick))
+    if room.locked:
+      # We just created the room; accept the default configuration so
+      # others can join.
+      d = self.configure(self.roomJID, {})
+      d.addCallback(lambda _: self.setReady(True))
+      return d
+    self.setReady(True)
+
+  def _joinFailed(self, failure):
+    log.msg('failed to join %s: %s' % (
+        self.roomJID.full(), failure.getErrorMessage()))
+
+  def broadcast(self, text):
+    log.msg('broadcasting message to %s: %s' % (self.roomJID.full(), text))
+    self.groupChat(self.roomJID, text)
+
+
+class PubSubBroadcastProtocol(PendingMixin, pubsub.PubSubClient):
+
+  def __init__(self, service, nodeIdentifier):
+    """
+    Args:
+      service: jid.JID of the pubsub service.
+      nodeIdentifier: node to publish alerts to. It's created if it doesn't
+          exist.
+    """
+    pubsub.PubSubClient.__init__(self)
+    self.service = service
+    self.nodeIdentifier = nodeIdentifier
+    self.initPending()
+
+  def connectionInitialized(self):
+    pubsub.PubSubClient.connectionInitialized(self)
+    d = self.createNode(self.service, self.nodeIdentifier)
+    d.addCallbacks(self._nodeCreated, self._createFailed)
+    d.addCallback(lambda _: self.setReady(True))
+
+  def connectionLost(self, reason):
+    self.setReady(False)
+    pubsub.PubSubClient.connectionLost(self, reason)
+
+  def _nodeCreated(self, nodeIdentifier):
+    log.msg('created pubsub node %s' % nodeIdentifier)
+
+  def _createFailed(self, failure):
+    # Usually a conflict, because the node already exists. If it's something
+    # else, publishing will fail and say so.
+    log.msg('not creating pubsub node %s: %s' % (
+        self.nodeIdentifier, failure.getErrorMessage()))
+
+  def broadcast(self, text):
+    log.msg('publishing message to %s/%s: %s' % (
+        self.service.full(), self.nodeIdentifier, text))
+    d = self.publish(self.service, self.nodeIdentifier,
+        [pubsub.Item(payload=atomEntry(text))])
+    d.addErrback(self._publishFailed, text)
+    return d
+
+  def _publishFailed(self, failure, text):
+    log.msg('failed to publish "%s": %s' % (text, failure.getErrorMessage()))
+
+
+def atomEntry(text, now=None):
+  """Build the Atom entry alerts are published as.
+
+  Args:
+    text: alert text
+    now: seconds since the epoch (optional)
+  Returns:
+    domish.Element
+  """
+  entry = domish.Element((NS_ATOM, 'entry'))
+  entry.addElement('title', content=text)
+  entry.addElement('updated', content=time.strftime(
+      '%Y-%m-%dT%H:%M:%SZ', time.gmtime(now)))
+  return entry
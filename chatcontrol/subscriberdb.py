@@ -0,0 +1,88 @@
+"""In-memory index of chat subscribers in front of the subscriber db.
+
+The db is listed once at startup. After that, lookups are set lookups, and
+subscribes and unsubscribes update the set right away and are written to the
+db in batches, each with one fsync.
+
+subscribers = subscriberdb.SubscriberIndex(subscriberdb.getDb(path))
+reactor.addSystemEventTrigger('before', 'shutdown', subscribers.flush)
+broadcaster = xmpp.ChatBroadcastProtocol(subscribers)
+commander = xmpp.ChatCommandReceiverProtocol(statemach, subscribers, passwd)
+"""
+
+from storage import journaldb
+from twisted.internet import reactor
+from twisted.python import log
+
+# Write changes to the db this long after the first unwritten change.
+BATCH_DELAY_SECS = 5
+
+
+def getDb(db_path):
+  return journaldb.openDb(db_path)
+
+
+class SubscriberIndex(object):
+  """Set of subscribed JIDs that supports the bits of the mapping interface
+  the chat protocols use: in, len, keys, item assignment and deletion."""
+
+  def __init__(self, db, batchDelay=BATCH_DELAY_SECS,
+      callLater=reactor.callLater):
+    """
+    Constructor.
+
+    Args:
+      db: journaldb.JournalDB the subscribers are persisted in.
+      batchDelay: seconds to wait before writing changes to the db, or None
+          to write them immediately.
+      callLater: reactor.callLater callback for testing.
+    """
+    self._db = db
+    self._batchDelay = batchDelay
+    self._callLater = callLater
+    self._subscribers = set(db.keys())
+    # JID -> value to write, or None to delete it.
+    self._unwritten = {}
+    self._flushCall = None
+
+  def __contains__(self, jid):
+    return jid in self._subscribers
+
+  def __len__(self):
+    return len(self._subscribers)
+
+  def __iter__(self):
+    return iter(self._subscribers)
+
+  def keys(self):
+    return list(self._subscribers)
+
+  def __setitem__(self, jid, value):
+    self._subscribers.add(jid)
+    self._write(jid, value)
+
+  def __delitem__(self, jid):
+    if jid not in self._subscribers:
+      raise KeyError(jid)
+    self._subscribers.remove(jid)
+    self._write(jid, None)
+
+  def _write(self, jid, value):
+    self._unwritten[jid] = value
+    if self._batchDelay is None:
+      self.flush()
+    elif self._flushCall is None:
+      self._flushCall = self._callLater(self._batchDelay, self.flush)
+
+  def flush(self):
+    """Write unwritten changes to the db."""
+    if self._flushCall is not None:
+      if self._flushCall.active():
+        self._flushCall.cancel()
+      self._flushCall = None
+    unwritten, self._unwritten = self._unwritten, {}
+    try:
+      self._db.write(unwritten)
+    except EnvironmentError as e:
+      log.msg('Failed to save subscribers %s: %s' % (
+          ', '.join(sorted(unwritten)), e))
@@ -0,0 +1,61 @@
+#!/usr/bin/trial
+
+import commands
+from twisted.trial import unittest
+
+
+def echo(sender, *args):
+  return (sender,) + args
+
+
+class CommandTableTest(unittest.TestCase):
+  def setUp(self):
+    self.table = commands.CommandTable()
+    self.table.add(commands.Command('status', echo,
+        parseArgs=commands.optionalArg, usage='[door]', aliases=('state',)))
+    self.table.add(commands.Command('snooze', echo))
+    self.table.add(commands.Command('stop', echo))
+
+  def testExactName(self):
+    self.assertEquals('status', self.table.get('status').name)
+    self.assertEquals('stop', self.table.get('stop').name)
+
+  def testAlias(self):
+    self.assertEquals('status', self.table.get('state').name)
+
+  def testUniquePrefix(self):
+    self.assertEquals('snooze', self.table.get('sn').name)
+    self.assertEquals('stop', self.table.get('sto').name)
+    self.assertEquals('status', self.table.get('stat').name)
+
+  def testAmbiguousPrefix(self):
+    # status, state, snooze and stop all start with s.
+    self.assertIdentical(None, self.table.get('s'))
+    self.assertIdentical(None, self.table.get('st'))
+    # Unless they're the same command.
+    self.assertEquals('status', self.table.get('sta').name)
+
+  def testUnknown(self):
+    self.assertIdentical(None, self.table.get('statusx'))
+    self.assertIdentical(None, self.table.get(''))
+
+  def testDuplicate(self):
+    self.assertRaises(ValueError, self.table.add,
+        commands.Command('state', echo))
+    self.assertRaises(ValueError, self.table.add,
+        commands.Command('foo', echo, aliases=('snooze',)))
+
+  def testCall(self):
+    status = self.table.get('status')
+    self.assertEquals(('me', None), status('me', ['']))
+    self.assertEquals(('me', 'shed'), status('me', ['', 'shed', 'x']))
+
+  def testArgumentError(self):
+    def parse(args):
+      raise commands.ArgumentError('nope')
+    self.table.add(commands.Command('fail', echo, parseArgs=parse))
+    self.assertEquals('nope', self.table.get('fail')('me', []))
+
+  def testHelpText(self):
+    self.assertEquals('commands: status [door], snooze, stop',
+        self.table.helpText())
@@ -0,0 +1,104 @@
+#!/usr/bin/trial
+
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.words.protocols.jabber import error
+from twisted.words.protocols.jabber import xmlstream
+from twisted.words.protocols.jabber.jid import JID
+from wokkel.generic import parseXml
+from wokkel.test import helpers
+
+import fanout
+
+ROOM_JID = JID('alerts@conference.example.org')
+NICK = 'gdoormon'
+PUBSUB_JID = JID('pubsub.example.org')
+NODE = 'gdoormon'
+
+
+class MUCBroadcastProtocolTest(unittest.TestCase):
+  def setUp(self):
+    self.clock = task.Clock()
+    self.sessionManager = helpers.TestableStreamManager(reactor=self.clock)
+    self.stub = self.sessionManager.stub
+    self.protocol = fanout.MUCBroadcastProtocol(ROOM_JID, NICK,
+        reactor=self.clock)
+    self.protocol.setHandlerParent(self.sessionManager)
+
+  def joinRoom(self, statusCode=None):
+    # Joining is the first thing sent.
+    self.assertEquals('presence', self.stub.output[0].name)
+    self.assertEquals('%s/%s' % (ROOM_JID.full(), NICK),
+        self.stub.output[0]['to'])
+    status = '<status code="%d"/>' % statusCode if statusCode else ''
+    self.stub.send(parseXml("""
+        <presence from='%s/%s'>
+          <x xmlns='http://jabber.org/protocol/muc#user'>
+            <item affiliation='owner' role='moderator'/>
+            <status code='110'/>%s
+          </x>
+        </presence>""" % (ROOM_JID.full(), NICK, status)))
+
+  def groupChats(self):
+    return [(element['to'], str(element.body)) for element in self.stub.output
+        if element.name == 'message']
+
+  def testHoldsMessagesUntilJoined(self):
+    self.protocol.sendAllSubscribers('door open')
+    self.assertEquals([], self.groupChats())
+    self.joinRoom()
+    self.protocol.sendAllSubscribers('door closed')
+    self.assertEquals([(ROOM_JID.full(), 'door open'),
+        (ROOM_JID.full(), 'door closed')], self.groupChats())
+    self.assertEquals('groupchat', self.stub.output[-1]['type'])
+
+  def testCreatesRoom(self):
+    self.protocol.sendAllSubscribers('door open')
+    self.joinRoom(statusCode=201)
+    # The new room is configured before anything is sent to it.
+    iq = self.stub.output[-1]
+    self.assertEquals('iq', iq.name)
+    self.assertEquals([], self.groupChats())
+    self.stub.send(xmlstream.toResponse(iq, 'result'))
+    self.assertEquals([(ROOM_JID.full(), 'door open')], self.groupChats())
+
+  def testDisconnect(self):
+    self.joinRoom()
+    self.sessionManager._disconnected(None)
+    self.protocol.sendAllSubscribers('door open')
+    self.assertEquals([], self.groupChats())
+
+
+class PubSubBroadcastProtocolTest(unittest.TestCase):
+  def setUp(self):
+    self.stub = helpers.XmlStreamStub()
+    self.protocol = fanout.PubSubBroadcastProtocol(PUBSUB_JID, NODE)
+    self.protocol.xmlstream = self.stub.xmlstream
+    self.protocol.connectionInitialized()
+
+  def testPublish(self):
+    self.protocol.sendAllSubscribers('door open')
+    # Create the node; it already exists.
+    iq = self.stub.output[-1]
+    self.assertEquals(PUBSUB_JID.full(), iq['to'])
+    self.assertEquals(NODE, iq.pubsub.create['node'])
+    self.stub.send(error.StanzaError('conflict').toResponse(iq))
+
+    iq = self.stub.output[-1]
+    self.assertEquals(PUBSUB_JID.full(), iq['to'])
+    self.assertEquals(NODE, iq.pubsub.publish['node'])
+    entry = iq.pubsub.publish.item.entry
+    self.assertEquals(fanout.NS_ATOM, entry.uri)
+    self.assertEquals('door open', str(entry.title))
+    self.stub.send(xmlstream.toResponse(iq, 'result'))
+
+    self.protocol.sendAllSubscribers('door closed')
+    self.assertEquals('door closed',
+        str(self.stub.output[-1].pubsub.publish.item.entry.title))
+
+
+class AtomEntryTest(unittest.TestCase):
+  def testEntry(self):
+    entry = fanout.atomEntry('door open', now=0)
+    self.assertEquals('door open', str(entry.title))
+    self.assertEquals('1970-01-01T00:00:00Z', str(entry.updated))
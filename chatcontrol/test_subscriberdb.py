@@ -0,0 +1,53 @@
+#!/usr/bin/trial
+
+import subscriberdb
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class SubscriberIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.db = subscriberdb.getDb(self.mktemp())
+    self.db['a@example.com'] = ''
+    self.clock = task.Clock()
+    self.index = subscriberdb.SubscriberIndex(self.db, batchDelay=5,
+        callLater=self.clock.callLater)
+
+  def testLoad(self):
+    self.assertTrue('a@example.com' in self.index)
+    self.assertFalse('b@example.com' in self.index)
+    self.assertEquals(['a@example.com'], self.index.keys())
+    self.assertEquals(1, len(self.index))
+
+  def testBatchedWrites(self):
+    self.index['b@example.com'] = ''
+    self.index['c@example.com'] = ''
+    del self.index['a@example.com']
+    # The index changes right away...
+    self.assertEquals(['b@example.com', 'c@example.com'],
+        sorted(self.index.keys()))
+    # ...and the db once the batch is written.
+    self.assertEquals(['a@example.com'], self.db.keys())
+    self.assertEquals(1, len(self.clock.getDelayedCalls()))
+    self.clock.advance(5)
+    self.assertEquals(['b@example.com', 'c@example.com'],
+        sorted(self.db.keys()))
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testSubscribeThenUnsubscribe(self):
+    self.index['b@example.com'] = ''
+    del self.index['b@example.com']
+    self.index.flush()
+    self.assertEquals(['a@example.com'], self.db.keys())
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testDeleteUnknown(self):
+    self.assertRaises(KeyError, self.index.__delitem__, 'b@example.com')
+
+  def testUnbatched(self):
+    db = subscriberdb.getDb(self.mktemp())
+    index = subscriberdb.SubscriberIndex(db, batchDelay=None)
+    index['a@example.com'] = ''
+    self.assertEquals(['a@example.com'], db.keys())
+    del index['a@example.com']
+    self.assertEquals([], db.keys())
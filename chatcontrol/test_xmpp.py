@@ -1,9 +1,12 @@
 #!/usr/bin/trial
 
+from twisted.internet import task
 from twisted.trial import unittest
 from twisted.words.xish import domish
+from xml.dom import minidom
 import re
 import xmpp
+from state import statemach
 
 
 TEST_PASSWORD = 'hunter2'
@@ -38,16 +41,69 @@ class TestChatProtocolBase(unittest.TestCase):
 class TestBroadcastProtocol(TestChatProtocolBase):
   def setUp(self):
     TestChatProtocolBase.setUp(self)
-    self.broadcast = xmpp.ChatBroadcastProtocol(self.subscribers)
+    self.clock = task.Clock()
+    self.broadcast = xmpp.ChatBroadcastProtocol(self.subscribers,
+        batchSize=2, batchInterval=1, coalesceSecs=10,
+        callLater=self.clock.callLater, seconds=self.clock.seconds)
     self.patch(self.broadcast, 'send', self.mockSend)
 
+  def parseSent(self):
+    """Parse the serialized messages sent so far."""
+    messages = [minidom.parseString(sent.encode('utf-8')).documentElement
+        for sent in self.sent]
+    self.sent = []
+    return messages
+
   def testSendAllSubscribers(self):
     self.broadcast.sendAllSubscribers('hello')
+    # Nothing is sent until the reactor gets to it.
+    self.assertEquals([], self.sent)
     self.assertNotEquals(len(self.subscribers), 0)
-    for sent in self.sent:
-      del self.subscribers[sent['to']]
+    self.clock.advance(0)
+    self.clock.advance(1)
+    for sent in self.parseSent():
+      self.assertEquals('chat', sent.getAttribute('type'))
+      self.assertEquals('hello', sent.getElementsByTagName('body')[0]
+          .firstChild.data)
+      del self.subscribers[sent.getAttribute('to')]
     self.assertEquals(len(self.subscribers), 0)
 
+  def testBatches(self):
+    self.broadcast.sendAllSubscribers('one')
+    self.broadcast.sendAllSubscribers('two')
+    self.assertEquals(6, self.broadcast.pendingMessages())
+    self.clock.advance(0)
+    self.assertEquals(2, len(self.sent))
+    self.clock.advance(1)
+    self.assertEquals(4, len(self.sent))
+    self.clock.advance(1)
+    self.assertEquals(0, self.broadcast.pendingMessages())
+    bodies = [sent.getElementsByTagName('body')[0].firstChild.data
+        for sent in self.parseSent()]
+    self.assertEquals(['one'] * 3 + ['two'] * 3, bodies)
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testCoalesce(self):
+    self.broadcast.sendAllSubscribers('door open')
+    self.clock.pump([0, 1, 4])
+    self.broadcast.sendAllSubscribers('door open')
+    self.clock.pump([0, 1, 4])
+    self.assertEquals(3, len(self.sent))
+    # Outside the window it's sent again.
+    self.broadcast.sendAllSubscribers('door open')
+    self.clock.pump([0, 1])
+    self.assertEquals(6, len(self.sent))
+
+  def testEscaping(self):
+    self.subscribers.clear()
+    self.subscribers["o'brien&co@example.com"] = 1
+    self.broadcast.sendAllSubscribers(u'<b>caf\xe9</b> & "stuff"')
+    self.clock.advance(0)
+    sent = self.parseSent()[0]
+    self.assertEquals("o'brien&co@example.com", sent.getAttribute('to'))
+    self.assertEquals(u'<b>caf\xe9</b> & "stuff"',
+        sent.getElementsByTagName('body')[0].firstChild.data)
+
 
 class ChatCommandReceiverProtocol(TestChatProtocolBase):
   def setUp(self):
@@ -71,6 +127,27 @@ class ChatCommandReceiverProtocol(TestChatProtocolBase):
     # Verify the statemach wasn't touched
     self.assertEquals(0, len(self.statemach.called))
 
+  def testHelpText(self):
+    self.receiveFakeMessage('commands', 'foo@example.com/zzzz')
+    self.assertEquals('commands: help, status [door], snooze [minutes] [door], '
+        'close_door [door], subscribe <password>, unsubscribe',
+        str(self.sent.pop().body))
+
+  def testPrefixesAndAliases(self):
+    self.statemach.valid_commands.add('command_close_door')
+    self.receiveFakeMessage(
+        'sub %s' % TEST_PASSWORD, 'foo@example.com/asdf')
+    self.assertEquals('foo@example.com subscribed', str(self.sent.pop().body))
+
+    self.receiveFakeMessage('STAT shed', 'foo@example.com/asdf')
+    self.assertEquals('getState', str(self.sent.pop().body))
+    self.receiveFakeMessage('shut', 'foo@example.com/asdf')
+    self.assertEquals('command_close_door', str(self.sent.pop().body))
+    self.assertEquals(
+        [('getState', (), {'doorId': 'shed'}),
+         ('command_close_door', (), {'args': [], 'sender': 'foo@example.com'})],
+        self.statemach.called)
+
   def testMalformedFromAddress(self):
     self.receiveFakeMessage('help me!', '~~~bogus~~~')
     self.assertEquals(0, len(self.sent))
@@ -179,6 +256,18 @@ class ChatCommandReceiverProtocol(TestChatProtocolBase):
     self.assertEquals('snoozeAlert', str(self.sent.pop().body))
     self.assertEquals(1, len(self.statemach.called))
 
+  def testDoorIdWithOneDoor(self):
+    # A lone StateMachine doesn't take door ids.
+    self.receiver.statemach = statemach.StateMachine(None, None)
+    self.receiveFakeMessage('status garage', 'a/zxcv')
+    self.assertTrue(str(self.sent.pop().body).startswith(
+        'unknown door "garage"'))
+    self.receiveFakeMessage('snooze 5 garage', 'a/zxcv')
+    self.assertTrue(str(self.sent.pop().body).startswith(
+        'unknown door "garage"'))
+    self.receiveFakeMessage('status', 'a/zxcv')
+    self.assertEquals('ok', str(self.sent.pop().body))
+
   def testGetStatus(self):
     self.receiveFakeMessage(
         'subscribe %s' % TEST_PASSWORD, 'foo@example.com/asdf')
@@ -1,7 +1,11 @@
+import collections
 import re
 
+from twisted.internet import reactor
 from twisted.python import log
 
+from chatcontrol import commands
+from metrics import instruments
 from twisted.words.xish import domish
 from wokkel import xmppim
 
@@ -9,6 +13,26 @@ from wokkel import xmppim
 # How long alert snooze lasts (in minutes).
 DEFAULT_SNOOZE_DURATION = 5
 
+# Broadcasts are sent this many messages at a time, this often.
+BROADCAST_BATCH_SIZE = 20
+BROADCAST_BATCH_INTERVAL_SECS = 1.0
+# Identical broadcasts this close together are only sent once.
+BROADCAST_COALESCE_SECS = 10
+
+# Stands in for the recipient when serializing a broadcast message.
+_RECIPIENT_MARKER = '\x00recipient\x00'
+
+_broadcasts = instruments.counter('broadcasts_total',
+    'Messages broadcast to the subscribers.')
+_broadcastsCoalesced = instruments.counter('broadcasts_coalesced_total',
+    'Broadcasts dropped as duplicates of a recent one.')
+_broadcastMessagesSent = instruments.counter('broadcast_messages_sent_total',
+    'Chat messages sent to individual subscribers.')
+# Large fan outs are rate limited, so this can take minutes.
+_broadcastSeconds = instruments.histogram('broadcast_fanout_seconds',
+    'Time from broadcasting a message until every subscriber was sent it.',
+    buckets=(0.01, 0.1, 1, 5, 10, 30, 60, 120, 300, 600))
+
 
 class SendMessageMixin:
   def sendMessage(self, body, to): 
@@ -18,35 +42,143 @@ class SendMessageMixin:
     msg.addElement('body', content=body)
     self.send(msg)
 
-def requiresAuthorization(func):
-  """Authorization decorator."""
-  def checkAuth(self, user, cmd_args):
-    if not self.isSubscriber(user):
-      msg = '%s is not subscribed' % user
-      log.msg(msg)
-      return msg
-    return func(self, user, cmd_args)
-  return checkAuth
-
 
 class ChatBroadcastProtocol(SendMessageMixin, xmppim.XMPPHandler):
-  def __init__(self, subscribers):
+  """Sends messages to every subscriber.
+
+  Broadcasts are queued and sent from the reactor, so whatever triggered the
+  broadcast (e.g. a state transition) doesn't wait on the fan out. Each
+  message is serialized once, and the recipient is stamped into the
+  serialized XML. Messages go out batchSize at a time, every batchInterval
+  seconds, to stay under the server's rate limits. A message identical to
+  one broadcast in the last coalesceSecs is dropped.
+  """
+
+  def __init__(self, subscribers, batchSize=BROADCAST_BATCH_SIZE,
+      batchInterval=BROADCAST_BATCH_INTERVAL_SECS,
+      coalesceSecs=BROADCAST_COALESCE_SECS, callLater=reactor.callLater,
+      seconds=reactor.seconds):
+    """
+    Args:
+      subscribers: subscriberdb.SubscriberIndex (or a dict)
+      batchSize: messages to send at a time.
+      batchInterval: seconds between batches.
+      coalesceSecs: drop messages identical to one broadcast this recently.
+      callLater: reactor.callLater callback for testing.
+      seconds: reactor.seconds callback for testing.
+    """
     self.subscribers = subscribers
+    self.batchSize = batchSize
+    self.batchInterval = batchInterval
+    self.coalesceSecs = coalesceSecs
+    self._callLater = callLater
+    self._seconds = seconds
+    # (prefix, suffix, recipients, when queued) for each queued message,
+    # where the XML to send to a recipient is prefix + recipient + suffix.
+    self._queue = collections.deque()
+    # text -> when it was last broadcast
+    self._recent = {}
+    self._drainCall = None
+    instruments.gauge('broadcast_pending_messages',
+        'Chat messages waiting to be sent.', func=self.pendingMessages)
 
   def sendAllSubscribers(self, text):
+    now = self._seconds()
+    for recentText, when in self._recent.items():
+      if now - when >= self.coalesceSecs:
+        del self._recent[recentText]
+    if text in self._recent:
+      log.msg('dropping duplicate broadcast: %s' % text)
+      _broadcastsCoalesced.inc()
+      return
+    self._recent[text] = now
+
+    _broadcasts.inc()
+    recipients = self.subscribers.keys()
     log.msg('broadcasting message to %d subscribers: %s' %
-        (len(self.subscribers), text))
-    for subscriber in self.subscribers.keys():
-      self.sendMessage(text, subscriber)
+        (len(recipients), text))
+    if not recipients:
+      return
+    prefix, suffix = self.messageTemplate(text)
+    self._queue.append((prefix, suffix, collections.deque(recipients), now))
+    if self._drainCall is None:
+      self._drainCall = self._callLater(0, self._drain)
+
+  def messageTemplate(self, text):
+    """Serialize a chat message with the recipient left out.
+
+    Returns:
+      (prefix, suffix) where prefix + escaped recipient + suffix is the
+      message XML.
+    """
+    msg = domish.Element((None, 'message'))
+    msg['to'] = _RECIPIENT_MARKER
+    msg['type'] = 'chat'
+    msg.addElement('body', content=text)
+    # The attributes come before the body, so the first marker is the one in
+    # the to attribute.
+    prefix, suffix = msg.toXml().split(_RECIPIENT_MARKER, 1)
+    return prefix, suffix
+
+  def pendingMessages(self):
+    """Number of messages waiting to be sent."""
+    return sum(len(recipients) for _, _, recipients, _ in self._queue)
+
+  def _drain(self):
+    self._drainCall = None
+    budget = self.batchSize
+    while self._queue and budget:
+      prefix, suffix, recipients, queued = self._queue[0]
+      while recipients and budget:
+        self.send(prefix + domish.escapeToXml(recipients.popleft(), 1) +
+            suffix)
+        budget -= 1
+      if not recipients:
+        self._queue.popleft()
+        _broadcastSeconds.observe(self._seconds() - queued)
+    _broadcastMessagesSent.inc(self.batchSize - budget)
+    if self._queue:
+      self._drainCall = self._callLater(self.batchInterval, self._drain)
 
 
 class ChatCommandReceiverProtocol(SendMessageMixin, xmppim.MessageProtocol):
   command_re = re.compile(r'(?P<command>\w+)\s*(?P<args>.*)')
+  args_re = re.compile(r'\s+')
 
   def __init__(self, statemach, subscribers, password):
+    """
+    Args:
+      statemach: statemach.StateMachine, or registry.DoorRegistry for
+          commands to take a door id.
+      subscribers: subscriberdb.SubscriberIndex (or a dict), shared with the
+          ChatBroadcastProtocol.
+      password: password users subscribe with.
+    """
     self.statemach = statemach
     self.subscribers = subscribers
     self.password = password
+    self.commands = self.buildCommands()
+
+  def buildCommands(self):
+    """
+    Returns:
+      commands.CommandTable of the commands this protocol understands.
+    """
+    table = commands.CommandTable()
+    table.add(commands.Command('help', self.command_help,
+        requiresAuth=False, aliases=('commands',)))
+    table.add(commands.Command('status', self.command_status,
+        parseArgs=commands.optionalArg, usage='[door]'))
+    table.add(commands.Command('snooze', self.command_snooze,
+        parseArgs=parseSnoozeArgs, usage='[minutes] [door]'))
+    table.add(commands.Command('close_door',
+        self.statemachCommand('command_close_door'),
+        parseArgs=commands.allArgs, usage='[door]', aliases=('close', 'shut')))
+    table.add(commands.Command('subscribe', self.command_subscribe,
+        requiresAuth=False, parseArgs=commands.optionalArg,
+        usage='<password>'))
+    table.add(commands.Command('unsubscribe', self.command_unsubscribe))
+    return table
 
   def connectionMade(self):
     # send initial presence
@@ -69,7 +201,7 @@ class ChatCommandReceiverProtocol(SendMessageMixin, xmppim.MessageProtocol):
       log.msg('dispatching command from %s: %s' % (address, msg.body))
       result = self.dispatchCommand(
           address, command_match.group(1),
-          re.split('\s+', command_match.group(2)))
+          self.args_re.split(command_match.group(2)))
     else:
       log.msg('Got bogus message: %s' % msg.body)
       result = 'what?'
@@ -80,12 +212,21 @@ class ChatCommandReceiverProtocol(SendMessageMixin, xmppim.MessageProtocol):
       log.msg('No reply to send.')
 
   def dispatchCommand(self, sender, cmd_str, cmd_args):
-    event_name = 'command_%s' % cmd_str.lower()
-    if hasattr(self, event_name):
-      log.msg('Calling %s(%s, %s) on self' % (event_name, sender, cmd_args))
-      return getattr(self, event_name)(sender, cmd_args)
+    cmd_str = cmd_str.lower()
+    command = self.commands.get(cmd_str)
+    if command is None:
+      return self.dispatchUnknownCommand(sender, 'command_%s' % cmd_str,
+          cmd_args)
+    if command.requiresAuth and not self.isSubscriber(sender):
+      msg = '%s is not subscribed' % sender
+      log.msg(msg)
+      return msg
+    log.msg('Calling %s(%s, %s)' % (command.name, sender, cmd_args))
+    return command(sender, cmd_args)
 
-    # XXX: duplicated message from requiresAuthorization
+  def dispatchUnknownCommand(self, sender, event_name, cmd_args):
+    """Pass commands that aren't in the table to the state machine, if it
+    handles them."""
     if not self.isSubscriber(sender):
       msg = 'not subscribed; send subscribe <password>'
       log.msg(msg)
@@ -98,8 +239,26 @@ class ChatCommandReceiverProtocol(SendMessageMixin, xmppim.MessageProtocol):
     log.msg('Bad command %s' % event_name)
     return 'bad command'
 
-  def command_subscribe(self, sender, cmd_args):
-    passwd = cmd_args[0] if cmd_args else None
+  def statemachCommand(self, event_name):
+    """Make a handler that fires event_name on the state machine."""
+    def handler(sender, args):
+      if not self.statemach.can(event_name):
+        log.msg('statemach cannot %s now' % event_name)
+        return 'bad command'
+      return getattr(self.statemach, event_name)(sender=sender, args=args)
+    return handler
+
+  def isSubscriber(self, user):
+    """Check if the user is subscribed.
+
+    Args:
+      user: xmpp user string
+    Returns:
+      boolean
+    """
+    return user in self.subscribers
+
+  def command_subscribe(self, sender, passwd):
     if not passwd:
       log.msg('subscription request lacks password')
       return 'usage: subscribe <password>'
@@ -111,43 +270,58 @@ class ChatCommandReceiverProtocol(SendMessageMixin, xmppim.MessageProtocol):
     log.msg(msg)
     return msg
 
-  def isSubscriber(self, user):
-    """Check if the user is subscribed.
-
-    Args:
-      user: xmpp user string
-    Returns:
-      boolean
-    """
-    # Note: have to use .keys() because dirdbm isn't a real dict
-    return user in self.subscribers.keys()
-
-  @requiresAuthorization
-  def command_unsubscribe(self, sender, cmd_args):
+  def command_unsubscribe(self, sender):
     del self.subscribers[str(sender)]
     msg = '%s unsubscribed' % sender
     log.msg(msg)
     return msg
 
-  @requiresAuthorization
-  def command_snooze(self, sender, cmd_args):
-    duration = None
-    if not cmd_args or not cmd_args[0]:
-      duration = DEFAULT_SNOOZE_DURATION
-    else:
-      try:
-        # Note that we use float(), which is handy for testing <1m intervals.
-        duration = float(cmd_args[0])
-      except ValueError:
-        return 'cannot parse "%s"' % cmd_args[0]
-    duration *= 60.0  # convert to minutes
+  def takesDoorIds(self):
+    """Whether the state machine is a DoorRegistry, which can pick a door."""
+    return hasattr(self.statemach, 'doorIds')
+
+  def noDoorIds(self, door_id):
+    msg = 'unknown door "%s" (there is only one door; leave out the door)' % (
+        door_id)
+    log.msg(msg)
+    return msg
+
+  def command_snooze(self, sender, duration, door_id=None):
+    if door_id:
+      if not self.takesDoorIds():
+        return self.noDoorIds(door_id)
+      log.msg('calling statemach.snoozeAlert(%d, %s)' % (duration, door_id))
+      return self.statemach.snoozeAlert(duration, doorId=door_id)
     log.msg('calling statemach.snoozeAlert(%d)' % duration)
     return self.statemach.snoozeAlert(duration)
 
-  @requiresAuthorization
-  def command_status(self, sender, cmd_args):
+  def command_status(self, sender, door_id=None):
     # TODO: timer stats, counts
+    if door_id:
+      if not self.takesDoorIds():
+        return self.noDoorIds(door_id)
+      return self.statemach.getState(doorId=door_id)
     return self.statemach.getState()
 
-  def command_help(self, sender, cmd_args):
-    return "commands: help, status, snooze, snooze <minutes>, close_door"
+  def command_help(self, sender):
+    return self.commands.helpText()
+
+
+def parseSnoozeArgs(args):
+  """
+  Args:
+    args: [minutes] [door]
+  Returns:
+    (seconds, door id or None)
+  """
+  if not args:
+    duration = DEFAULT_SNOOZE_DURATION
+  else:
+    try:
+      # Note that we use float(), which is handy for testing <1m intervals.
+      duration = float(args[0])
+    except ValueError:
+      raise commands.ArgumentError('cannot parse "%s"' % args[0])
+  duration *= 60.0  # convert to minutes
+  door_id = args[1] if len(args) > 1 else None
+  return duration, door_id
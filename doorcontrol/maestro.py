@@ -1,84 +1,413 @@
 """Garage door button presser.
 
-Requires a Pololu Micro Maestro set in "USB Dual Port" mode.
+Requires a Pololu Micro Maestro set in "USB Dual Port" mode. Commands use the
+Maestro's compact protocol over the command port, written through a Twisted
+SerialPort so nothing blocks the reactor. Queries return Deferreds.
+
+maestro_device = maestro.PololuMicroMaestro()
+maestro.MaestroService(maestro_device, '/dev/ttyACM0').setServiceParent(app)
+control = maestro.DoorControl(maestro_device)
+control.hitButton().addCallback(lambda moved: ...)
+
+Servo targets for each whole angle are computed once per channel. The button
+press can also run as a script on the Maestro (see buttonScript), so pressing
+the button is a single serial write and the Maestro does the timing.
 """
+import collections
 import serial
+from twisted.application import service
+from twisted.internet import defer
+from twisted.internet import protocol
 from twisted.internet import reactor
+from twisted.internet import serialport
+from twisted.python import failure
 from twisted.python import log
 
 PRESS_DURATION = .5
 IMPINGE_ANGLE = 0
 RETRACT_ANGLE = 90
+DEFAULT_PORT = '/dev/ttyACM0'
+# Servo channels on a Micro Maestro.
+CHANNELS = 6
+MAX_ANGLE = 180
+# How far off the button a servo can read back and still count as there, in
+# degrees.
+POSITION_TOLERANCE_ANGLE = 5
+# How long the Maestro gets to answer a query.
+RESPONSE_TIMEOUT_SECS = 1
+# How often to retry opening the serial port, e.g. while it's unplugged.
+REOPEN_SECS = 30
+
+# Compact protocol commands.
+SET_TARGET = 0x84
+GET_POSITION = 0x90
+GET_ERRORS = 0xA1
+GO_HOME = 0xA2
+STOP_SCRIPT = 0xA4
+RESTART_SCRIPT = 0xA7
+GET_SCRIPT_STATUS = 0xAE
+
+
+class MaestroError(Exception):
+  pass
+
+
+def angleToTarget(angle):
+  """Convert an angle to the servo target in "quarter microseconds", i.e., the
+  pulse width necessary to get to that angle (and thus it's between 1.0ms and
+  2.0ms in increments of 0.25us).  Whew!"""
+  minAngle = 0.0
+  maxAngle = float(MAX_ANGLE)
+  # these numbers, in quarter microseconds, taken from the code here:
+  # http://forum.pololu.com/viewtopic.php?t=2380#p10697
+  minTarget = 256.0
+  maxTarget = 13120.0
+  return int((angle / ((maxAngle - minAngle) / (maxTarget - minTarget))) +
+      minTarget)
+
+
+def encodeTarget(target):
+  """The two 7-bit bytes of a target, low bits first."""
+  return chr(target & 0x7F) + chr((target >> 7) & 0x7F)
+
+
+def _decodeWord(data):
+  """Maestro responses are little-endian 16-bit words."""
+  return ord(data[0]) | (ord(data[1]) << 8)
+
+
+def _decodeScriptRunning(data):
+  return data == '\x00'
+
+
+class TargetTable(object):
+  """Encoded targets and Set Target commands for one channel, for each whole
+  angle."""
+
+  def __init__(self, channel):
+    self.channel = channel
+    self._targets = [encodeTarget(angleToTarget(angle))
+        for angle in range(MAX_ANGLE + 1)]
+    self._commands = [chr(SET_TARGET) + chr(channel) + target
+        for target in self._targets]
+
+  def target(self, angle):
+    """
+    Returns:
+      the encoded target for angle.
+    """
+    if angle == int(angle) and 0 <= angle <= MAX_ANGLE:
+      return self._targets[int(angle)]
+    return encodeTarget(angleToTarget(angle))
+
+  def command(self, angle):
+    """
+    Returns:
+      the Set Target command for angle.
+    """
+    if angle == int(angle) and 0 <= angle <= MAX_ANGLE:
+      return self._commands[int(angle)]
+    return chr(SET_TARGET) + chr(self.channel) + self.target(angle)
+
+
+class PololuMicroMaestro(protocol.Protocol):
+  """http://afflator.ontopoeticmachines.org/post/9
+
+  Commands are queued in the transport and written when the port is
+  writable. Each query's response is matched to it in order.
+  """
+
+  def __init__(self, responseTimeout=RESPONSE_TIMEOUT_SECS, channels=CHANNELS,
+      reactor=reactor):
+    """
+    Constructor.
+
+    Args:
+      responseTimeout: seconds to wait for the answer to a query.
+      channels: number of servo channels.
+      reactor: reactor for testing.
+    """
+    self._responseTimeout = responseTimeout
+    self._tables = [TargetTable(channel) for channel in range(channels)]
+    self._reactor = reactor
+    # (response size, decoder, Deferred, timeout call) for each query in
+    # flight.
+    self._pending = collections.deque()
+    self._buffer = ''
+    # Called with the reason when the port closes.
+    self.onConnectionLost = None
+
+  def connectionMade(self):
+    log.msg('connected to the maestro')
+    self._buffer = ''
+
+  def dataReceived(self, data):
+    self._buffer += data
+    while self._pending and len(self._buffer) >= self._pending[0][0]:
+      size, decode, d, timeoutCall = self._pending.popleft()
+      response, self._buffer = self._buffer[:size], self._buffer[size:]
+      timeoutCall.cancel()
+      d.callback(decode(response))
+    if not self._pending and self._buffer:
+      log.msg('ignoring unexpected data from the maestro: %r' % self._buffer)
+      self._buffer = ''
+
+  def connectionLost(self, reason):
+    log.msg('lost connection to the maestro: %s' % reason.getErrorMessage())
+    self.transport = None
+    self._failPending(MaestroError('connection lost'))
+    if self.onConnectionLost:
+      self.onConnectionLost(reason)
 
+  def _failPending(self, error):
+    pending, self._pending = self._pending, collections.deque()
+    self._buffer = ''
+    for size, decode, d, timeoutCall in pending:
+      if timeoutCall.active():
+        timeoutCall.cancel()
+      d.errback(error)
 
-class PololuMicroMaestro(object):
-  """http://afflator.ontopoeticmachines.org/post/9"""
-  def __init__(self, port='/dev/ttyACM0'):
-      self.ser = serial.Serial(port=port)
+  def _timedOut(self):
+    # Responses are matched by order, so after a lost one nothing in flight
+    # can be trusted.
+    self._failPending(MaestroError('no response from the maestro'))
+
+  def _send(self, command):
+    if self.transport is None:
+      log.msg('maestro not connected, dropping command %r' % command)
+      return False
+    self.transport.write(command)
+    return True
+
+  def _query(self, command, size=2, decode=_decodeWord):
+    if not self._send(command):
+      return defer.fail(MaestroError('not connected'))
+    d = defer.Deferred()
+    timeoutCall = self._reactor.callLater(self._responseTimeout,
+        self._timedOut)
+    self._pending.append((size, decode, d, timeoutCall))
+    return d
 
   def setAngle(self, angle, channel=0):
-    """Set the target angle of the servo.  This is converted into "quarter
-    microseconds", i.e., the pulse width necessary to get to that angle (and
-    thus it's between 1.0ms and 2.0ms in increments of 0.25us).  Whew!"""
+    """Set the target angle of the servo."""
     log.msg('SetAngle(%s)' % angle)
-    minAngle = 0.0
-    maxAngle = 180.0
-    # these numbers, in quarter microseconds, taken from the code here:
-    # http://forum.pololu.com/viewtopic.php?t=2380#p10697
-    minTarget = 256.0
-    maxTarget = 13120.0
-    scaledValue = int((angle / ((maxAngle - minAngle) / (maxTarget - minTarget))) + minTarget)
-    commandByte = chr(0x84)
-    channelByte = chr(channel)
-    lowTargetByte = chr(scaledValue & 0x7F)
-    highTargetByte = chr((scaledValue >> 7) & 0x7F)
-    command = commandByte + channelByte + lowTargetByte + highTargetByte
-    self.ser.write(command)
-    self.ser.flush()
+    self._send(self._tables[channel].command(angle))
 
   def goHome(self):
     """Set all servos to home position."""
     log.msg('GoHome()')
-    self.ser.write(chr(0xA2))
+    self._send(chr(GO_HOME))
+
+  def getPosition(self, channel=0):
+    """
+    Returns:
+      Deferred that fires with the pulse width the servo is being sent, in
+      quarter microseconds.
+    """
+    return self._query(chr(GET_POSITION) + chr(channel))
+
+  def getErrors(self):
+    """Get and clear the Maestro's error bits.
+
+    Returns:
+      Deferred that fires with the error bits as an int.
+    """
+    return self._query(chr(GET_ERRORS))
+
+  def restartScript(self, subroutine):
+    """Run a subroutine of the script loaded on the Maestro."""
+    log.msg('RestartScript(%d)' % subroutine)
+    self._send(chr(RESTART_SCRIPT) + chr(subroutine))
+
+  def stopScript(self):
+    self._send(chr(STOP_SCRIPT))
+
+  def isScriptRunning(self):
+    """
+    Returns:
+      Deferred that fires with whether the Maestro's script is running.
+    """
+    return self._query(chr(GET_SCRIPT_STATUS), 1, _decodeScriptRunning)
+
+
+class MaestroService(service.Service):
+  """Keeps the Maestro's serial port open while the service runs."""
+
+  def __init__(self, maestro, port=DEFAULT_PORT, reopenSecs=REOPEN_SECS,
+      reactor=reactor):
+    """
+    Constructor.
+
+    Args:
+      maestro: PololuMicroMaestro to connect.
+      port: serial device of the Maestro's command port.
+      reopenSecs: seconds between attempts to open the port.
+      reactor: reactor for testing.
+    """
+    self._maestro = maestro
+    self._portName = port
+    self._reopenSecs = reopenSecs
+    self._reactor = reactor
+    self._port = None
+    self._reopenCall = None
+    self._closed = None
+    maestro.onConnectionLost = self._connectionLost
+
+  def startService(self):
+    service.Service.startService(self)
+    self._open()
 
-  def close(self):
-    self.ser.close()
+  def stopService(self):
+    service.Service.stopService(self)
+    if self._reopenCall:
+      self._reopenCall.cancel()
+      self._reopenCall = None
+    if self._port is None:
+      return defer.succeed(None)
+    self._closed = defer.Deferred()
+    self._port.loseConnection()
+    return self._closed
 
-  def __del__(self):
-    self.close()
+  def _open(self):
+    self._reopenCall = None
+    try:
+      self._port = serialport.SerialPort(self._maestro, self._portName,
+          self._reactor)
+    except (serial.SerialException, EnvironmentError) as e:
+      log.msg('failed to open %s: %s' % (self._portName, e))
+      self._reopenCall = self._reactor.callLater(self._reopenSecs, self._open)
+
+  def _connectionLost(self, reason):
+    self._port = None
+    if self.running:
+      self._reopenCall = self._reactor.callLater(self._reopenSecs, self._open)
+    elif self._closed:
+      closed, self._closed = self._closed, None
+      closed.callback(None)
+
+
+def buttonScript(impingeAngle=IMPINGE_ANGLE, retractAngle=RETRACT_ANGLE,
+    pressDuration=PRESS_DURATION, channel=0):
+  """Maestro script that presses the button the way DoorControl does.
+
+  The command port can only run a loaded script, not upload one: load it
+  with the Maestro Control Center or "UscCmd --script <file>", then give
+  DoorControl scriptSubroutine=0.
+
+  Returns:
+    the script, as a string.
+  """
+  delay = int(pressDuration * 1000)
+  return '\n'.join([
+      '# gdoormon button press, generated by "python doorcontrol/maestro.py".',
+      '# Load it with the Maestro Control Center or UscCmd --script.',
+      'quit',
+      '',
+      '# Subroutine 0.',
+      'sub press_button',
+      '  %d %d servo  # impinge' % (angleToTarget(impingeAngle), channel),
+      '  %d delay' % delay,
+      '  %d %d servo  # retract' % (angleToTarget(retractAngle), channel),
+      '  %d delay' % delay,
+      '  0 %d servo  # idle' % channel,
+      '  quit',
+      ''])
 
 
 class DoorControl(object):
   def __init__(self, p, pressDuration=PRESS_DURATION, callLater=reactor.callLater,
-      impingeAngle=IMPINGE_ANGLE, retractAngle=RETRACT_ANGLE):
+      impingeAngle=IMPINGE_ANGLE, retractAngle=RETRACT_ANGLE,
+      scriptSubroutine=None):
+    """
+    Constructor.
+
+    Args:
+      p: PololuMicroMaestro
+      pressDuration: seconds to hold the button, and to wait after retracting.
+      callLater: reactor.callLater callback for testing.
+      impingeAngle: servo angle that presses the button.
+      retractAngle: servo angle clear of the button.
+      scriptSubroutine: subroutine of the Maestro's script (see buttonScript)
+          to press the button with, or None to time the press from here.
+    """
     self._p = p
     self._pressDuration = pressDuration
     self._callLater = callLater
     self._impingeAngle = impingeAngle
     self._retractAngle = retractAngle
+    self._scriptSubroutine = scriptSubroutine
 
   def _impinge(self):
     log.msg('impinge ->')
     self._p.setAngle(self._impingeAngle)
 
-  def _retract(self):
+  def _retract(self, pressed):
+    # Check the servo got to the button before pulling it back.
+    reached = self._p.getPosition()
     log.msg('<- retract')
     self._p.setAngle(self._retractAngle)
-    self._callLater(self._pressDuration, self._idle)
-  
-  def _idle(self):
+    reached.addCallback(self._checkPosition)
+    reached.addErrback(self._positionFailed)
+    self._callLater(self._pressDuration, self._idle, reached, pressed)
+
+  def _near(self, position, angle):
+    tolerance = angleToTarget(POSITION_TOLERANCE_ANGLE) - angleToTarget(0)
+    return abs(position - angleToTarget(angle)) <= tolerance
+
+  def _checkPosition(self, position):
+    # 0 means the channel is off.
+    if position and self._near(position, self._impingeAngle):
+      return True
+    d = self._p.getErrors()
+    d.addBoth(self._checkMismatch, position)
+    return d
+
+  def _checkMismatch(self, errors, position):
+    # The Maestro clamps targets to the channel's range and ramps to them at
+    # the channel's speed and acceleration, so a press that worked can read
+    # back short of the button. It only failed if the servo never left the
+    # retracted (or idle) position, or the Maestro is in trouble.
+    if (isinstance(errors, failure.Failure) or errors or position == 0 or
+        self._near(position, self._retractAngle)):
+      log.msg('servo did not reach the button: position %s, errors %s' % (
+          position, errors))
+      return False
+    log.msg('servo short of the button, likely clamped or still moving: '
+        'position %s' % position)
+    return True
+
+  def _positionFailed(self, failure):
+    log.msg('failed to get the servo position: %s' % failure.getErrorMessage())
+    return False
+
+  def _idle(self, reached, pressed):
     log.msg('idle')
     self._p.goHome()
+    reached.chainDeferred(pressed)
 
   def hitButton(self):
+    """
+    Returns:
+      Deferred that fires with whether the servo reached the button, once the
+      press is over.
+    """
+    pressed = defer.Deferred()
+    if self._scriptSubroutine is not None:
+      self._p.restartScript(self._scriptSubroutine)
+      # Check on the servo halfway through the press.
+      self._callLater(self._pressDuration / 2.0, self._checkScriptPress,
+          pressed)
+      return pressed
     self._impinge()
-    self._callLater(self._pressDuration, self._retract)
+    self._callLater(self._pressDuration, self._retract, pressed)
+    return pressed
+
+  def _checkScriptPress(self, pressed):
+    reached = self._p.getPosition()
+    reached.addCallback(self._checkPosition)
+    reached.addErrback(self._positionFailed)
+    reached.chainDeferred(pressed)
 
 
-#if __name__ == '__main__':
-#  import time
-#  p = PololuMicroMaestro()
-#  dc = DoorControl(p)
-#  while True:
-#    dc.HitButton()
-#    time.sleep(1)
+if __name__ == '__main__':
+  print buttonScript(),
@@ -1,25 +1,210 @@
 #!/usr/bin/trial
 
+from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.internet import task
 from twisted.trial import unittest
 import maestro
 import mox
 import time
+from testing import fake_maestro
 
 class DoorControlTest(unittest.TestCase):
   def setUp(self):
     self.m = mox.Mox()
-    self.mock_micro_maestro = self.m.CreateMock(maestro.PololuMicroMaestro)
+    self.mock_micro_maestro = self.m.CreateMockAnything()
     self.clock = task.Clock()
     self.control = maestro.DoorControl(
         self.mock_micro_maestro, callLater=self.clock.callLater)
 
   def testHitButton(self):
     self.mock_micro_maestro.setAngle(maestro.IMPINGE_ANGLE)
+    self.mock_micro_maestro.getPosition().AndReturn(
+        defer.succeed(maestro.angleToTarget(maestro.IMPINGE_ANGLE)))
     self.mock_micro_maestro.setAngle(maestro.RETRACT_ANGLE)
     self.mock_micro_maestro.goHome()
     self.m.ReplayAll()
-    self.control.hitButton()
+    pressed = []
+    self.control.hitButton().addCallback(pressed.append)
     self.clock.advance(1)
     self.clock.advance(1)
     self.m.VerifyAll()
+    self.assertEquals([True], pressed)
+
+  def testHitButtonStuck(self):
+    self.mock_micro_maestro.setAngle(maestro.IMPINGE_ANGLE)
+    self.mock_micro_maestro.getPosition().AndReturn(
+        defer.succeed(maestro.angleToTarget(maestro.RETRACT_ANGLE)))
+    self.mock_micro_maestro.setAngle(maestro.RETRACT_ANGLE)
+    self.mock_micro_maestro.getErrors().AndReturn(defer.succeed(0))
+    self.mock_micro_maestro.goHome()
+    self.m.ReplayAll()
+    pressed = []
+    self.control.hitButton().addCallback(pressed.append)
+    self.clock.advance(1)
+    self.clock.advance(1)
+    self.m.VerifyAll()
+    self.assertEquals([False], pressed)
+
+  def testHitButtonNearTarget(self):
+    self.mock_micro_maestro.setAngle(maestro.IMPINGE_ANGLE)
+    self.mock_micro_maestro.getPosition().AndReturn(
+        defer.succeed(maestro.angleToTarget(maestro.IMPINGE_ANGLE + 2)))
+    self.mock_micro_maestro.setAngle(maestro.RETRACT_ANGLE)
+    self.mock_micro_maestro.goHome()
+    self.m.ReplayAll()
+    pressed = []
+    self.control.hitButton().addCallback(pressed.append)
+    self.clock.pump([1, 1])
+    self.m.VerifyAll()
+    self.assertEquals([True], pressed)
+
+  def testHitButtonClamped(self):
+    # The channel's range stops the servo short of 0 degrees, e.g. at 1ms.
+    self.mock_micro_maestro.setAngle(maestro.IMPINGE_ANGLE)
+    self.mock_micro_maestro.getPosition().AndReturn(defer.succeed(4000))
+    self.mock_micro_maestro.setAngle(maestro.RETRACT_ANGLE)
+    self.mock_micro_maestro.getErrors().AndReturn(defer.succeed(0))
+    self.mock_micro_maestro.goHome()
+    self.m.ReplayAll()
+    pressed = []
+    self.control.hitButton().addCallback(pressed.append)
+    self.clock.pump([1, 1])
+    self.m.VerifyAll()
+    self.assertEquals([True], pressed)
+
+  def testHitButtonNoResponse(self):
+    self.mock_micro_maestro.setAngle(maestro.IMPINGE_ANGLE)
+    self.mock_micro_maestro.getPosition().AndReturn(
+        defer.fail(maestro.MaestroError('not connected')))
+    self.mock_micro_maestro.setAngle(maestro.RETRACT_ANGLE)
+    self.mock_micro_maestro.goHome()
+    self.m.ReplayAll()
+    pressed = []
+    self.control.hitButton().addCallback(pressed.append)
+    self.clock.advance(1)
+    self.clock.advance(1)
+    self.m.VerifyAll()
+    self.assertEquals([False], pressed)
+
+  def testHitButtonWithScript(self):
+    control = maestro.DoorControl(self.mock_micro_maestro,
+        callLater=self.clock.callLater, scriptSubroutine=0)
+    self.mock_micro_maestro.restartScript(0)
+    self.mock_micro_maestro.getPosition().AndReturn(
+        defer.succeed(maestro.angleToTarget(maestro.IMPINGE_ANGLE)))
+    self.m.ReplayAll()
+    pressed = []
+    control.hitButton().addCallback(pressed.append)
+    self.clock.advance(maestro.PRESS_DURATION)
+    self.m.VerifyAll()
+    self.assertEquals([True], pressed)
+
+
+class TargetTableTest(unittest.TestCase):
+  def testCommand(self):
+    table = maestro.TargetTable(1)
+    # 6688 quarter microseconds.
+    self.assertEquals('\x84\x01\x20\x34', table.command(90))
+    self.assertEquals('\x20\x34', table.target(90))
+
+  def testUncommonAngles(self):
+    table = maestro.TargetTable(0)
+    for angle in (0, 45.0, 45.5, 180, 181):
+      self.assertEquals(chr(maestro.SET_TARGET) + '\x00' +
+          maestro.encodeTarget(maestro.angleToTarget(angle)),
+          table.command(angle))
+
+
+class PololuMicroMaestroTest(unittest.TestCase):
+  def setUp(self):
+    self.fake = fake_maestro.FakeMaestro()
+    self.device = maestro.PololuMicroMaestro(responseTimeout=0.5)
+    self.service = maestro.MaestroService(self.device, self.fake.portName)
+    self.service.startService()
+
+  @defer.inlineCallbacks
+  def tearDown(self):
+    yield self.service.stopService()
+    self.fake.close()
+
+  @defer.inlineCallbacks
+  def testSetAngle(self):
+    self.device.setAngle(90, channel=1)
+    position = yield self.device.getPosition(1)
+    self.assertEquals(maestro.angleToTarget(90), position)
+    self.assertEquals((maestro.SET_TARGET, [1, 0x20, 0x34]),
+        self.fake.commands[0])
+
+  @defer.inlineCallbacks
+  def testGoHome(self):
+    self.device.setAngle(90)
+    self.device.goHome()
+    position = yield self.device.getPosition()
+    self.assertEquals(0, position)
+
+  @defer.inlineCallbacks
+  def testGetErrors(self):
+    self.fake.errors = 0x10
+    errors = yield self.device.getErrors()
+    self.assertEquals(0x10, errors)
+    errors = yield self.device.getErrors()
+    self.assertEquals(0, errors)
+
+  @defer.inlineCallbacks
+  def testResponsesMatchQueries(self):
+    self.device.setAngle(0, channel=0)
+    self.device.setAngle(180, channel=2)
+    self.fake.errors = 0x01
+    results = yield defer.gatherResults([self.device.getPosition(0),
+        self.device.getErrors(), self.device.getPosition(2)])
+    self.assertEquals([maestro.angleToTarget(0), 0x01,
+        maestro.angleToTarget(180)], results)
+
+  def testNoResponse(self):
+    self.fake.silent = True
+    return self.assertFailure(self.device.getPosition(), maestro.MaestroError)
+
+  @defer.inlineCallbacks
+  def testHitButton(self):
+    control = maestro.DoorControl(self.device, pressDuration=0.01)
+    pressed = yield control.hitButton()
+    self.assertTrue(pressed)
+    self.fake.stuck = True
+    pressed = yield control.hitButton()
+    self.assertFalse(pressed)
+
+  @defer.inlineCallbacks
+  def testHitButtonWithScript(self):
+    self.fake.loadScript(maestro.buttonScript(pressDuration=0.05))
+    control = maestro.DoorControl(self.device, pressDuration=0.05,
+        scriptSubroutine=0)
+    pressed = yield control.hitButton()
+    self.assertTrue(pressed)
+    # One write starts the press.
+    self.assertEquals([maestro.RESTART_SCRIPT, maestro.GET_POSITION],
+        [command for command, args in self.fake.commands])
+    running = yield self.device.isScriptRunning()
+    self.assertTrue(running)
+    yield task.deferLater(reactor, 0.1, lambda: None)
+    running = yield self.device.isScriptRunning()
+    self.assertFalse(running)
+    self.assertEquals([0] * fake_maestro.CHANNELS, self.fake.positions)
+
+
+class MaestroServiceTest(unittest.TestCase):
+  def testNotConnected(self):
+    device = maestro.PololuMicroMaestro()
+    return self.assertFailure(device.getPosition(), maestro.MaestroError)
+
+  def testReopen(self):
+    clock = task.Clock()
+    device = maestro.PololuMicroMaestro(reactor=clock)
+    service = maestro.MaestroService(device, '/nonexistent/ttyACM0',
+        reopenSecs=5, reactor=clock)
+    service.startService()
+    self.assertEquals(1, len(clock.getDelayedCalls()))
+    clock.advance(5)
+    self.assertEquals(1, len(clock.getDelayedCalls()))
+    service.stopService()
+    self.assertEquals([], clock.getDelayedCalls())
@@ -3,98 +3,346 @@ Polls the Arduino sensor server for the status of the door.
 
 toggle = arduino_client.StatemachToggle(statemach)
 monitor = arduino_client.DoorSensor(toggle, hostname, port, threshold)
-pressence_service = internet.TimerService(15, monitor.check)
+sensor_service = poller.AdaptivePoller(monitor.check, FAST_POLLING_SECS, 5,
+    MAX_POLLING_SECS)
+
+Every DoorSensor in the process shares one pool of persistent connections, so
+polling reuses a kept-alive connection instead of doing a TCP handshake (and a
+DNS lookup) every time.
+
+The sensor can also push readings as they change (see push_server). While it
+does, polling is skipped and only resumes if the pushes stop for
+pushLivenessSecs.
+
+The sensor sends a burst of readings per request. They're run through a
+median and hysteresis filter, and the filtered door state is passed to the
+toggle, which only drives the state machine when it changes.
 """
 
 ARDUINO_HOSTNAME = 'arduino-gdoor'
 ARDUINO_PORT = 80
 THRESHOLD_CM = 10   # anything over 10cm is "open"
 REQUEST_PATH = '/'
+# Give up on a poll (resolve, connect and response) after this long.
+REQUEST_TIMEOUT_SECS = 10
+# The Arduino's ethernet shield only has 4 sockets, so don't hog them.
+MAX_PERSISTENT_PER_HOST = 1
+CACHED_CONNECTION_TIMEOUT_SECS = 60
+# Decide on the median of this many readings (the sketch sends a burst of 5).
+FILTER_WINDOW = 5
+# The median has to be this far past the threshold to change the decision.
+HYSTERESIS_CM = 2
+# Poll this often while the door is open, alerting, closing or stuck, and
+# back off to this often while it's quiet (see state.poller).
+FAST_POLLING_SECS = 1
+MAX_POLLING_SECS = 60
+
+import collections
 
+from logs import logger
+from metrics import instruments
+from twisted.internet import defer
 from twisted.internet import reactor
-from twisted.python import log
 from twisted.web import client
 from twisted.web import http
+from twisted.web import http_headers
 from twisted.internet import protocol
+from state import toggle
+
+_log = logger.Logger('arduino')
 
 
 # Stop the log spam.
 client._HTTP11ClientFactory.noisy = False
 
+_pools = {}
+
+def getConnectionPool(reactor=reactor):
+  """Returns the process-wide pool of persistent connections to the sensors."""
+  if reactor not in _pools:
+    pool = client.HTTPConnectionPool(reactor, persistent=True)
+    pool.maxPersistentPerHost = MAX_PERSISTENT_PER_HOST
+    pool.cachedConnectionTimeout = CACHED_CONNECTION_TIMEOUT_SECS
+    _pools[reactor] = pool
+  return _pools[reactor]
+
 
 class DoorSensor(object):
   def __init__(self, toggle, hostname=ARDUINO_HOSTNAME, port=ARDUINO_PORT,
-      threshold=THRESHOLD_CM, requestPath=REQUEST_PATH):
+      threshold=THRESHOLD_CM, requestPath=REQUEST_PATH,
+      filterWindow=FILTER_WINDOW, hysteresis=HYSTERESIS_CM,
+      timeout=REQUEST_TIMEOUT_SECS, pushLivenessSecs=None, pool=None,
+      reactor=reactor):
+    """
+    Constructor.
+
+    Args:
+      toggle: called with True if the door is open, False if it's closed.
+      hostname: host to connect to
+      port: port to connect to
+      threshold: distance to the door
+      requestPath: path to request
+      filterWindow: number of readings to take the median of.
+      hysteresis: cm past the threshold needed to change the door state.
+      timeout: seconds to wait for a poll to complete.
+      pushLivenessSecs: skip polls while the sensor has pushed readings
+          within this many seconds. None to always poll.
+      pool: HTTPConnectionPool, defaults to the process-wide pool.
+      reactor: reactor for testing.
+    """
     self.toggle = toggle
     self.hostname = hostname
-    self.port = port
+    self.port = int(port)
     self.threshold = int(threshold)
     self.requestPath = requestPath
+    self.filter = DistanceFilter(threshold, filterWindow, hysteresis)
+    self.timeout = timeout
+    self._reactor = reactor
+    if pool is None:
+      pool = getConnectionPool(reactor)
+    self._agent = client.Agent(reactor, connectTimeout=timeout, pool=pool)
+    if self.port == ARDUINO_PORT:
+      host = self.hostname
+    else:
+      host = '%s:%d' % (self.hostname, self.port)
+    self._headers = http_headers.Headers({'Host': [host]})
+    # Resolved address of hostname; cleared when a poll fails so the next
+    # poll looks it up again.
+    self._address = None
+    self._outstanding = False
+    self.pushLivenessSecs = pushLivenessSecs
+    self._lastPush = None
+    # Every poll reads the door, but it rarely changes.
+    self._changeLog = logger.ChangeLog(_log, seconds=self._reactor.seconds)
+    labels = {'host': hostname}
+    self._pollSeconds = instruments.histogram('door_sensor_poll_seconds',
+        'Round trip time of door sensor polls.', labels)
+    self._pollFailures = instruments.counter(
+        'door_sensor_poll_failures_total', 'Door sensor polls that failed.',
+        labels)
+    self._pollsSkipped = instruments.counter('door_sensor_polls_skipped_total',
+        'Door sensor polls skipped while the last was outstanding.', labels)
+    self._pushes = instruments.counter('door_sensor_pushes_total',
+        'Readings pushed by the door sensor.', labels)
 
   def check(self):
     """Check if the door is open by making an HTTP request to the Arduino.
 
-    Args:
-      hostname: host to connect to
-      port: port to connect to
-      threshold: distance to the door
+    The poll is skipped if the previous one is still outstanding, or if the
+    sensor is pushing readings.
 
     Returns:
-      boolean - door is open or not
+      Deferred that fires when the response has been handled, with whether
+      the door is open (after filtering), or None if the poll failed. None
+      instead of a Deferred if the poll was skipped.
     """
-    log.msg('Polling %s for distance.' % self.hostname)
-    agent = client.Agent(reactor)
-    d = agent.request('GET', 'http://%s%s' % (self.hostname, self.requestPath))
+    if self.isPushing():
+      return None
+    if self._outstanding:
+      self._pollsSkipped.inc()
+      _log.info('Still waiting for %(host)s, skipping poll.',
+          host=self.hostname)
+      return None
+    _log.debug('Polling %(host)s for distance.', host=self.hostname)
+    self._outstanding = True
+    d = self._resolve()
+    # Cancelling d cancels whichever step it's waiting on.
+    timeoutCall = self._reactor.callLater(self.timeout, d.cancel)
+    d.addCallback(self._request)
     d.addCallback(self._handleResponse)
+    d.addCallback(lambda _: self.filter.doorOpen)
     d.addErrback(self._handleError)
+    d.addBoth(self._finished, timeoutCall, self._reactor.seconds())
+    return d
+
+  def isPushing(self):
+    """Whether the sensor pushed readings within pushLivenessSecs."""
+    return (self.pushLivenessSecs is not None and self._lastPush is not None
+        and self._reactor.seconds() - self._lastPush < self.pushLivenessSecs)
+
+  def pushReadings(self, readings):
+    """Handle readings pushed by the sensor (see push_server).
+
+    Args:
+      readings: list of distances, oldest first.
+    """
+    self._lastPush = self._reactor.seconds()
+    self._pushes.inc()
+    self._handleReadings(readings)
+
+  def _resolve(self):
+    if self._address is not None:
+      return defer.succeed(self._address)
+    d = self._reactor.resolve(self.hostname)
+    d.addCallback(self._cacheAddress)
+    return d
+
+  def _cacheAddress(self, address):
+    self._address = address
+    return address
+
+  def _request(self, address):
+    url = 'http://%s:%d%s' % (address, self.port, self.requestPath)
+    return self._agent.request('GET', url, self._headers.copy())
 
   def _handleResponse(self, response):
-    response.deliverBody(DoorMeasurementProtocol(self.toggle, self.threshold))
+    finished = defer.Deferred(
+        lambda _: bodyProtocol.transport.stopProducing())
+    bodyProtocol = DoorMeasurementProtocol(self._handleReadings, finished)
+    response.deliverBody(bodyProtocol)
+    return finished
+
+  def _handleReadings(self, readings):
+    """Feed the readings to the filter, and pass the result to the toggle."""
+    doorOpen = self.filter.add(readings)
+    if doorOpen is None:
+      _log.warning('No readings from %(host)s.', host=self.hostname)
+      return
+    self._changeLog.report(doorOpen, 'Door is %(state)s: '
+        'threshold=%(threshold)s, read from server: %(readings)s, '
+        'median=%(median)s.',
+        state='open' if doorOpen else 'closed', threshold=self.threshold,
+        readings=readings, median=self.filter.median())
+    self.toggle(doorOpen)
 
   def _handleError(self, response):
-    log.msg('Got: %s' % response)
+    _log.warning('Polling %(host)s failed: %(reason)s', host=self.hostname,
+        reason=response)
+    self._pollFailures.inc()
+    self._address = None
+
+  def _finished(self, result, timeoutCall, start):
+    self._outstanding = False
+    self._pollSeconds.observe(self._reactor.seconds() - start)
+    if timeoutCall.active():
+      timeoutCall.cancel()
+    return result
+
+
+def parseReadings(body):
+  """Parse whitespace separated distances, skipping anything that isn't one.
+
+  Returns:
+    list of ints
+  """
+  readings = []
+  for token in body.split():
+    try:
+      readings.append(int(token))
+    except ValueError:
+      _log.warning('Bad data from the server: %(token)r', token=token)
+  return readings
+
+
+class DistanceFilter(object):
+  """Decides if the door is open from a window of distance readings.
+
+  The median of the last few readings has to cross the threshold by more than
+  the hysteresis before the decision changes, so a single bad echo (or a
+  reading hovering around the threshold) doesn't flap the door state.
+
+  doorFilter = DistanceFilter(threshold=10, window=5, hysteresis=2)
+  doorOpen = doorFilter.add([9, 11, 250, 10, 9])
+  """
+
+  def __init__(self, threshold=THRESHOLD_CM, window=FILTER_WINDOW,
+      hysteresis=HYSTERESIS_CM):
+    """
+    Constructor.
+
+    Args:
+      threshold: distance over which the door is open.
+      window: number of most recent readings to take the median of.
+      hysteresis: cm the median has to move past the threshold to change the
+          decision.
+    """
+    self.threshold = int(threshold)
+    self.hysteresis = int(hysteresis)
+    self._readings = collections.deque(maxlen=int(window))
+    # None until the first reading.
+    self.doorOpen = None
+
+  def median(self):
+    readings = sorted(self._readings)
+    return readings[len(readings) // 2]
+
+  def add(self, readings):
+    """Add readings, oldest first.
+
+    Returns:
+      boolean - door is open or not, or None if there are no readings yet.
+    """
+    self._readings.extend(readings)
+    if not self._readings:
+      return self.doorOpen
+    median = self.median()
+    if self.doorOpen is None:
+      self.doorOpen = median > self.threshold
+    elif self.doorOpen:
+      self.doorOpen = median > self.threshold - self.hysteresis
+    else:
+      self.doorOpen = median > self.threshold + self.hysteresis
+    return self.doorOpen
 
 
 class DoorMeasurementProtocol(protocol.Protocol):
+  """Buffers the response body, which is one or more whitespace separated
+  distances, and passes them on when it's done."""
 
-  def __init__(self, toggle, threshold):
-    self.toggle = toggle
-    self.threshold = threshold
+  def __init__(self, handleReadings, finished=None):
+    """
+    Constructor.
+
+    Args:
+      handleReadings: called with the list of distances read.
+      finished: optional Deferred to fire when the body is done, or errback
+          if the response was lost.
+    """
+    self.handleReadings = handleReadings
+    self.finished = finished
+    self._chunks = []
 
   def dataReceived(self, data):
-    msg = 'threshold=%s, read from server: %s' % (self.threshold, data)
-    try:
-      try:
-        distance = int(data)
-        if distance > self.threshold:
-          log.msg('Door is open: %s.' % msg)
-          self.toggle(True)
-        else:
-          log.msg('Door is closed: %s.' % msg)
-          self.toggle(False)
-      except ValueError as e:
-        log.msg('Bad data from the server: %s' % repr(data))
-    except Exception as e:
-      import traceback
-      log.msg('caught: %s' % traceback.format_exc(e))
+    self._chunks.append(data)
+
+  def parseReadings(self):
+    return parseReadings(''.join(self._chunks))
 
   def connectionLost(self, reason):
-    if not isinstance(reason, client.ResponseDone):
-      if reason.check(http.PotentialDataLoss):
-        # Since the server is an HTTP 1.0 server, we always ignore
-        # http.PotentialDataLoss
-        pass
-      else:
-        # TODO: make this a state change
-        log.msg('failure: %s' % reason)
-
-
-class StatemachToggle(object):
-  def __init__(self, statemach):
+    # finished has already failed if the poll timed out.
+    if self.finished is not None and self.finished.called:
+      return
+    # An HTTP 1.0 server closes the connection instead of sending a length, so
+    # http.PotentialDataLoss is expected from it.
+    if reason.check(client.ResponseDone, http.PotentialDataLoss):
+      try:
+        self.handleReadings(self.parseReadings())
+      except Exception as e:
+        import traceback
+        _log.error('caught: %(traceback)s', traceback=traceback.format_exc(e))
+      if self.finished is not None:
+        self.finished.callback(None)
+    elif self.finished is not None:
+      self.finished.errback(reason)
+    else:
+      # TODO: make this a state change
+      _log.error('failure: %(reason)s', reason=reason)
+
+
+class StatemachToggle(toggle.EdgeTriggeredToggle):
+  def __init__(self, statemach, resyncSecs=None, seconds=reactor.seconds):
+    toggle.EdgeTriggeredToggle.__init__(self, resyncSecs, seconds)
     self.statemach = statemach
 
   def __call__(self, doorOpen):
+    # The state machine checks the door is still open before pressing the
+    # button again, so it gets every reading.
+    self.statemach.sensorReading(bool(doorOpen))
+    return toggle.EdgeTriggeredToggle.__call__(self, doorOpen)
+
+  def fire(self, doorOpen):
     if doorOpen:
       self.statemach.door_opened()
     else:
       self.statemach.door_closed()
+
@@ -1,7 +1,14 @@
 /* HC-SR04 distance sensor and server.
  *
- * Starts a webserver on port 80 that replies to any request with a string
- * representation of the number of centimeters the rangefinder is detecting.
+ * Starts a webserver on port 80 that replies to any request with a burst of
+ * readings of the number of centimeters the rangefinder is detecting, one per
+ * line. The poller filters out bad echoes.
+ * Connections are kept alive so the poller doesn't reconnect every time; the
+ * poller closes idle connections.
+ *
+ * If PUSH_PATH is defined, it also POSTs a burst to gdoormon whenever the
+ * distance changes, and every PUSH_HEARTBEAT_MS so gdoormon knows it can stop
+ * polling.
  *
  * Pin configuration:
  *  HC-SR04:
@@ -32,6 +39,26 @@
 // 1/(speed of sound), where (speed of sound) = 333.1 * .6 * (air temp in C)
 #define PACE_OF_SOUND 29.1  // microseconds per centimeter
 
+// Readings per response, and the time between them (the HC-SR04 needs ~60ms
+// for the echo to die down).
+#define BURST_SIZE 5
+#define BURST_INTERVAL_MS 60
+
+// Where to push readings: the gdoormon server, and /sensor/<door id>. Leave
+// PUSH_PATH undefined to only answer polls. PUSH_TOKEN is gdoormon's
+// arduino_push_token.
+//#define PUSH_PATH "/sensor/garage"
+//#define PUSH_TOKEN "changeme"
+IPAddress PUSH_HOST(192,168,1,2);
+#define PUSH_PORT 8080
+// Push when the distance moves this much, or this long after the last push.
+#define PUSH_CHANGE_CM 5
+#define PUSH_HEARTBEAT_MS 60000
+#define PUSH_REPLY_TIMEOUT_MS 500
+
+long lastPushedDistance = -1;
+unsigned long lastPushMillis = 0;
+
 byte MAC[] = { 
     0xCA, 0xFE, 0xBA, 0xBE, 0xF0, 0x0D };
 //IPAddress IP(192,168,1,47);
@@ -74,13 +101,29 @@ long getDistance() {
 }
 
 
+int formatBurst(char *body, int size, long distance) {
+  // The first reading was taken in loop(), take the rest now.
+  int length = snprintf(body, size, "%ld\n", distance);
+  for (int i = 1; i < BURST_SIZE; i++) {
+    delay(BURST_INTERVAL_MS);
+    length += snprintf(body + length, size - length, "%ld\n", getDistance());
+  }
+  return length;
+}
+
+
 void serveClient(EthernetClient &client, long distance) {
+  char body[BURST_SIZE * 12];
+  int length = formatBurst(body, sizeof(body), distance);
   Serial.println("writing response");
-  client.println("HTTP/1.0 200 OK");
+  client.println("HTTP/1.1 200 OK");
   client.println("Content-Type: text/plain");
+  client.print("Content-Length: ");
+  client.println(length);
+  client.println("Connection: keep-alive");
   client.println("Refresh: 1");
   client.println();
-  client.print(distance);
+  client.print(body);
   Serial.println("response sent, sleeping 200ms");
   delay(200);
 }
@@ -119,14 +162,55 @@ void maybeAnswerHTTPRequest(long distance) {
     if (readClient(client)) {
       Serial.println("Request received");
       serveClient(client, distance);
+    } else {
+      Serial.println("closing connection");
+      client.stop();
     }
-    Serial.println("closing connection");
-    client.stop();
     digitalWrite(DATA_RECEIVED_LED_PIN, LOW);
   }
 }
 
 
+#ifdef PUSH_PATH
+void maybePushReadings(long distance) {
+  if (lastPushedDistance >= 0 &&
+      abs(distance - lastPushedDistance) < PUSH_CHANGE_CM &&
+      millis() - lastPushMillis < PUSH_HEARTBEAT_MS) {
+    return;
+  }
+  char body[BURST_SIZE * 12];
+  int length = formatBurst(body, sizeof(body), distance);
+  lastPushedDistance = distance;
+  lastPushMillis = millis();
+
+  Serial.println("pushing readings");
+  EthernetClient client;
+  if (!client.connect(PUSH_HOST, PUSH_PORT)) {
+    Serial.println("push failed: couldn't connect");
+    return;
+  }
+  client.print("POST ");
+  client.print(PUSH_PATH);
+  client.println(" HTTP/1.0");
+  client.print("Authorization: Bearer ");
+  client.println(PUSH_TOKEN);
+  client.println("Content-Type: text/plain");
+  client.print("Content-Length: ");
+  client.println(length);
+  client.println();
+  client.print(body);
+  // Wait a bit for the reply, so the server sees the whole request.
+  unsigned long start = millis();
+  while (client.connected() && millis() - start < PUSH_REPLY_TIMEOUT_MS) {
+    while (client.available()) {
+      client.read();
+    }
+  }
+  client.stop();
+}
+#endif
+
+
 void toggleLights(long distance) {
   if (distance < 10) {
     digitalWrite(MAX_RANGE_LED_PIN, HIGH);
@@ -144,6 +228,9 @@ void loop() {
   long distance = getDistance();
 
   toggleLights(distance);
+#ifdef PUSH_PATH
+  maybePushReadings(distance);
+#endif
   maybeAnswerHTTPRequest(distance);
 
   delay(200);
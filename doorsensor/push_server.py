@@ -0,0 +1,65 @@
+"""
+Accepts distance readings pushed by the Arduino, so a door is seen as soon as
+it moves instead of on the next poll.
+
+The sensor POSTs the same body it serves to polls (whitespace separated
+distances) to /sensor/<door id>, or to /sensor/ if there's only one door,
+with an "Authorization: Bearer <token>" header.
+
+sensors = {'garage': garage_sensor}
+root.putChild('sensor', push_server.SensorPushResource(sensors, token))
+"""
+
+import hmac
+
+from doorsensor import arduino_client
+from twisted.python import log
+from twisted.web import resource
+
+
+class SensorPushResource(resource.Resource):
+  isLeaf = True
+
+  def __init__(self, sensors, token):
+    """
+    Constructor.
+
+    Args:
+      sensors: dict of door id -> arduino_client.DoorSensor
+      token: token that pushes must give. Pushes drive the state machines
+          (and suspend polling), so they can't be anonymous.
+    """
+    resource.Resource.__init__(self)
+    self._sensors = sensors
+    self._token = token
+
+  def getSensor(self, doorId):
+    """
+    Returns:
+      the DoorSensor for doorId (or the only sensor if doorId is empty), or
+      None if there isn't one.
+    """
+    if not doorId and len(self._sensors) == 1:
+      return self._sensors.values()[0]
+    return self._sensors.get(doorId)
+
+  def render_POST(self, request):
+    header = request.getHeader('authorization') or ''
+    if not hmac.compare_digest(header, 'Bearer ' + self._token):
+      log.msg('Readings pushed with a bad token from %s' % (
+          request.getClientIP(),))
+      request.setResponseCode(401)
+      return 'bad token\n'
+    doorId = '/'.join(part for part in request.postpath if part)
+    sensor = self.getSensor(doorId)
+    if sensor is None:
+      log.msg('Readings pushed for unknown door "%s" from %s' % (
+          doorId, request.getClientIP()))
+      request.setResponseCode(404)
+      return 'unknown door "%s"\n' % doorId
+    readings = arduino_client.parseReadings(request.content.read())
+    if not readings:
+      request.setResponseCode(400)
+      return 'no readings\n'
+    sensor.pushReadings(readings)
+    return 'ok\n'
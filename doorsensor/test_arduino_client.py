@@ -0,0 +1,218 @@
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import failure
+from twisted.trial import unittest
+from twisted.web import client
+from twisted.web import resource
+from twisted.web import server
+
+import arduino_client
+
+
+class FakeArduino(resource.Resource):
+  """Serves a distance, and counts the requests and connections it gets."""
+  isLeaf = True
+
+  def __init__(self, distance):
+    resource.Resource.__init__(self)
+    self.distance = distance
+    self.requests = []
+    self.hold = False
+
+  def render_GET(self, request):
+    self.requests.append(request)
+    if self.hold:
+      return server.NOT_DONE_YET
+    return str(self.distance)
+
+
+class CountingSite(server.Site):
+  connections = 0
+
+  def buildProtocol(self, addr):
+    self.connections += 1
+    return server.Site.buildProtocol(self, addr)
+
+
+class FakeResolver(object):
+  def __init__(self, reactor):
+    self._reactor = reactor
+    self.lookups = 0
+
+  def __getattr__(self, attr):
+    return getattr(self._reactor, attr)
+
+  def resolve(self, hostname):
+    self.lookups += 1
+    return defer.succeed('127.0.0.1')
+
+
+class DoorSensorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.arduino = FakeArduino(5)
+    self.site = CountingSite(self.arduino)
+    self.port = reactor.listenTCP(0, self.site, interface='127.0.0.1')
+    self.portNumber = self.port.getHost().port
+    self.pool = client.HTTPConnectionPool(reactor, persistent=True)
+    self.resolver = FakeResolver(reactor)
+    self.readings = []
+    self.sensor = arduino_client.DoorSensor(self.readings.append,
+        hostname='arduino-gdoor', port=self.portNumber,
+        threshold=10, timeout=1, pool=self.pool, reactor=self.resolver)
+
+  def tearDown(self):
+    for request in self.arduino.requests:
+      if not (request.finished or request._disconnected):
+        request.finish()
+    d = self.pool.closeCachedConnections()
+    d.addCallback(lambda _: self.port.stopListening())
+    return d
+
+  @defer.inlineCallbacks
+  def testDoorClosed(self):
+    yield self.sensor.check()
+    self.assertEquals([False], self.readings)
+    self.assertEquals('arduino-gdoor:%d' % self.portNumber,
+        self.arduino.requests[0].getHeader('host'))
+
+  @defer.inlineCallbacks
+  def testDoorOpen(self):
+    self.arduino.distance = 42
+    doorOpen = yield self.sensor.check()
+    self.assertEquals([True], self.readings)
+    self.assertEquals(True, doorOpen)
+
+  @defer.inlineCallbacks
+  def testReusesConnectionAndAddress(self):
+    for _ in range(3):
+      yield self.sensor.check()
+    self.assertEquals([False] * 3, self.readings)
+    self.assertEquals(3, len(self.arduino.requests))
+    self.assertEquals(1, self.site.connections)
+    self.assertEquals(1, self.resolver.lookups)
+
+  @defer.inlineCallbacks
+  def testSkipsOverlappingPoll(self):
+    d = self.sensor.check()
+    self.assertIdentical(None, self.sensor.check())
+    yield d
+    self.assertEquals([False], self.readings)
+    self.assertEquals(1, len(self.arduino.requests))
+
+  @defer.inlineCallbacks
+  def testReresolvesAfterFailure(self):
+    yield self.sensor.check()
+    yield self.port.stopListening()
+    yield self.pool.closeCachedConnections()
+    yield self.sensor.check()
+    self.assertEquals(1, self.resolver.lookups)
+    self.port = reactor.listenTCP(self.portNumber, self.site,
+        interface='127.0.0.1')
+    self.arduino.distance = 42
+    yield self.sensor.check()
+    self.assertEquals([False, True], self.readings)
+    self.assertEquals(2, self.resolver.lookups)
+
+  @defer.inlineCallbacks
+  def testTimeout(self):
+    self.sensor.timeout = 0.1
+    self.arduino.hold = True
+    doorOpen = yield self.sensor.check()
+    self.assertIdentical(None, doorOpen)
+    self.assertEquals([], self.readings)
+    self.assertEquals(1, len(self.arduino.requests))
+    # The next poll isn't blocked by the one that timed out.
+    self.arduino.hold = False
+    yield self.sensor.check()
+    self.assertEquals([False], self.readings)
+
+  @defer.inlineCallbacks
+  def testFiltersReadings(self):
+    # A burst per response, with one bad echo in each.
+    for distance in ('5\n5\n250\n5\n5\n', '5 5 5 0 5', '42\n41\n2\n42\n43\n',
+        '43\n43\n43\n43\n43\n', '8\n7\n8\n300\n8\n'):
+      self.arduino.distance = distance
+      yield self.sensor.check()
+    self.assertEquals([False, False, True, True, False], self.readings)
+
+  @defer.inlineCallbacks
+  def testBadReadingsIgnored(self):
+    self.arduino.distance = 'garbage'
+    yield self.sensor.check()
+    self.assertEquals([], self.readings)
+    self.arduino.distance = '42\nbad\n42'
+    yield self.sensor.check()
+    self.assertEquals([True], self.readings)
+
+
+class DoorMeasurementProtocolTest(unittest.TestCase):
+
+  def testBodyInChunks(self):
+    readings = []
+    finished = defer.Deferred()
+    bodyProtocol = arduino_client.DoorMeasurementProtocol(readings.append,
+        finished)
+    for chunk in ('1', '2\n3', '4\n', '\n5'):
+      bodyProtocol.dataReceived(chunk)
+    self.assertEquals([], readings)
+    bodyProtocol.connectionLost(failure.Failure(client.ResponseDone()))
+    self.assertEquals([[12, 34, 5]], readings)
+    self.assertTrue(finished.called)
+
+
+class DistanceFilterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.filter = arduino_client.DistanceFilter(threshold=10, window=3,
+        hysteresis=2)
+
+  def testNoReadings(self):
+    self.assertIdentical(None, self.filter.add([]))
+
+  def testMedianIgnoresOutliers(self):
+    self.assertFalse(self.filter.add([5, 400, 5]))
+    self.assertTrue(self.filter.add([0, 40, 40]))
+
+  def testFirstReadingUsesThreshold(self):
+    self.assertTrue(self.filter.add([11]))
+
+  def testHysteresis(self):
+    self.filter = arduino_client.DistanceFilter(threshold=10, window=1,
+        hysteresis=2)
+    # Opening needs the median over threshold + hysteresis...
+    self.assertFalse(self.filter.add([10]))
+    self.assertFalse(self.filter.add([12]))
+    self.assertTrue(self.filter.add([13]))
+    # ...and closing needs it at threshold - hysteresis.
+    self.assertTrue(self.filter.add([9]))
+    self.assertFalse(self.filter.add([8]))
+
+
+class FakeStatemach(object):
+  def __init__(self):
+    self.events = []
+    self.readings = []
+
+  def sensorReading(self, doorOpen):
+    self.readings.append(doorOpen)
+
+  def door_opened(self):
+    self.events.append('door_opened')
+
+  def door_closed(self):
+    self.events.append('door_closed')
+
+
+class StatemachToggleTest(unittest.TestCase):
+
+  def testOnlyFiresOnEdges(self):
+    statemach = FakeStatemach()
+    toggle = arduino_client.StatemachToggle(statemach)
+    for doorOpen in (False, False, True, True, True, False, False):
+      toggle(doorOpen)
+    self.assertEquals(['door_closed', 'door_opened', 'door_closed'],
+        statemach.events)
+    self.assertEquals([False, False, True, True, True, False, False],
+        statemach.readings)
+
@@ -0,0 +1,96 @@
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.trial import unittest
+from twisted.web import resource
+from twisted.web import server
+
+import arduino_client
+import push_server
+from testing import fake_push_sensor
+
+
+class SteppedReactor(object):
+  """The real reactor, with a clock that only moves when told to."""
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def __getattr__(self, attr):
+    return getattr(reactor, attr)
+
+  def seconds(self):
+    return self.now
+
+
+class SensorPushResourceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.reactor = SteppedReactor()
+    self.readings = {'garage': [], 'shed': []}
+    self.sensors = {}
+    for doorId, readings in self.readings.iteritems():
+      self.sensors[doorId] = arduino_client.DoorSensor(readings.append,
+          pushLivenessSecs=60, reactor=self.reactor)
+    root = resource.Resource()
+    root.putChild('sensor',
+        push_server.SensorPushResource(self.sensors, 'sekrit'))
+    self.port = reactor.listenTCP(0, server.Site(root), interface='127.0.0.1')
+    self.url = 'http://127.0.0.1:%d/sensor/' % self.port.getHost().port
+
+  def tearDown(self):
+    return self.port.stopListening()
+
+  def pushSensor(self, doorId, token='sekrit'):
+    return fake_push_sensor.FakePushSensor(self.url + doorId, token=token)
+
+  @defer.inlineCallbacks
+  def testPushDrivesToggle(self):
+    sensor = self.pushSensor('garage')
+    code = yield sensor.setDistance(fake_push_sensor.OPEN_CM)
+    self.assertEquals(200, code)
+    yield sensor.setDistance(fake_push_sensor.CLOSED_CM)
+    self.assertEquals([True, False], self.readings['garage'])
+    self.assertEquals([], self.readings['shed'])
+
+  @defer.inlineCallbacks
+  def testBadToken(self):
+    garage = self.sensors['garage']
+    code = yield self.pushSensor('garage', token='guess').setDistance(
+        fake_push_sensor.CLOSED_CM)
+    self.assertEquals(401, code)
+    self.assertEquals([], self.readings['garage'])
+    # Rejected pushes don't suspend polling.
+    self.assertFalse(garage.isPushing())
+
+  @defer.inlineCallbacks
+  def testUnknownDoor(self):
+    code = yield self.pushSensor('barn').push()
+    self.assertEquals(404, code)
+    # The door has to be named when there's more than one.
+    code = yield self.pushSensor('').push()
+    self.assertEquals(404, code)
+
+  @defer.inlineCallbacks
+  def testOnlyDoor(self):
+    del self.sensors['shed']
+    yield self.pushSensor('').push()
+    self.assertEquals([False], self.readings['garage'])
+
+  @defer.inlineCallbacks
+  def testNoReadings(self):
+    sensor = self.pushSensor('garage')
+    sensor.burst = lambda: 'garbage\n'
+    code = yield sensor.push()
+    self.assertEquals(400, code)
+    self.assertEquals([], self.readings['garage'])
+
+  @defer.inlineCallbacks
+  def testPushesSuspendPolling(self):
+    garage = self.sensors['garage']
+    self.assertFalse(garage.isPushing())
+    yield self.pushSensor('garage').push()
+    self.assertTrue(garage.isPushing())
+    self.assertIdentical(None, garage.check())
+    # Polling resumes if the pushes stop.
+    self.reactor.now += 60
+    self.assertFalse(garage.isPushing())
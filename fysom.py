@@ -242,6 +242,34 @@ define your own startup event.
 So you have a number of choices available to you when initializing your
 state machine.
 
+COMPILED MODE
+
+By default every event call looks up the callbacks by name, builds a new
+event object and uses the 'transition' attribute as a lock. For state
+machines that fire events at a high rate (e.g. on every sensor poll), pass
+'compiled': True:
+
+fsm = Fysom({
+  'initial': 'green',
+  'compiled': True,
+  'events': [
+    {'name': 'warn',  'src': 'green',  'dst': 'yellow'},
+    {'name': 'clear', 'src': 'yellow', 'dst': 'green'}
+  ],
+  'callbacks': {
+    'onyellow': onyellow,
+  }
+})
+
+This precomputes a table mapping each event and source state to the
+destination state and the bound callbacks, so firing an event is a couple
+of dict lookups. The event object passed to the callbacks is a reusable
+record, so don't hold on to it after the callback returns unless you passed
+keyword arguments (in which case a fresh one is created).
+
+Callbacks are bound when the table is built. If you add or remove callbacks
+after construction, call fsm.compile() to rebuild it.
+
 """
 
 __author__ = 'Mansour Behabadi'
@@ -263,6 +291,16 @@ except NameError:
 class FysomError(Exception):
   pass
 
+class _EventRecord(object):
+  """Event object passed to callbacks in compiled mode."""
+  __slots__ = ('fsm', 'event', 'src', 'dst')
+
+
+class _KeywordEventRecord(_EventRecord):
+  """Event object for compiled events fired with keyword arguments."""
+  pass
+
+
 class Fysom(object):
 
   def __init__(self, cfg):
@@ -272,6 +310,10 @@ class Fysom(object):
     return self.current == state
 
   def can(self, event):
+    if self._table is not None:
+      bystate = self._table.get(event)
+      return bystate is not None and self.current in bystate \
+        and not self._busy
     return event in self._map and self.current in self._map[event] \
       and not hasattr(self, 'transition')
 
@@ -284,8 +326,12 @@ class Fysom(object):
       init = {'state': init}
     events = cfg['events'] if 'events' in cfg else []
     callbacks = cfg['callbacks'] if 'callbacks' in cfg else {}
+    compiled = cfg['compiled'] if 'compiled' in cfg else False
     tmap = {}
     self._map = tmap
+    self._table = {} if compiled else None
+    self._busy = False
+    self._spare_event = _EventRecord() if compiled else None
 
     def add(e):
       src = [e['src']] if isinstance(e['src'], basestring) else e['src']
@@ -303,13 +349,19 @@ class Fysom(object):
       add(e)
 
     for name in tmap:
-      setattr(self, name, self._build_event(name))
+      if compiled:
+        setattr(self, name, self._build_compiled_event(name))
+      else:
+        setattr(self, name, self._build_event(name))
 
     for name in callbacks:
       setattr(self, name, callbacks[name])
 
     self.current = 'none'
 
+    if compiled:
+      self.compile()
+
     if init and 'defer' not in init:
       getattr(self, init['event'])()
 
@@ -351,6 +403,125 @@ class Fysom(object):
       
     return fn
 
+  def compile(self):
+    """Build the (event, state) -> (dst, callbacks) table for compiled mode.
+
+    Called automatically on construction; call it again after adding or
+    removing callbacks.
+    """
+    if self._table is None:
+      raise FysomError("compile() needs a state machine created with"
+                       " 'compiled': True")
+    change = getattr(self, 'onchangestate', None)
+    for event, srcmap in self._map.items():
+      before = getattr(self, 'onbefore' + event, None)
+      after = self._first_callback('onafter' + event, 'on' + event)
+      # Update in place: the event methods hold a reference to this dict.
+      bystate = self._table.setdefault(event, {})
+      bystate.clear()
+      for src, dst in srcmap.items():
+        leave = getattr(self, 'onleave' + src, None)
+        if src == dst:
+          # Self transitions only ever call the leave callback.
+          bystate[src] = (dst, None, leave, None, None, None)
+        else:
+          enter = self._first_callback('onenter' + dst, 'on' + dst)
+          bystate[src] = (dst, before, leave, enter, change, after)
+
+  def noops(self):
+    """Returns {event: frozenset(states)} of compiled self transitions.
+
+    Firing an event from one of its states leaves the state unchanged and
+    calls no callbacks, so callers can skip it entirely.
+    """
+    if self._table is None:
+      raise FysomError("noops() needs a state machine created with"
+                       " 'compiled': True")
+    noops = {}
+    for event, bystate in self._table.items():
+      noops[event] = frozenset(
+          src for src, entry in bystate.items()
+          if src == entry[0] and entry[2] is None)
+    return noops
+
+  def _first_callback(self, *fnnames):
+    for fnname in fnnames:
+      fn = getattr(self, fnname, None)
+      if fn is not None:
+        return fn
+    return None
+
+  def _build_compiled_event(self, event):
+    bystate = self._table.setdefault(event, {})
+
+    def fn(**kwargs):
+
+      if self._busy:
+        raise FysomError("event %s inappropriate because previous"
+                         " transition did not complete" % event)
+      src = self.current
+      entry = bystate.get(src)
+      if entry is None:
+        raise FysomError("event %s inappropriate in current state"
+                         " %s" % (event, src))
+
+      dst, before, leave, enter, change, after = entry
+      if src == dst:
+        if leave is not None:
+          e = self._acquire_event(event, src, dst, kwargs)
+          leave(e)
+          self._release_event(e)
+        return
+
+      e = self._acquire_event(event, src, dst, kwargs)
+      if before is not None and before(e) == False:
+        self._release_event(e)
+        return
+
+      self._busy = True
+      if leave is not None and leave(e) == False:
+        # Asynchronous transition: completed when the caller invokes
+        # transition().
+        def _tran():
+          delattr(self, 'transition')
+          self._finish_transition(e, dst, enter, change, after)
+        self.transition = _tran
+        return
+      self._finish_transition(e, dst, enter, change, after)
+
+    return fn
+
+  def _finish_transition(self, e, dst, enter, change, after):
+    self._busy = False
+    self.current = dst
+    if enter is not None:
+      enter(e)
+    if change is not None:
+      change(e)
+    if after is not None:
+      after(e)
+    self._release_event(e)
+
+  def _acquire_event(self, event, src, dst, kwargs):
+    if kwargs:
+      e = _KeywordEventRecord()
+    else:
+      # Callbacks may fire nested events, in which case the spare record is
+      # already in use and a new one is needed.
+      e = self._spare_event
+      if e is None:
+        e = _EventRecord()
+      else:
+        self._spare_event = None
+    e.fsm, e.event, e.src, e.dst = self, event, src, dst
+    for k in kwargs:
+      setattr(e, k, kwargs[k])
+    return e
+
+  def _release_event(self, e):
+    if type(e) is _EventRecord:
+      self._spare_event = e
+
   def _before_event(self, e):
     fnname = 'onbefore' + e.event
     if hasattr(self, fnname):
@@ -0,0 +1,191 @@
+"""Leveled, lazily formatted logging on top of twisted.python.log.
+
+Each subsystem logs through its own Logger. Messages below the subsystem's
+level are dropped before anything is formatted or sent to the observers, and
+the rest are formatted by the observer that writes them.
+
+_log = logger.Logger('arduino')
+_log.debug('Polling %(host)s for distance.', host=hostname)
+
+logger.setLevels({'default': 'info', 'arduino': 'debug'})
+
+Polls that keep getting the same result are logged through a ChangeLog,
+which writes the result when it changes and otherwise an occasional summary.
+"""
+
+import logging
+
+from twisted.internet import reactor
+from twisted.python import log
+
+DEFAULT_LEVEL = logging.INFO
+# The key in setLevels for subsystems without a level of their own.
+DEFAULT_SUBSYSTEM = 'default'
+# Write buffered log lines after this long, or once there are this many bytes.
+FLUSH_SECS = 5
+FLUSH_BYTES = 64 * 1024
+# How often a ChangeLog summarizes a result that hasn't changed.
+SUMMARY_SECS = 10 * 60
+
+# Subsystem -> level, for subsystems that don't log at DEFAULT_LEVEL.
+_levels = {}
+
+
+def parseLevel(name):
+  """
+  Returns:
+    the logging level called name (e.g. 'debug' or 'WARNING').
+  """
+  level = getattr(logging, name.strip().upper(), None)
+  if not isinstance(level, int):
+    raise ValueError('unknown log level "%s"' % name)
+  return level
+
+
+def setLevels(levels):
+  """Set the level of each subsystem.
+
+  Args:
+    levels: dict of subsystem -> level or level name. DEFAULT_SUBSYSTEM sets
+        the level of the others.
+  """
+  _levels.clear()
+  for subsystem, level in levels.items():
+    if not isinstance(level, int):
+      level = parseLevel(level)
+    _levels[subsystem] = level
+
+
+class Logger(object):
+
+  def __init__(self, subsystem):
+    self.subsystem = subsystem
+
+  def level(self):
+    level = _levels.get(self.subsystem)
+    if level is None:
+      level = _levels.get(DEFAULT_SUBSYSTEM, DEFAULT_LEVEL)
+    return level
+
+  def isEnabledFor(self, level):
+    return level >= self.level()
+
+  def log(self, level, format, **kwargs):
+    """Log format % kwargs, if the subsystem logs at level.
+
+    The subsystem is logged as the twisted log system, e.g. "[arduino]".
+    """
+    if level < self.level():
+      return
+    log.msg(format=format, system=self.subsystem, logLevel=level, **kwargs)
+
+  def debug(self, format, **kwargs):
+    self.log(logging.DEBUG, format, **kwargs)
+
+  def info(self, format, **kwargs):
+    self.log(logging.INFO, format, **kwargs)
+
+  def warning(self, format, **kwargs):
+    self.log(logging.WARNING, format, **kwargs)
+
+  def error(self, format, **kwargs):
+    self.log(logging.ERROR, format, **kwargs)
+
+
+class ChangeLog(object):
+  """Logs a poll's result when it changes. While it doesn't, the polls are
+  counted and summarized every summarySecs instead."""
+
+  def __init__(self, logger, summarySecs=SUMMARY_SECS,
+      seconds=reactor.seconds):
+    """
+    Constructor.
+
+    Args:
+      logger: Logger to log to.
+      summarySecs: seconds between summaries of an unchanged result.
+      seconds: reactor.seconds callback for testing.
+    """
+    self._logger = logger
+    self.summarySecs = summarySecs
+    self._seconds = seconds
+    self._result = None
+    self._unchanged = 0
+    self._lastLogged = None
+
+  def report(self, result, format, level=logging.INFO, **kwargs):
+    """Log format % kwargs if result is new, or it's time for a summary.
+
+    Args:
+      result: what the poll found. Only compared to the previous result.
+    """
+    if not self._logger.isEnabledFor(level):
+      return
+    now = self._seconds()
+    if self._lastLogged is None or result != self._result:
+      self._result = result
+      self._unchanged = 0
+    else:
+      self._unchanged += 1
+      if now - self._lastLogged < self.summarySecs:
+        return
+      format = ('unchanged for %(unchangedPolls)d polls: ' + format)
+      kwargs['unchangedPolls'] = self._unchanged
+      self._unchanged = 0
+    self._lastLogged = now
+    self._logger.log(level, format, **kwargs)
+
+
+class BufferedFileLogObserver(log.FileLogObserver):
+  """FileLogObserver that writes in batches: every flushSecs, once flushBytes
+  have been buffered, on errors, and on flush()."""
+
+  def __init__(self, f, flushSecs=FLUSH_SECS, flushBytes=FLUSH_BYTES,
+      callLater=reactor.callLater):
+    """
+    Constructor.
+
+    Args:
+      f: file to write to, e.g. a twisted.python.logfile.LogFile.
+      flushSecs: seconds to buffer lines for.
+      flushBytes: bytes to buffer before writing them right away.
+      callLater: reactor.callLater callback for testing.
+    """
+    log.FileLogObserver.__init__(self, f)
+    self._file = f
+    self.flushSecs = flushSecs
+    self.flushBytes = flushBytes
+    self._callLater = callLater
+    self._buffer = []
+    self._buffered = 0
+    self._flushCall = None
+    # FileLogObserver.emit calls these for every line.
+    self.write = self._append
+    self.flush = self._flushSoon
+
+  def emit(self, eventDict):
+    log.FileLogObserver.emit(self, eventDict)
+    if eventDict.get('isError'):
+      self.flushNow()
+
+  def _append(self, text):
+    self._buffer.append(text)
+    self._buffered += len(text)
+
+  def _flushSoon(self):
+    if self._buffered >= self.flushBytes:
+      self.flushNow()
+    elif self._flushCall is None and self._buffer:
+      self._flushCall = self._callLater(self.flushSecs, self.flushNow)
+
+  def flushNow(self):
+    """Write the buffered lines."""
+    if self._flushCall is not None:
+      if self._flushCall.active():
+        self._flushCall.cancel()
+      self._flushCall = None
+    if not self._buffer:
+      return
+    text, self._buffer, self._buffered = ''.join(self._buffer), [], 0
+    self._file.write(text)
+    self._file.flush()
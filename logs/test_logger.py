@@ -0,0 +1,117 @@
+#!/usr/bin/trial
+
+import logging
+
+from twisted.internet import task
+from twisted.python import log
+from twisted.trial import unittest
+
+import logger
+
+
+class LoggerTest(unittest.TestCase):
+  def setUp(self):
+    self.events = []
+    log.addObserver(self.events.append)
+    self.addCleanup(log.removeObserver, self.events.append)
+    self.addCleanup(logger.setLevels, {})
+    self.log = logger.Logger('arduino')
+
+  def texts(self):
+    return [log.textFromEventDict(event) for event in self.events]
+
+  def testLevels(self):
+    self.log.debug('polling %(host)s', host='arduino-gdoor')
+    self.log.info('door is %(state)s', state='open')
+    self.assertEquals(['door is open'], self.texts())
+    self.assertEquals('arduino', self.events[0]['system'])
+    self.assertEquals(logging.INFO, self.events[0]['logLevel'])
+
+  def testSetLevels(self):
+    logger.setLevels({'default': 'warning', 'arduino': 'DEBUG'})
+    self.log.debug('polling')
+    logger.Logger('airport').info('polling')
+    self.assertEquals(['polling'], self.texts())
+    self.assertRaises(ValueError, logger.setLevels, {'arduino': 'loud'})
+
+  def testLazyFormatting(self):
+    class Expensive(object):
+      def __str__(self):
+        raise AssertionError('formatted')
+    self.log.debug('readings: %(readings)s', readings=Expensive())
+    self.assertEquals([], self.events)
+
+
+class ChangeLogTest(unittest.TestCase):
+  def setUp(self):
+    self.events = []
+    log.addObserver(self.events.append)
+    self.addCleanup(log.removeObserver, self.events.append)
+    self.clock = task.Clock()
+    self.changes = logger.ChangeLog(logger.Logger('airport'),
+        summarySecs=60, seconds=self.clock.seconds)
+
+  def texts(self):
+    return [log.textFromEventDict(event) for event in self.events]
+
+  def poll(self, result):
+    self.changes.report(result, 'found %(found)s', found=result)
+    self.clock.advance(10)
+
+  def testSummarizesUnchanged(self):
+    for _ in range(8):
+      self.poll('a')
+    self.poll('b')
+    self.assertEquals(['found a', 'unchanged for 6 polls: found a',
+        'found b'], self.texts())
+
+
+class FakeFile(object):
+  def __init__(self):
+    self.written = []
+
+  def write(self, text):
+    self.written.append(text)
+
+  def flush(self):
+    pass
+
+
+class BufferedFileLogObserverTest(unittest.TestCase):
+  def setUp(self):
+    self.clock = task.Clock()
+    self.file = FakeFile()
+    self.observer = logger.BufferedFileLogObserver(self.file, flushSecs=5,
+        flushBytes=200, callLater=self.clock.callLater)
+
+  def emit(self, text, isError=0):
+    self.observer.emit({'message': (text,), 'isError': isError,
+        'system': 'test', 'time': 0})
+
+  def testFlushesOnTimer(self):
+    self.emit('one')
+    self.emit('two')
+    self.assertEquals([], self.file.written)
+    self.clock.advance(5)
+    self.assertEquals(1, len(self.file.written))
+    self.assertIn('[test] one\n', self.file.written[0])
+    self.assertIn('[test] two\n', self.file.written[0])
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testFlushesOnSize(self):
+    self.emit('x' * 100)
+    self.emit('x' * 100)
+    self.assertEquals(1, len(self.file.written))
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testFlushesErrors(self):
+    self.emit('one')
+    self.emit('oops', isError=1)
+    self.assertEquals(1, len(self.file.written))
+
+  def testFlushNow(self):
+    self.observer.flushNow()
+    self.assertEquals([], self.file.written)
+    self.emit('one')
+    self.observer.flushNow()
+    self.assertEquals(1, len(self.file.written))
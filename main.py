@@ -3,17 +3,27 @@ import os
 import sys
 sys.path.append('.')
 
+from chatcontrol import fanout
+from chatcontrol import subscriberdb
 from chatcontrol import xmpp
 from doorcontrol import maestro
 from doorsensor import arduino_client
+from doorsensor import push_server
+from logs import logger
+from metrics import web
 from presence import airport_clientmonitor
 from presence import clientdb
 from presence import registration
+from speech import speaker
+from state import poller
+from state import registry
+from state import snapshot
 from state import statemach
+from state import timerwheel
 
 from twisted.application import internet
 from twisted.application import service
-from twisted.persisted import dirdbm
+from twisted.internet import reactor
 from twisted.python import log
 from twisted.python import logfile
 from twisted.web import server
@@ -24,12 +34,19 @@ import ConfigParser
 # Constants.
 APP_NAME = 'gdoormon'
 CONFIG_FNAME = 'gdoormon.config'
+# Config sections named "door <id>" define one door each.
+DOOR_SECTION_PREFIX = 'door '
+DEFAULT_DOOR_ID = 'garage'
+# Config section of subsystem: level options.
+LOG_LEVELS_SECTION = 'log levels'
 
 homedir = os.getenv('HOME')
 
 # Load the config.
 # TODO: file paths should be specified by a flag.
 subscriber_dir = os.path.join(homedir, APP_NAME + '-subscribers')
+speech_cache_dir = os.path.join(homedir, APP_NAME + '-speech')
+state_snapshot_path = os.path.join(homedir, APP_NAME + '-state.json')
 config_path = os.path.join(os.getcwd(), CONFIG_FNAME)
 if not os.path.exists(config_path):
   raise RuntimeError("Couldn't find %s" % config_path)
@@ -37,19 +54,49 @@ config = ConfigParser.ConfigParser()
 config.read([config_path])
 
 
+def getDoorConfig(section, option, default=None):
+  """Get a per-door option, falling back to the [gdoormon] section."""
+  if section and config.has_option(section, option):
+    return config.get(section, option)
+  if default is not None and not config.has_option(APP_NAME, option):
+    return default
+  return config.get(APP_NAME, option)
+
+
 # Setup the application. Twisted looks for a variable named 'application'.
 application = service.Application(APP_NAME)
 sc = service.MultiService()
 sc.setServiceParent(application)
 
-# Setup logging: write to stdout if it's a tty, and write to rotated log files.
+# Setup logging: write to stdout if it's a tty, and write to rotated log files
+# in batches.
+if config.has_section(LOG_LEVELS_SECTION):
+  logger.setLevels(dict(config.items(LOG_LEVELS_SECTION)))
 if os.isatty(sys.stdout.fileno()):
   log.startLogging(sys.stdout)
 outputLog = logfile.LogFile.fromFullPath(APP_NAME + '.log', maxRotatedFiles=20)
-application.setComponent(log.ILogObserver, log.FileLogObserver(outputLog).emit)
+log_observer = logger.BufferedFileLogObserver(outputLog)
+application.setComponent(log.ILogObserver, log_observer.emit)
+reactor.addSystemEventTrigger('after', 'shutdown', log_observer.flushNow)
+
+# Registered wifi clients, shared by the registration server and the presence
+# monitor.
+clients = clientdb.getRegistry()
 
-# Start the client registration server.
-factory = server.Site(registration.GetRegistrationResource())
+# Start the client registration server. Door sensors can also push readings
+# to it if arduino_push_token is set; door_sensors is filled in as the doors
+# are set up below. It also serves metrics at /metrics.
+door_sensors = {}
+registration_api_token = None
+if config.has_option(APP_NAME, 'registration_api_token'):
+  registration_api_token = config.get(APP_NAME, 'registration_api_token')
+root = registration.GetRegistrationResource(clients,
+    apiToken=registration_api_token)
+if config.has_option(APP_NAME, 'arduino_push_token'):
+  root.putChild('sensor', push_server.SensorPushResource(door_sensors,
+      config.get(APP_NAME, 'arduino_push_token')))
+root.putChild('metrics', web.MetricsResource())
+factory = server.Site(root)
 server_port = int(config.get(APP_NAME, 'server_port'))
 registration_server = internet.TCPServer(server_port, factory)
 registration_server.setServiceParent(sc)
@@ -62,38 +109,146 @@ xmppclient = client.XMPPClient(
 xmppclient.logTraffic = False
 xmppclient.setServiceParent(sc)
 
-subscribers = dirdbm.DirDBM(subscriber_dir)
-broadcaster = xmpp.ChatBroadcastProtocol(subscribers)
+# Subscribers are looked up in memory, and saved in batches (and on shutdown).
+subscribers = subscriberdb.SubscriberIndex(subscriberdb.getDb(subscriber_dir))
+reactor.addSystemEventTrigger('before', 'shutdown', subscribers.flush)
+
+# Alerts go to each subscriber as a chat message by default, or can be sent
+# once to a chat room or pubsub node that the server fans out.
+broadcast_mode = 'chat'
+if config.has_option(APP_NAME, 'broadcast_mode'):
+  broadcast_mode = config.get(APP_NAME, 'broadcast_mode')
+if broadcast_mode == 'chat':
+  broadcaster = xmpp.ChatBroadcastProtocol(subscribers)
+elif broadcast_mode == 'muc':
+  broadcast_muc_nick = APP_NAME
+  if config.has_option(APP_NAME, 'broadcast_muc_nick'):
+    broadcast_muc_nick = config.get(APP_NAME, 'broadcast_muc_nick')
+  broadcaster = fanout.MUCBroadcastProtocol(
+      jid.internJID(config.get(APP_NAME, 'broadcast_muc_room')),
+      broadcast_muc_nick)
+elif broadcast_mode == 'pubsub':
+  broadcaster = fanout.PubSubBroadcastProtocol(
+      jid.internJID(config.get(APP_NAME, 'broadcast_pubsub_service')),
+      config.get(APP_NAME, 'broadcast_pubsub_node'))
+else:
+  raise RuntimeError('unknown broadcast_mode "%s"' % broadcast_mode)
 broadcaster.setHandlerParent(xmppclient)
 
-# Setup the state machine and pass it the door controller and xmpp service.
-door_controller = maestro.DoorControl(maestro.PololuMicroMaestro())
-door_open_timeout_secs = int(config.get(APP_NAME, 'door_open_timeout_secs'))
-alert_timeout_secs = int(config.get(APP_NAME, 'alert_timeout_secs'))
-sm = statemach.StateMachine(broadcaster, door_controller,
-    doorOpenTimeoutSecs=door_open_timeout_secs,
-    alertTimeoutSecs=alert_timeout_secs)
+# All door timeouts run off one timer wheel, ticked by a single service.
+timer_wheel = timerwheel.TimerWheel()
+timer_wheel_service = internet.TimerService(
+    timer_wheel.resolution, timer_wheel.tick)
+timer_wheel_service.setServiceParent(sc)
+
+# Find the doors. Without any door sections there's a single door configured
+# by the [gdoormon] section.
+door_sections = [section for section in config.sections()
+    if section.startswith(DOOR_SECTION_PREFIX)]
+if door_sections:
+  doors = [(section[len(DOOR_SECTION_PREFIX):].strip(), section)
+      for section in door_sections]
+else:
+  doors = [(DEFAULT_DOOR_ID, None)]
+
+# Announcements are spoken one at a time by a background TTS process. The
+# fixed phrases are rendered to audio files once and played back after that.
+tts_command = speaker.TTS_COMMAND
+if config.has_option(APP_NAME, 'tts_command'):
+  tts_command = config.get(APP_NAME, 'tts_command').split()
+audio_player = speaker.PLAY_COMMAND
+if config.has_option(APP_NAME, 'audio_player'):
+  audio_player = config.get(APP_NAME, 'audio_player').split()
+door_speaker = speaker.Speaker(speech_cache_dir, tts=tts_command,
+    player=audio_player)
+reactor.addSystemEventTrigger('before', 'shutdown', door_speaker.stop)
+
+doors_registry = registry.DoorRegistry()
+# Each door's state and pending timeout are saved on every change, so a
+# restart resumes them instead of starting over.
+snapshots = snapshot.SnapshotFile(state_snapshot_path)
+# Pollers only drive the state machines when what they see changes, and
+# (optionally) every toggle_resync_secs in case an edge was missed.
+toggle_resync_secs = None
+if config.has_option(APP_NAME, 'toggle_resync_secs'):
+  toggle_resync_secs = int(config.get(APP_NAME, 'toggle_resync_secs'))
+arduino_polling_secs = int(config.get(APP_NAME, 'arduino_polling_secs'))
+for door_id, section in doors:
+  # Setup the state machine and pass it the door controller and xmpp service.
+  maestro_port = getDoorConfig(section, 'maestro_port',
+      maestro.DEFAULT_PORT)
+  maestro_device = maestro.PololuMicroMaestro()
+  maestro.MaestroService(maestro_device, maestro_port).setServiceParent(sc)
+  script_subroutine = getDoorConfig(section, 'maestro_script_subroutine', '')
+  door_controller = maestro.DoorControl(maestro_device,
+      scriptSubroutine=int(script_subroutine) if script_subroutine else None)
+  door_open_timeout_secs = int(
+      getDoorConfig(section, 'door_open_timeout_secs'))
+  alert_timeout_secs = int(getDoorConfig(section, 'alert_timeout_secs'))
+  close_confirm_secs = int(getDoorConfig(section, 'close_confirm_secs',
+      statemach.CLOSE_CONFIRM_SECS))
+  close_retries = int(getDoorConfig(section, 'close_retries',
+      statemach.CLOSE_RETRIES))
+  sm = statemach.StateMachine(broadcaster, door_controller,
+      doorOpenTimeoutSecs=door_open_timeout_secs,
+      alertTimeoutSecs=alert_timeout_secs,
+      callLater=timer_wheel.callLater, speaker=door_speaker,
+      doorId=door_id if len(doors) > 1 else None,
+      closeConfirmSecs=close_confirm_secs, closeRetries=close_retries)
+  door_speaker.prerender(sm.spokenMessages())
+  snapshots.watch(door_id, sm)
+  doors_registry.addDoor(door_id, sm)
+
+  # Setup a service to poll the door sensor, and pass it the state machine.
+  arduino_hostname = getDoorConfig(section, 'arduino_hostname')
+  threshold_cm = int(getDoorConfig(section, 'arduino_threshold_cm'))
+  filter_window = int(getDoorConfig(section, 'arduino_filter_window',
+      arduino_client.FILTER_WINDOW))
+  hysteresis_cm = int(getDoorConfig(section, 'arduino_hysteresis_cm',
+      arduino_client.HYSTERESIS_CM))
+  push_liveness_secs = getDoorConfig(section, 'arduino_push_liveness_secs',
+      '')
+  push_liveness_secs = int(push_liveness_secs) if push_liveness_secs else None
+  toggle = arduino_client.StatemachToggle(sm, resyncSecs=toggle_resync_secs)
+  sensor = arduino_client.DoorSensor(toggle, hostname=arduino_hostname,
+      threshold=threshold_cm, filterWindow=filter_window,
+      hysteresis=hysteresis_cm, pushLivenessSecs=push_liveness_secs)
+  door_sensors[door_id] = sensor
+  # Poll fast while the door is open, alerting, closing or stuck, and back
+  # off while it's quiet.
+  arduino_fast_polling_secs = float(getDoorConfig(section,
+      'arduino_fast_polling_secs', arduino_client.FAST_POLLING_SECS))
+  arduino_max_polling_secs = float(getDoorConfig(section,
+      'arduino_max_polling_secs', arduino_client.MAX_POLLING_SECS))
+  sensor_service = poller.AdaptivePoller(sensor.check,
+      fastSecs=arduino_fast_polling_secs, slowSecs=arduino_polling_secs,
+      maxSecs=arduino_max_polling_secs)
+  sensor_service.watch(sm)
+  sensor_service.setServiceParent(sc)
 
 bot_passwd = config.get(APP_NAME, 'bot_passwd')
-commander = xmpp.ChatCommandReceiverProtocol(sm, subscribers, bot_passwd)
+commander = xmpp.ChatCommandReceiverProtocol(
+    doors_registry, subscribers, bot_passwd)
 commander.setHandlerParent(xmppclient)
 
 # Setup a service to poll the airport, and pass it the state machine.
 airport_hostname = config.get(APP_NAME, 'airport_hostname')
 airport_polling_secs = int(config.get(APP_NAME, 'airport_polling_secs'))
-clients = clientdb.getDb()
-presence_toggle = airport_clientmonitor.StatemachToggle(sm)
+presence_toggle = airport_clientmonitor.StatemachToggle(doors_registry,
+    resyncSecs=toggle_resync_secs)
 monitor = airport_clientmonitor.PresenceMonitor(
     airport_hostname, clients, presence_toggle)
-presence_service = internet.TimerService(airport_polling_secs, monitor.check)
+airport_fast_polling_secs = airport_clientmonitor.FAST_POLLING_SECS
+if config.has_option(APP_NAME, 'airport_fast_polling_secs'):
+  airport_fast_polling_secs = float(
+      config.get(APP_NAME, 'airport_fast_polling_secs'))
+airport_max_polling_secs = airport_clientmonitor.MAX_POLLING_SECS
+if config.has_option(APP_NAME, 'airport_max_polling_secs'):
+  airport_max_polling_secs = float(
+      config.get(APP_NAME, 'airport_max_polling_secs'))
+presence_service = poller.AdaptivePoller(monitor.check,
+    fastSecs=airport_fast_polling_secs, slowSecs=airport_polling_secs,
+    maxSecs=airport_max_polling_secs)
+for door_id in doors_registry.doorIds():
+  presence_service.watch(doors_registry.getDoor(door_id))
 presence_service.setServiceParent(sc)
-
-# Setup a service to poll the door sensor, and pass it the state machine.
-arduino_polling_secs = int(config.get(APP_NAME, 'arduino_polling_secs'))
-arduino_hostname = config.get(APP_NAME, 'arduino_hostname')
-threshold_cm = int(config.get(APP_NAME, 'arduino_threshold_cm'))
-toggle = arduino_client.StatemachToggle(sm)
-sensor = arduino_client.DoorSensor(toggle, hostname=arduino_hostname,
-    threshold=threshold_cm)
-sensor_service = internet.TimerService(arduino_polling_secs, sensor.check)
-sensor_service.setServiceParent(sc)
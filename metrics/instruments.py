@@ -0,0 +1,186 @@
+"""Counters, gauges and latency histograms, exported by metrics.web.
+
+Instruments are created once, up front, and keep their values in
+preallocated arrays, so recording is an index and an increment.
+
+_polls = instruments.counter('sensor_polls_total', 'Polls of the sensor.')
+_pollSeconds = instruments.histogram('sensor_poll_seconds',
+    'Round trip time of sensor polls.')
+
+_polls.inc()
+_pollSeconds.observe(elapsed)
+
+Instruments with the same name and labels are the same instrument, so each
+door (say) can create its own with a door label.
+"""
+
+import array
+import bisect
+
+# Upper bounds, in seconds, of the latency buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10)
+
+
+class Counter(object):
+  kind = 'counter'
+
+  def __init__(self, name, help, labels):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self._value = array.array('d', [0])
+
+  def inc(self, amount=1):
+    self._value[0] += amount
+
+  @property
+  def value(self):
+    return self._value[0]
+
+  def samples(self):
+    """Returns [(suffix, extra labels, value)] to export."""
+    return [('', (), self._value[0])]
+
+
+class Gauge(Counter):
+  kind = 'gauge'
+
+  def __init__(self, name, help, labels, func=None):
+    """
+    Args:
+      func: if given, called for the value whenever it's exported, instead
+          of the gauge being set.
+    """
+    Counter.__init__(self, name, help, labels)
+    self._func = func
+
+  def set(self, value):
+    self._value[0] = value
+
+  def dec(self, amount=1):
+    self._value[0] -= amount
+
+  @property
+  def value(self):
+    if self._func is not None:
+      return self._func()
+    return self._value[0]
+
+  def samples(self):
+    return [('', (), self.value)]
+
+
+class Histogram(object):
+  kind = 'histogram'
+
+  def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.buckets = tuple(sorted(buckets))
+    # Observations per bucket (not cumulative), the last one for anything
+    # over the largest bound.
+    self._counts = array.array('L', [0] * (len(self.buckets) + 1))
+    self._sum = array.array('d', [0])
+
+  def observe(self, value):
+    self._counts[bisect.bisect_left(self.buckets, value)] += 1
+    self._sum[0] += value
+
+  @property
+  def count(self):
+    return sum(self._counts)
+
+  @property
+  def sum(self):
+    return self._sum[0]
+
+  def samples(self):
+    samples = []
+    total = 0
+    for bound, count in zip(self.buckets + ('+Inf',), self._counts):
+      total += count
+      samples.append(('_bucket', (('le', formatValue(bound)),), total))
+    samples.append(('_sum', (), self._sum[0]))
+    samples.append(('_count', (), total))
+    return samples
+
+
+def formatValue(value):
+  if isinstance(value, basestring):
+    return value
+  if value != value:
+    return 'NaN'
+  if value in (float('inf'), float('-inf')):
+    return '+Inf' if value > 0 else '-Inf'
+  if value == int(value):
+    return str(int(value))
+  return repr(float(value))
+
+
+class Registry(object):
+
+  def __init__(self):
+    # (name, labels) -> instrument, in the order they were created.
+    self._instruments = {}
+    self._order = []
+
+  def _get(self, cls, name, help, labels, **kwargs):
+    labels = tuple(sorted((labels or {}).items()))
+    key = (name, labels)
+    instrument = self._instruments.get(key)
+    if instrument is None:
+      instrument = cls(name, help, labels, **kwargs)
+      self._instruments[key] = instrument
+      self._order.append(instrument)
+    elif type(instrument) is not cls:
+      raise ValueError('%s is already a %s' % (name, instrument.kind))
+    return instrument
+
+  def counter(self, name, help, labels=None):
+    return self._get(Counter, name, help, labels)
+
+  def gauge(self, name, help, labels=None, func=None):
+    """
+    Args:
+      func: called for the gauge's value when it's exported, instead of the
+          gauge being set.
+    """
+    gauge = self._get(Gauge, name, help, labels)
+    if func is not None:
+      gauge._func = func
+    return gauge
+
+  def histogram(self, name, help, labels=None, buckets=LATENCY_BUCKETS):
+    return self._get(Histogram, name, help, labels, buckets=buckets)
+
+  def export(self):
+    """
+    Returns:
+      the instruments in the Prometheus text format.
+    """
+    lines = []
+    described = set()
+    for instrument in sorted(self._order, key=lambda i: i.name):
+      if instrument.name not in described:
+        described.add(instrument.name)
+        lines.append('# HELP %s %s' % (instrument.name, instrument.help))
+        lines.append('# TYPE %s %s' % (instrument.name, instrument.kind))
+      for suffix, extraLabels, value in instrument.samples():
+        labels = instrument.labels + extraLabels
+        if labels:
+          labelText = '{%s}' % ','.join('%s="%s"' % (
+              name, str(labelValue).replace('\\', '\\\\').replace('"', '\\"'))
+              for name, labelValue in labels)
+        else:
+          labelText = ''
+        lines.append('%s%s%s %s' % (instrument.name, suffix, labelText,
+            formatValue(value)))
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
@@ -0,0 +1,57 @@
+#!/usr/bin/trial
+
+from twisted.trial import unittest
+
+import instruments
+
+
+class RegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.registry = instruments.Registry()
+
+  def testCounter(self):
+    polls = self.registry.counter('polls_total', 'Polls.')
+    polls.inc()
+    polls.inc(2)
+    self.assertEquals(3, polls.value)
+    self.assertIdentical(polls, self.registry.counter('polls_total', 'Polls.'))
+    self.assertRaises(ValueError, self.registry.gauge, 'polls_total', 'Polls.')
+
+  def testGauge(self):
+    clients = self.registry.gauge('clients', 'Clients.')
+    clients.set(5)
+    clients.dec()
+    self.assertEquals(4, clients.value)
+    pending = self.registry.gauge('pending', 'Pending.', func=lambda: 7)
+    self.assertEquals(7, pending.value)
+
+  def testHistogram(self):
+    latency = self.registry.histogram('latency_seconds', 'Latency.',
+        buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+      latency.observe(value)
+    self.assertEquals(4, latency.count)
+    self.assertAlmostEquals(2.65, latency.sum)
+    self.assertEquals('\n'.join([
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 2.65',
+        'latency_seconds_count 4',
+    ]) + '\n', self.registry.export())
+
+  def testExportLabels(self):
+    self.registry.counter('polls_total', 'Polls.', {'host': 'shed'}).inc()
+    self.registry.gauge('clients', 'Clients.').set(1.5)
+    self.registry.counter('polls_total', 'Polls.', {'host': 'garage'})
+    self.assertEquals('\n'.join([
+        '# HELP clients Clients.',
+        '# TYPE clients gauge',
+        'clients 1.5',
+        '# HELP polls_total Polls.',
+        '# TYPE polls_total counter',
+        'polls_total{host="shed"} 1',
+        'polls_total{host="garage"} 0',
+    ]) + '\n', self.registry.export())
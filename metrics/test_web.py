@@ -0,0 +1,18 @@
+#!/usr/bin/trial
+
+from twisted.trial import unittest
+from twisted.web.test import test_web
+
+import instruments
+import web
+
+
+class MetricsResourceTest(unittest.TestCase):
+  def testRender(self):
+    registry = instruments.Registry()
+    registry.counter('polls_total', 'Polls.').inc()
+    request = test_web.DummyRequest([''])
+    body = web.MetricsResource(registry).render_GET(request)
+    self.assertIn('polls_total 1\n', body)
+    self.assertEquals([web.CONTENT_TYPE],
+        request.outgoingHeaders.values())
@@ -0,0 +1,21 @@
+"""Serves the metrics in the Prometheus text format.
+
+root.putChild('metrics', web.MetricsResource())
+"""
+
+from metrics import instruments
+from twisted.web import resource
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class MetricsResource(resource.Resource):
+  isLeaf = True
+
+  def __init__(self, registry=instruments.REGISTRY):
+    resource.Resource.__init__(self)
+    self._registry = registry
+
+  def render_GET(self, request):
+    request.setHeader('Content-Type', CONTENT_TYPE)
+    return self._registry.export()
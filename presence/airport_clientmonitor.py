@@ -4,42 +4,79 @@ This script is released under the GNU GPL v2 license.
 
 toggle = airport_clientmonitor.StatemachToggle(statemach)
 monitor = airport_clientmonitor.PresenceMonitor(airport_hostname, clients, toggle)
-pressence_service = internet.TimerService(15, monitor.check)
+pressence_service = poller.AdaptivePoller(monitor.check, FAST_POLLING_SECS,
+    15, MAX_POLLING_SECS)
 """
 
 import airport_snmp
 import argparse
 import os
 import time
+from logs import logger
 from presence import clientdb
+from state import toggle
+from twisted.internet import reactor
 from twisted.python import log
 
 SLEEP_SECONDS = 15
+# Poll this often while a door is open, alerting, closing or stuck, and back
+# off to this often while it's quiet (see state.poller).
+FAST_POLLING_SECS = 5
+MAX_POLLING_SECS = 120
+
+_log = logger.Logger('airport')
 
 
 class PresenceMonitor(object):
-  def __init__(self, airportHostname, db, toggleCallback):
+  def __init__(self, airportHostname, registry, toggleCallback, poller=None):
+    """
+    Args:
+      airportHostname: airport host name
+      registry: clientdb.ClientRegistry of registered clients
+      toggleCallback: called with True if someone is home, False if not, on
+          every poll. Use an edge triggered toggle (e.g. StatemachToggle) to
+          only act on changes.
+      poller: airport_snmp.AirportPoller (optional)
+    """
     self._airportHostname = airportHostname
-    self._db = db
+    self._registry = registry
     self._someone_home = None
     self._toggleCallback = toggleCallback
+    self._poller = poller or airport_snmp.AirportPoller(airportHostname)
+    # Every poll finds the clients, but they rarely change.
+    self._changeLog = logger.ChangeLog(_log)
 
   def check(self):
-    log.msg('Polling for airport clients.')
-    # TODO: getData should be a callback
-    airport_clients = airport_snmp.getData(self._airportHostname)
-
-    registered_airport_clients = set(airport_clients
-        ).intersection(set(self._db.keys()))
-    if registered_airport_clients:
-      # TODO: announce connections/departures
-      log.msg('%d registered airport clients: %s' % (
-              len(registered_airport_clients),
-              ', '.join(registered_airport_clients)))
-      self.setPresenceDetected(True)
+    """Poll the airport.
+
+    Returns:
+      Deferred firing with whether presence was detected, or None if the
+      airport couldn't be polled.
+    """
+    _log.debug('Polling for airport clients.')
+    d = self._poller.getData()
+    d.addCallback(self._handleClients)
+    d.addErrback(self._handleError)
+    return d
+
+  def _handleError(self, failure):
+    # Leave the presence state alone until the airport answers again.
+    _log.warning('Failed to poll airport %(host)s: %(reason)s',
+        host=self._airportHostname, reason=failure.getErrorMessage())
+
+  def _handleClients(self, airport_clients):
+    registered_airport_clients = self._registry.macs.intersection(
+        airport_clients)
+    someone_home = bool(registered_airport_clients)
+    # TODO: announce connections/departures
+    if someone_home:
+      self._changeLog.report(registered_airport_clients,
+          '%(count)d registered airport clients: %(clients)s',
+          count=len(registered_airport_clients),
+          clients=', '.join(sorted(registered_airport_clients)))
     else:
-      log.msg('nobody home!')
-      self.setPresenceDetected(False)
+      self._changeLog.report(registered_airport_clients, 'nobody home!')
+    self.setPresenceDetected(someone_home)
 
     return self.isPresenceDetected()
 
@@ -47,14 +84,16 @@ class PresenceMonitor(object):
     return self._someone_home
 
   def setPresenceDetected(self, b):
+    self._someone_home = b
     self._toggleCallback(b)
 
 
-class StatemachToggle(object):
-  def __init__(self, statemach):
+class StatemachToggle(toggle.EdgeTriggeredToggle):
+  def __init__(self, statemach, resyncSecs=None, seconds=reactor.seconds):
+    toggle.EdgeTriggeredToggle.__init__(self, resyncSecs, seconds)
     self.statemach = statemach
 
-  def __call__(self, presence):
+  def fire(self, presence):
     if presence:
       self.statemach.someone_home()
     else:
@@ -102,8 +141,8 @@ def main():
   flags = setupFlags().parse_args()
   setupLogging()
 
-  db = clientdb.getDb()
-  presence_mon = PresenceMonitor(flags.airport, db, toggle)
+  registry = clientdb.getRegistry(flags.db)
+  presence_mon = PresenceMonitor(flags.airport, registry, toggle)
 
   while True:
     presence_mon.check()
@@ -3,22 +3,50 @@
 # This script is released under the GNU GPL v2 license.
 # From http://bazaar.launchpad.net/~cmsj/+junk/munin-plugins/view/head:/snmp__airport
 
-import netsnmp
+import collections
+import itertools
 import logging
 
+import snmp
+from metrics import instruments
+from twisted.internet import reactor
+
+# Airport MIB.
+WIRELESS_NUMBER_OID = '.1.3.6.1.4.1.63.501.3.2.1.0'
+WIRELESS_CLIENT_TABLE_OID = '.1.3.6.1.4.1.63.501.3.2.2.1'
+# Columns in the client table: the MAC, then one per CLIENT_FIELDS.
+NUM_COLUMNS = 12
+# Client table cells asked for in the first GETBULK (~1.5KB of reply). Agents
+# truncate replies that don't fit in a packet; AirportPoller asks for the rest
+# of the table if that happens.
+MAX_REPETITIONS = 48
+
+CLIENT_FIELDS = ('type', 'rates', 'time', 'lastrefresh', 'signal', 'noise',
+    'rate', 'rx', 'tx', 'rxerr', 'txerr')
+AirportClient = collections.namedtuple('AirportClient',
+    ('mac',) + CLIENT_FIELDS)
+
+_pollSeconds = instruments.histogram('airport_poll_seconds',
+    'Time to read the client table from the Airport over SNMP.')
+_pollFailures = instruments.counter('airport_poll_failures_total',
+    'Polls of the Airport that failed.')
+_clients = instruments.gauge('airport_clients',
+    'Wireless clients of the Airport at the last poll.')
+
 
 def getNumClients(host):
   """Get the number of wireless clients connected to an Airport.
 
+  Blocks; use AirportPoller from the reactor thread.
+
   Args:
     host: hostname
   Returns:
     integer
   """
-  wirelessNumberOID = '.1.3.6.1.4.1.63.501.3.2.1.0'
-
+  import netsnmp
   logging.log(logging.DEBUG, "polling SNMP for client number")
-  retval = int(netsnmp.snmpget(netsnmp.Varbind(wirelessNumberOID), 
+  retval = int(netsnmp.snmpget(netsnmp.Varbind(WIRELESS_NUMBER_OID),
       Version=2, DestHost=host, 
       Community='public')[0])
 
@@ -30,10 +58,12 @@ def tableToDict(table, num):
   """Get a dictionary of SNMP data.
   
   The netsnmp library returns a tuple with all of the data, it is not in any
-  way formatted into rows. This function converts the data into a structured
-  dictionary, with each key being the MAC address of a wireless client. The
-  associated value will be a dictionary containing the information available
+  way formatted into rows: it's the MAC column, then one column per field.
+  This function slices the columns out in one pass and converts the data into
+  a dictionary, with each key being the MAC address of a wireless client. The
+  associated value will be an AirportClient with the information available
   about the client:
+      * mac         - MAC address (lowercased)
       * type        - 1 = sta, 2 = wds
       * rates       - the wireless rates available to the client
       * time        - length of time the client has been connected
@@ -47,54 +77,37 @@ def tableToDict(table, num):
       * txerr       - number of error packets transmitted by the client
 
   Args:
-    table: tuple returned from netsnmp
+    table: sequence returned from netsnmp or AirportPoller
     num: integer number of clients
   Returns:
-    dict: {mac_addr: properties_dict}
+    dict: {mac_addr: AirportClient}
   """
-  table = list(table)
-  clients = []
-  clientTable = {}
-
-  keys = ['type', 'rates', 'time', 'lastrefresh', 'signal', 'noise',
-          'rate', 'rx', 'tx', 'rxerr', 'txerr']
-
-  # First get the MACs
-  i = num
-  while i > 0:
-    data = table.pop(0).lower()
-    clients.append(data)
-    clientTable[data] = {}
-    logging.log(logging.DEBUG, "found client '%s'" % data)
-    i = i - 1
-
-  for cmd in keys:
-    i = 0
-    while i < num:
-      data = table.pop(0)
-      clientTable[clients[i]][cmd] = data
-      i = i + 1
-
-  return clientTable
+  if len(table) < num * NUM_COLUMNS:
+    raise ValueError('expected %d clients, client table has %d cells' % (
+        num, len(table)))
+  columns = [table[i * num:(i + 1) * num] for i in range(NUM_COLUMNS)]
+  columns[0] = macs = [mac.lower() for mac in columns[0]]
+  return dict(itertools.izip(macs, itertools.imap(AirportClient, *columns)))
 
 
 def getData(host):
   """Returns a dictionary populated with data about all wireless clients.
 
+  Blocks; use AirportPoller from the reactor thread.
+
   Args:
     host: airport host name
   Returns:
     dict, keyed by mac addr (lowercased)
   """
-  wirelessClientTableOID = '.1.3.6.1.4.1.63.501.3.2.2.1'
-
+  import netsnmp
   numClients = getNumClients(host)
 
   if numClients == 0:
     return {}
 
   logging.log(logging.DEBUG, "polling SNMP for client table")
-  clientTable = netsnmp.snmpwalk(netsnmp.Varbind(wirelessClientTableOID), 
+  clientTable = netsnmp.snmpwalk(netsnmp.Varbind(WIRELESS_CLIENT_TABLE_OID),
                                  Version=2, DestHost=host, 
                                  Community='public')
   clients = tableToDict(clientTable, numClients)
@@ -102,6 +115,88 @@ def getData(host):
   return clients
 
 
+class AirportPoller(object):
+  """Gets the wireless clients of an Airport without blocking the reactor.
+
+  poller = airport_snmp.AirportPoller('airport')
+  d = poller.getData()  # fires with the same dict getData() returns
+  """
+
+  def __init__(self, host, client=None, seconds=reactor.seconds):
+    """
+    Args:
+      host: airport host name
+      client: snmp.SnmpClient (optional)
+      seconds: reactor.seconds callback for testing.
+    """
+    self._host = host
+    self._client = client or snmp.SnmpClient()
+    self._seconds = seconds
+    self._numberOid = snmp.parseOid(WIRELESS_NUMBER_OID)
+    self._tableOid = snmp.parseOid(WIRELESS_CLIENT_TABLE_OID)
+
+  def getData(self):
+    """
+    Returns:
+      Deferred firing with a dict, keyed by mac addr (lowercased)
+    """
+    # GETNEXT on the parent of the client count returns the count, so a single
+    # GETBULK gets the count and the start of the client table.
+    d = self._client.getBulk(self._host,
+        [self._numberOid[:-1], self._tableOid],
+        nonRepeaters=1, maxRepetitions=MAX_REPETITIONS)
+    d.addCallback(self._handleFirstResponse)
+    d.addCallbacks(self._polled, self._pollFailed,
+        callbackArgs=(self._seconds(),))
+    return d
+
+  def _polled(self, clients, start):
+    _pollSeconds.observe(self._seconds() - start)
+    _clients.set(len(clients))
+    return clients
+
+  def _pollFailed(self, failure):
+    _pollFailures.inc()
+    return failure
+
+  def close(self):
+    return self._client.close()
+
+  def _handleFirstResponse(self, varbinds):
+    if not varbinds or varbinds[0][0] != self._numberOid:
+      raise snmp.DecodeError('no client count in response: %r' % varbinds)
+    numClients = varbinds[0][1]
+    if not isinstance(numClients, (int, long)):
+      raise snmp.DecodeError('bad client count: %r' % numClients)
+    return self._collect(varbinds[1:], [], numClients)
+
+  def _collect(self, varbinds, values, numClients):
+    wanted = numClients * NUM_COLUMNS
+    tableOidLen = len(self._tableOid)
+    for oid, value in varbinds:
+      if len(values) >= wanted:
+        break
+      if (oid[:tableOidLen] != self._tableOid or
+          isinstance(value, snmp.VarbindException)):
+        # Walked off the end of the table.
+        wanted = len(values)
+        break
+      values.append(value)
+
+    if len(values) < wanted and varbinds:
+      # The reply was truncated: carry on from the last oid.
+      d = self._client.getBulk(self._host, [varbinds[-1][0]],
+          maxRepetitions=wanted - len(values))
+      d.addCallback(self._collect, values, numClients)
+      return d
+
+    if len(values) < numClients * NUM_COLUMNS:
+      # Clients came or went between reading the count and the table.
+      raise snmp.DecodeError('expected %d clients, client table has %d cells'
+          % (numClients, len(values)))
+    return tableToDict(values, numClients)
+
+
 if __name__ == '__main__':
   clients = getData('hoth')
   for client, client_data in clients.iteritems():
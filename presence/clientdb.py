@@ -1,7 +1,83 @@
-from twisted.persisted import dirdbm
+from storage import journaldb
 
 DEFAULT_DB_PATH = '/tmp/presence'
 
 # TODO: path flag
 def getDb(db_path=DEFAULT_DB_PATH):
-  return dirdbm.DirDBM(db_path)
+  return journaldb.openDb(db_path)
+
+
+class ClientRegistry(object):
+  """In-memory set of registered MAC addresses in front of the client db.
+
+  Registrations made through the registry are written through to the db.
+  Changes made by other processes (e.g. edit_clientdb.py) are picked up by
+  refreshing the db, which is one stat() per lookup when nothing changed.
+
+  registry = clientdb.getRegistry()
+  registry.register('00:11:22:33:44:55', '192.168.1.10')
+  home = registry.macs.intersection(airport_clients)
+  """
+
+  def __init__(self, db_path=DEFAULT_DB_PATH):
+    self._db = getDb(db_path)
+    self.refresh()
+
+  @property
+  def macs(self):
+    """frozenset of registered MAC addresses."""
+    if self._db.refresh():
+      self.refresh()
+    return self._macs
+
+  def keys(self):
+    return self.macs
+
+  def __contains__(self, mac):
+    return mac in self.macs
+
+  def __len__(self):
+    return len(self.macs)
+
+  def refresh(self):
+    """Reload the registered MACs from the db."""
+    self._macs = frozenset(self._db.keys())
+
+  def register(self, mac, value):
+    self._db[mac] = value
+    self.refresh()
+
+  def unregister(self, mac):
+    """
+    Returns:
+      boolean: whether the mac was registered
+    """
+    if mac not in self.macs:
+      return False
+    del self._db[mac]
+    self.refresh()
+    return True
+
+  def update(self, register=None, unregister=()):
+    """Register and unregister many MACs at once.
+
+    The changes are written to the db as one batch, so other processes see
+    all of them or none.
+
+    Args:
+      register: dict of mac -> value to register.
+      unregister: macs to unregister.
+    """
+    changes = dict.fromkeys(unregister)
+    changes.update(register or {})
+    self._db.write(changes)
+    self.refresh()
+
+
+_registries = {}
+
+def getRegistry(db_path=DEFAULT_DB_PATH):
+  """Returns the process-wide ClientRegistry for db_path."""
+  if db_path not in _registries:
+    _registries[db_path] = ClientRegistry(db_path)
+  return _registries[db_path]
@@ -0,0 +1,148 @@
+"""Looks up the MAC addresses of hosts on the LAN in the kernel's neighbor
+(ARP) table.
+
+The table is read from /proc/net/arp into a dict and reread when it's more
+than ttlSecs old, so most lookups don't touch the file at all. A lookup that
+misses waits for a reread, since the kernel may still be resolving the
+address.
+
+table = neighbors.NeighborTable()
+table.lookup('192.168.1.10').addCallback(registerMac)
+"""
+
+import logging
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import log
+
+PROC_NET_ARP = '/proc/net/arp'
+TTL_SECS = 5
+# A miss rereads the table this often, this many times, before failing.
+RETRY_SECS = 0.2
+RETRIES = 3
+# Set in the flags column once the address is resolved.
+ATF_COM = 0x2
+
+
+class NeighborNotFound(Exception):
+  pass
+
+
+def parseProcNetArp(text):
+  """
+  Args:
+    text: contents of /proc/net/arp.
+  Returns:
+    {ip: lowercased mac} of the resolved entries.
+  """
+  table = {}
+  for line in text.splitlines()[1:]:
+    parts = line.split()
+    if len(parts) < 4:
+      continue
+    ip, flags, mac = parts[0], parts[2], parts[3]
+    try:
+      if not int(flags, 16) & ATF_COM:
+        continue
+    except ValueError:
+      continue
+    table[ip] = mac.lower()
+  return table
+
+
+class NeighborTable(object):
+
+  def __init__(self, path=PROC_NET_ARP, ttlSecs=TTL_SECS,
+      retrySecs=RETRY_SECS, retries=RETRIES, reactor=reactor):
+    """
+    Constructor.
+
+    Args:
+      path: file in the format of /proc/net/arp, e.g. a fake one for testing.
+      ttlSecs: how long to answer lookups from the last read of path.
+      retrySecs: how long a miss waits before rereading path.
+      retries: how many times a miss rereads path before failing.
+      reactor: reactor for testing.
+    """
+    self.path = path
+    self.ttlSecs = ttlSecs
+    self.retrySecs = retrySecs
+    self.retries = retries
+    self._reactor = reactor
+    self._table = {}
+    self._readTime = None
+    # {ip: [Deferred]} of lookups waiting for a reread, and {ip: rereads
+    # left} for each.
+    self._waiting = {}
+    self._retriesLeft = {}
+    self._retryCall = None
+
+  def refresh(self):
+    """Reread the table now."""
+    try:
+      with open(self.path) as f:
+        text = f.read()
+    except IOError as e:
+      log.msg('failed to read %s: %s' % (self.path, e),
+          logLevel=logging.ERROR)
+      return
+    self._table = parseProcNetArp(text)
+    self._readTime = self._reactor.seconds()
+
+  def get(self, ip):
+    """
+    Returns:
+      the mac address of ip, or None if it's not in the table.
+    """
+    if (self._readTime is None or
+        self._reactor.seconds() - self._readTime >= self.ttlSecs):
+      self.refresh()
+    return self._table.get(ip)
+
+  def lookup(self, ip):
+    """
+    Returns:
+      a Deferred that fires with the lowercased mac address of ip, or fails
+      with NeighborNotFound.
+    """
+    mac = self.get(ip)
+    if mac is not None:
+      return defer.succeed(mac)
+    d = defer.Deferred()
+    # Misses share the rereads, but each ip only gets so many of them.
+    if ip not in self._waiting:
+      self._waiting[ip] = []
+      self._retriesLeft[ip] = self.retries
+    self._waiting[ip].append(d)
+    if self._retryCall is None:
+      self._retryCall = self._reactor.callLater(self.retrySecs, self._retry)
+    return d
+
+  def _retry(self):
+    self._retryCall = None
+    self.refresh()
+    # Settle the bookkeeping before firing anything: callbacks may look up
+    # more ips.
+    found = []
+    notFound = []
+    for ip, deferreds in self._waiting.items():
+      mac = self._table.get(ip)
+      self._retriesLeft[ip] -= 1
+      if mac is None and self._retriesLeft[ip] > 0:
+        continue
+      del self._waiting[ip]
+      del self._retriesLeft[ip]
+      if mac is not None:
+        found.append((mac, deferreds))
+      else:
+        notFound.append((ip, deferreds))
+    for mac, deferreds in found:
+      for d in deferreds:
+        d.callback(mac)
+    for ip, deferreds in notFound:
+      for d in deferreds:
+        d.errback(NeighborNotFound('%s is not in %s' % (ip, self.path)))
+    # A callback may have looked up another ip and scheduled a reread.
+    if self._waiting and self._retryCall is None:
+      self._retryCall = self._reactor.callLater(self.retrySecs, self._retry)
@@ -1,78 +1,42 @@
 import cgi
+import hmac
+import json
 import logging
 import re
 
+from metrics import instruments
 from presence import airport_clientmonitor
 from presence import clientdb
+from presence import neighbors
 
-from twisted.internet import defer
-from twisted.internet import error
-from twisted.internet import protocol
 from twisted.internet import reactor
 from twisted.python import log
 from twisted.web import resource
 from twisted.web import server
 from twisted.python import failure
 
-ARP_BIN = '/usr/sbin/arp'
-
-class CannotGetIp(failure.Failure):
-  pass
-
-
-class GetMacForIpProcessProtocol(protocol.ProcessProtocol):
-  """Calls arp -n <p> address to get the mac address of a connected ip.
-  
-  In retrospect, writing this as an asynchronous process is overkill.
-  """
-  def __init__(self, ip, d):
-    self._ip = ip
-    self._d = d
-    self._data = []
-
-  def connectionMade(self):
-    self.transport.closeStdin()
-
-  def getExecutable(self):
-    return ARP_BIN
-
-  def getArgs(self):
-    return [ARP_BIN, '-n', self._ip]
-
-  def outReceived(self, data):
-    self._data.append(data)
-
-  def processEnded(self, status):
-    """Determine if the process succeded or failed. On success, calls the
-    deferred callback with a lowercased string of the mac address obtained."""
-    if isinstance(status.value, error.ProcessTerminated):
-      msg = 'Process exited with non-zero status code: %d' % status.value.exitCode
-      log.msg(msg, logLevel=logging.CRITICAL)
-      self._d.errback(CannotGetIp(msg))
-      return
-
-    # Parse the output
-    lines = ''.join(self._data).split('\n')
-    if len(lines) != 3:
-      msg = 'Cannot parse arp response: <pre>%s</pre>' % '\n'.join(lines)
-      log.msg(msg, logLevel=logging.CRITICAL)
-      self._d.errback(CannotGetIp(msg))
-      return
-
-    parts = re.split(r'\s+', lines[1])
-    if len(parts) < 3:
-      msg = 'malformed line: %s' % lines[1]
-      log.msg(msg, logLevel=logging.CRITICAL)
-      self._d.errback(CannotGetIp(msg))
-      return
-    self._d.callback(parts[2].lower())
+MAC_RE = re.compile(r'([0-9a-f]{2}:){5}[0-9a-f]{2}\Z')
 
+_lookupSeconds = instruments.histogram('registration_lookup_seconds',
+    'Time to look up the MAC address of a registration page visitor.')
+_lookupFailures = instruments.counter('registration_lookup_failures_total',
+    'Registration page visitors whose MAC address was not found.')
+_registrations = instruments.counter('registrations_total',
+    'Devices registered, through the page or the API.')
+_unregistrations = instruments.counter('unregistrations_total',
+    'Devices unregistered, through the page or the API.')
 
 class RegistrationResource(resource.Resource):
   """Base class for registration web resources."""
 
+  def __init__(self, neighborTable, seconds=reactor.seconds):
+    resource.Resource.__init__(self)
+    self._neighbors = neighborTable
+    self._seconds = seconds
+
   def handleLookupError(self, failure, request):
     """Called when the mac address looked fails."""
+    _lookupFailures.inc()
     request.write('failed to lookup your mac: %s' % failure)
 
   def handleLookup(self, mac, request):
@@ -83,20 +47,22 @@ class RegistrationResource(resource.Resource):
     return self.render_GET(request)
 
   def render_GET(self, request):
-    """Takes a request, spawns an arp lookup subprocess."""
+    """Takes a request, looks up the client's mac address."""
     if not request.path.endswith('/'):
       request.setResponseCode(404)
       return 'That resource is not here.'
 
-    d = defer.Deferred()
+    d = self._neighbors.lookup(request.getClientIP())
+    d.addBoth(self._lookedUp, self._seconds())
     d.addCallbacks(self.handleLookup, self.handleLookupError,
         callbackArgs=(request,), errbackArgs=(request,))
     d.addBoth(self.done, request)
-    lookupProcess = GetMacForIpProcessProtocol(request.getClientIP(), d)
-    reactor.spawnProcess(lookupProcess, lookupProcess.getExecutable(),
-        lookupProcess.getArgs())
     return server.NOT_DONE_YET
 
+  def _lookedUp(self, result, start):
+    _lookupSeconds.observe(self._seconds() - start)
+    return result
+
   def done(self, reason, request):
     if isinstance(reason, failure.Failure):
       log.err()
@@ -107,45 +73,44 @@ class RegistrationResource(resource.Resource):
 class RegistrationLookup(RegistrationResource):
   isLeaf = True
 
-  def __init__(self, form_action):
-    RegistrationResource.__init__(self)
+  def __init__(self, form_action, registry, neighborTable):
+    RegistrationResource.__init__(self, neighborTable)
     self._form_action = form_action
+    self._registry = registry
 
   def handleLookup(self, mac, request):
     """Displays the form to register or unregister a mac address.
 
-    Called when the mac address lookup subprocess completes.
+    Called when the mac address lookup completes.
 
     Args:
       mac: mac address as string
       request: request object
     """
     request.write('Your MAC address is: %s<p>' % mac)
-    db = None
-    try:
-      db = clientdb.getDb()
-      request.write('<form action="%s" method="post">' % self._form_action)
-      if mac in db:
-        request.write('You are registered.')
-        request.write('<input type="hidden" name="action" value="unregister">')
-        request.write('<input type="submit" value="unregister">')
-      else:
-        request.write('You are not registered.')
-        request.write('<input type="hidden" name="action" value="register">')
-        request.write('<input type="submit" value="register">')
-      request.write('</form>')
-    finally:
-      if db is not None:
-        db.close()
+    request.write('<form action="%s" method="post">' % self._form_action)
+    if mac in self._registry:
+      request.write('You are registered.')
+      request.write('<input type="hidden" name="action" value="unregister">')
+      request.write('<input type="submit" value="unregister">')
+    else:
+      request.write('You are not registered.')
+      request.write('<input type="hidden" name="action" value="register">')
+      request.write('<input type="submit" value="register">')
+    request.write('</form>')
 
 
 class RegistrationUpdate(RegistrationResource):
   isLeaf = True
 
+  def __init__(self, registry, neighborTable):
+    RegistrationResource.__init__(self, neighborTable)
+    self._registry = registry
+
   def handleLookup(self, mac, request):
     """Register or unregister a mac address.
 
-    Called when the mac address lookup subprocess completes.
+    Called when the mac address lookup completes.
     """
     postvars = request.args
     if ('action' not in postvars or 
@@ -153,20 +118,121 @@ class RegistrationUpdate(RegistrationResource):
       request.setResponseCode(500)
       request.write('missing args')
       return
-    db = clientdb.getDb()
     request.write('Your device (%s) is ' % mac)
     if postvars['action'][0] == 'register':
-      db[mac] = request.getClientIP()
+      self._registry.register(mac, request.getClientIP())
+      _registrations.inc()
     else:
-      if mac in db:
-        del db[mac]
+      if self._registry.unregister(mac):
+        _unregistrations.inc()
       request.write('un')
     request.write('registered.')
 
 
-def GetRegistrationResource():
+class ApiError(Exception):
+  pass
+
+
+class RegistrationApi(resource.Resource):
+  """JSON API to list, register and unregister many devices at once.
+
+  GET /api/ replies {"macs": [registered macs]}.
+
+  POST /api/ with {"register": {mac: value} or [macs], "unregister": [macs]}
+  applies all of the changes in one batch (or none of them, if any mac is
+  malformed or any value isn't an ASCII string) and replies with what
+  changed.
+
+  Requests must have an "Authorization: Bearer <token>" header.
+  """
+  isLeaf = True
+
+  def __init__(self, registry, token):
+    resource.Resource.__init__(self)
+    self._registry = registry
+    self._token = token
+
+  def render(self, request):
+    request.setHeader('Content-Type', 'application/json')
+    header = request.getHeader('authorization') or ''
+    if not hmac.compare_digest(header, 'Bearer ' + self._token):
+      request.setResponseCode(401)
+      return json.dumps({'error': 'bad token'})
+    try:
+      return json.dumps(resource.Resource.render(self, request))
+    except ApiError as e:
+      request.setResponseCode(400)
+      return json.dumps({'error': str(e)})
+
+  def render_GET(self, request):
+    return {'macs': sorted(self._registry.macs)}
+
+  def render_POST(self, request):
+    try:
+      body = json.loads(request.content.read())
+    except ValueError:
+      raise ApiError('body is not JSON')
+    if not isinstance(body, dict):
+      raise ApiError('body is not a JSON object')
+    register = body.get('register', {})
+    if isinstance(register, list):
+      register = dict((mac, '') for mac in register)
+    if not isinstance(register, dict):
+      raise ApiError('"register" must be an object or a list')
+    unregister = body.get('unregister', [])
+    if not isinstance(unregister, list):
+      raise ApiError('"unregister" must be a list')
+    register = dict((self.parseMac(mac), self.parseValue(mac, value))
+        for mac, value in register.items())
+    unregister = set(self.parseMac(mac) for mac in unregister)
+    registered = self._registry.macs
+    self._registry.update(register, unregister)
+    _registrations.inc(len(register))
+    _unregistrations.inc(len(unregister.intersection(registered)))
+    log.msg('API registered %d and unregistered %d devices for %s' % (
+        len(register), len(unregister), request.getClientIP()),
+        logLevel=logging.INFO)
+    return {
+        'registered': sorted(register),
+        'unregistered': sorted(unregister.intersection(registered)),
+        'count': len(self._registry),
+    }
+
+  def parseMac(self, mac):
+    """Returns mac lowercased, or raises ApiError if it isn't a mac."""
+    if not isinstance(mac, basestring) or not MAC_RE.match(mac.lower()):
+      raise ApiError('bad mac address %r' % (mac,))
+    return str(mac.lower())
+
+  def parseValue(self, mac, value):
+    """Returns value as a str, or raises ApiError if it isn't ASCII text."""
+    if isinstance(value, basestring):
+      try:
+        return str(value)
+      except UnicodeEncodeError:
+        pass
+    raise ApiError('value for %s must be an ASCII string' % mac)
+
+
+def GetRegistrationResource(registry=None, neighborTable=None,
+    apiToken=None):
+  """
+  Args:
+    registry: clientdb.ClientRegistry (optional)
+    neighborTable: neighbors.NeighborTable to look up macs in (optional)
+    apiToken: token that RegistrationApi requests must give, or None to
+        leave the API out.
+  """
+  if registry is None:
+    registry = clientdb.getRegistry()
+  if neighborTable is None:
+    neighborTable = neighbors.NeighborTable()
+  instruments.gauge('registered_clients', 'Registered devices.',
+      func=lambda: len(registry))
   root = resource.Resource()
-  lookup = RegistrationLookup('/register/')
+  lookup = RegistrationLookup('/register/', registry, neighborTable)
   root.putChild('', lookup)
-  root.putChild('register', RegistrationUpdate())
+  root.putChild('register', RegistrationUpdate(registry, neighborTable))
+  if apiToken:
+    root.putChild('api', RegistrationApi(registry, apiToken))
   return root
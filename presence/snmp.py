@@ -0,0 +1,411 @@
+"""Minimal asynchronous SNMPv2c client.
+
+Talks UDP directly on the reactor so a slow or unreachable agent doesn't
+block anything else. Supports GET, GETNEXT and GETBULK, with per-request
+timeouts and retries.
+
+client = snmp.SnmpClient()
+d = client.getBulk('airport', ['.1.3.6.1.4.1.63.501.3.2.2.1'],
+    maxRepetitions=20)
+d.addCallback(lambda varbinds: ...)  # [(oid_tuple, value), ...]
+"""
+
+import random
+
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.python import log
+
+SNMP_PORT = 161
+COMMUNITY = 'public'
+TIMEOUT_SECS = 2
+RETRIES = 2
+VERSION_2C = 1
+
+# Universal BER tags.
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+# SNMP application tags.
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIME_TICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+# Varbind exceptions.
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+# PDU tags.
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+RESPONSE = 0xA2
+SET_REQUEST = 0xA3
+GET_BULK_REQUEST = 0xA5
+
+CONSTRUCTED_TAGS = frozenset([SEQUENCE, GET_REQUEST, GET_NEXT_REQUEST,
+    RESPONSE, SET_REQUEST, GET_BULK_REQUEST])
+UNSIGNED_TAGS = frozenset([COUNTER32, GAUGE32, TIME_TICKS, COUNTER64])
+
+
+class Error(Exception):
+  pass
+
+
+class DecodeError(Error):
+  pass
+
+
+class SnmpTimeout(Error):
+  pass
+
+
+class SnmpError(Error):
+  """The agent replied with a non-zero error-status."""
+  def __init__(self, status, index):
+    Error.__init__(self, 'error-status %d at index %d' % (status, index))
+    self.status = status
+    self.index = index
+
+
+class VarbindException(object):
+  """noSuchObject, noSuchInstance or endOfMibView in place of a value."""
+  def __init__(self, tag, name):
+    self.tag = tag
+    self.name = name
+
+  def __repr__(self):
+    return self.name
+
+noSuchObject = VarbindException(NO_SUCH_OBJECT, 'noSuchObject')
+noSuchInstance = VarbindException(NO_SUCH_INSTANCE, 'noSuchInstance')
+endOfMibView = VarbindException(END_OF_MIB_VIEW, 'endOfMibView')
+VARBIND_EXCEPTIONS = dict((e.tag, e)
+    for e in (noSuchObject, noSuchInstance, endOfMibView))
+
+
+def parseOid(oid):
+  """Converts '.1.3.6.1' or (1, 3, 6, 1) to a tuple of ints."""
+  if isinstance(oid, tuple):
+    return oid
+  return tuple(int(arc) for arc in oid.strip('.').split('.'))
+
+
+def formatOid(oid):
+  return '.' + '.'.join(str(arc) for arc in oid)
+
+
+def encodeLength(length):
+  if length < 0x80:
+    return chr(length)
+  octets = []
+  while length:
+    octets.insert(0, chr(length & 0xFF))
+    length >>= 8
+  return chr(0x80 | len(octets)) + ''.join(octets)
+
+
+def encodeTlv(tag, value):
+  return chr(tag) + encodeLength(len(value)) + value
+
+
+def encodeInteger(value, tag=INTEGER):
+  octets = []
+  while True:
+    octets.insert(0, chr(value & 0xFF))
+    value >>= 8
+    # Stop once the remaining value is just the sign extension.
+    if ((value == 0 and not ord(octets[0]) & 0x80) or
+        (value == -1 and ord(octets[0]) & 0x80)):
+      break
+  return encodeTlv(tag, ''.join(octets))
+
+
+def encodeOid(oid):
+  oid = parseOid(oid)
+  arcs = [oid[0] * 40 + oid[1]] + list(oid[2:])
+  octets = []
+  for arc in arcs:
+    encoded = [chr(arc & 0x7F)]
+    arc >>= 7
+    while arc:
+      encoded.insert(0, chr(0x80 | (arc & 0x7F)))
+      arc >>= 7
+    octets.extend(encoded)
+  return encodeTlv(OBJECT_IDENTIFIER, ''.join(octets))
+
+
+def encodeValue(value):
+  if value is None:
+    return encodeTlv(NULL, '')
+  if isinstance(value, VarbindException):
+    return encodeTlv(value.tag, '')
+  if isinstance(value, bool):
+    value = int(value)
+  if isinstance(value, (int, long)):
+    return encodeInteger(value)
+  if isinstance(value, tuple):
+    return encodeOid(value)
+  return encodeTlv(OCTET_STRING, str(value))
+
+
+def encodeVarbinds(varbinds):
+  return encodeTlv(SEQUENCE, ''.join(
+      encodeTlv(SEQUENCE, encodeOid(oid) + encodeValue(value))
+      for oid, value in varbinds))
+
+
+def encodeMessage(pduType, requestId, varbinds, errorStatus=0, errorIndex=0,
+    community=COMMUNITY):
+  """Encode an SNMPv2c message.
+
+  For GETBULK, errorStatus and errorIndex are non-repeaters and
+  max-repetitions.
+
+  Args:
+    pduType: one of the PDU tags, e.g. GET_BULK_REQUEST
+    requestId: integer
+    varbinds: [(oid, value)]; value is None in requests
+  Returns:
+    string
+  """
+  pdu = encodeTlv(pduType, encodeInteger(requestId) +
+      encodeInteger(errorStatus) + encodeInteger(errorIndex) +
+      encodeVarbinds(varbinds))
+  return encodeTlv(SEQUENCE, encodeInteger(VERSION_2C) +
+      encodeTlv(OCTET_STRING, community) + pdu)
+
+
+def decodeHeader(data, offset=0):
+  """Decode the tag and length octets of a TLV.
+
+  Returns:
+    (tag, offset of the value, offset of the next TLV)
+  """
+  try:
+    tag = ord(data[offset])
+    length = ord(data[offset + 1])
+    offset += 2
+    if length & 0x80:
+      numOctets = length & 0x7F
+      length = 0
+      for octet in data[offset:offset + numOctets]:
+        length = (length << 8) | ord(octet)
+      offset += numOctets
+  except IndexError:
+    raise DecodeError('truncated header at offset %d' % offset)
+  end = offset + length
+  if end > len(data):
+    raise DecodeError('truncated value at offset %d' % offset)
+  return tag, offset, end
+
+
+def decodeTlv(data, offset=0):
+  """Decode one TLV.
+
+  Returns:
+    (tag, value, offset of the next TLV); constructed values are lists.
+  """
+  tag, offset, end = decodeHeader(data, offset)
+  raw = data[offset:end]
+
+  if tag in CONSTRUCTED_TAGS:
+    value = []
+    while offset < end:
+      _, child, offset = decodeTlv(data, offset)
+      value.append(child)
+  elif tag == INTEGER:
+    value = 0
+    for octet in raw:
+      value = (value << 8) | ord(octet)
+    if raw and ord(raw[0]) & 0x80:
+      value -= 1 << (8 * len(raw))
+  elif tag in UNSIGNED_TAGS:
+    value = 0
+    for octet in raw:
+      value = (value << 8) | ord(octet)
+  elif tag == OBJECT_IDENTIFIER:
+    arcs = []
+    arc = 0
+    for octet in raw:
+      arc = (arc << 7) | (ord(octet) & 0x7F)
+      if not ord(octet) & 0x80:
+        arcs.append(arc)
+        arc = 0
+    if not arcs:
+      raise DecodeError('empty oid at offset %d' % offset)
+    first = min(arcs[0] // 40, 2)
+    value = (first, arcs[0] - first * 40) + tuple(arcs[1:])
+  elif tag == IP_ADDRESS:
+    value = '.'.join(str(ord(octet)) for octet in raw)
+  elif tag == NULL:
+    value = None
+  elif tag in VARBIND_EXCEPTIONS:
+    value = VARBIND_EXCEPTIONS[tag]
+  else:
+    # OCTET STRING, Opaque and anything else.
+    value = raw
+  return tag, value, end
+
+
+def decodeMessage(data):
+  """Decode an SNMPv2c message.
+
+  Returns:
+    (community, pduType, requestId, errorStatus, errorIndex, varbinds)
+  """
+  tag, offset, _ = decodeHeader(data)
+  if tag != SEQUENCE:
+    raise DecodeError('not an SNMP message')
+  _, version, offset = decodeTlv(data, offset)
+  if version != VERSION_2C:
+    raise DecodeError('unsupported version %s' % version)
+  _, community, offset = decodeTlv(data, offset)
+  pduType, pdu, _ = decodeTlv(data, offset)
+  if len(pdu) != 4 or not all(len(varbind) == 2 for varbind in pdu[3]):
+    raise DecodeError('malformed pdu')
+  requestId, errorStatus, errorIndex, varbinds = pdu
+  return (community, pduType, requestId, errorStatus, errorIndex,
+      [tuple(varbind) for varbind in varbinds])
+
+
+class _Request(object):
+  def __init__(self, requestId, address, packet, deferred):
+    self.requestId = requestId
+    self.address = address
+    self.packet = packet
+    self.deferred = deferred
+    self.attempts = 0
+    self.timeoutCall = None
+
+
+class SnmpClient(protocol.DatagramProtocol):
+  """Sends SNMP requests and matches responses to them by request id.
+
+  Starts listening on an ephemeral UDP port on the first request.
+  """
+  noisy = False
+
+  def __init__(self, community=COMMUNITY, timeout=TIMEOUT_SECS,
+      retries=RETRIES, port=SNMP_PORT, reactor=reactor):
+    """
+    Args:
+      community: SNMP community string.
+      timeout: seconds to wait for each attempt.
+      retries: number of times to resend a request before giving up.
+      port: agent UDP port.
+      reactor: reactor for testing.
+    """
+    self._community = community
+    self._timeout = timeout
+    self._retries = retries
+    self._agentPort = port
+    self._reactor = reactor
+    self._listeningPort = None
+    self._pending = {}
+    self._nextRequestId = random.randint(1, 0x3FFFFFFF)
+    # hostname -> IP address; agents must be addressed by IP over UDP.
+    self._addresses = {}
+
+  def get(self, host, oids):
+    """
+    Returns:
+      Deferred firing with [(oid_tuple, value)]
+    """
+    return self._request(host, GET_REQUEST,
+        [(parseOid(oid), None) for oid in oids])
+
+  def getNext(self, host, oids):
+    return self._request(host, GET_NEXT_REQUEST,
+        [(parseOid(oid), None) for oid in oids])
+
+  def getBulk(self, host, oids, nonRepeaters=0, maxRepetitions=10):
+    """GETNEXT on the first nonRepeaters oids, then up to maxRepetitions
+    successors of each of the rest, in one round trip."""
+    return self._request(host, GET_BULK_REQUEST,
+        [(parseOid(oid), None) for oid in oids],
+        errorStatus=nonRepeaters, errorIndex=maxRepetitions)
+
+  def close(self):
+    for request in self._pending.values():
+      self._fail(request, SnmpTimeout('client closed'))
+    if self._listeningPort is not None:
+      port, self._listeningPort = self._listeningPort, None
+      return port.stopListening()
+
+  def _request(self, host, pduType, varbinds, errorStatus=0, errorIndex=0):
+    if self._listeningPort is None:
+      self._listeningPort = self._reactor.listenUDP(0, self)
+    requestId = self._nextRequestId
+    self._nextRequestId = (self._nextRequestId % 0x7FFFFFFF) + 1
+    packet = encodeMessage(pduType, requestId, varbinds, errorStatus,
+        errorIndex, self._community)
+    d = defer.Deferred()
+    d2 = self._resolve(host)
+    def send(ip):
+      request = _Request(requestId, (ip, self._agentPort), packet, d)
+      self._pending[requestId] = request
+      self._send(request)
+    def resolveFailed(failure):
+      d.errback(failure)
+    d2.addCallbacks(send, resolveFailed)
+    return d
+
+  def _resolve(self, host):
+    if host in self._addresses:
+      return defer.succeed(self._addresses[host])
+    d = self._reactor.resolve(host)
+    def cache(ip):
+      self._addresses[host] = ip
+      return ip
+    return d.addCallback(cache)
+
+  def _send(self, request):
+    request.attempts += 1
+    self.transport.write(request.packet, request.address)
+    request.timeoutCall = self._reactor.callLater(
+        self._timeout, self._timedOut, request)
+
+  def _timedOut(self, request):
+    request.timeoutCall = None
+    if request.attempts <= self._retries:
+      log.msg('SNMP request %d to %s timed out, retrying' % (
+          request.requestId, request.address[0]))
+      self._send(request)
+      return
+    # The agent may have moved; look it up again next time.
+    for host, ip in self._addresses.items():
+      if ip == request.address[0]:
+        del self._addresses[host]
+    self._fail(request, SnmpTimeout('no response from %s after %d attempts' %
+        (request.address[0], request.attempts)))
+
+  def _fail(self, request, exception):
+    del self._pending[request.requestId]
+    if request.timeoutCall is not None:
+      request.timeoutCall.cancel()
+      request.timeoutCall = None
+    request.deferred.errback(exception)
+
+  def datagramReceived(self, data, address):
+    try:
+      (community, pduType, requestId, errorStatus, errorIndex,
+          varbinds) = decodeMessage(data)
+    except (DecodeError, ValueError, TypeError) as e:
+      log.msg('bad SNMP packet from %s: %s' % (address[0], e))
+      return
+    request = self._pending.get(requestId)
+    if request is None or pduType != RESPONSE:
+      # Probably the reply to an attempt that already timed out.
+      return
+    del self._pending[requestId]
+    request.timeoutCall.cancel()
+    request.timeoutCall = None
+    if errorStatus:
+      request.deferred.errback(SnmpError(errorStatus, errorIndex))
+    else:
+      request.deferred.callback(varbinds)
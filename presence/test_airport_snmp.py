@@ -0,0 +1,70 @@
+#!/usr/bin/trial
+
+import airport_snmp
+import snmp
+from testing import fake_snmp_agent
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+MACS = ['00:11:22:33:44:%02x' % i for i in range(7)]
+
+
+class TableToDictTest(unittest.TestCase):
+  def testColumns(self):
+    table = ('AA:BB', 'cc:dd') + tuple(range(22))
+    clients = airport_snmp.tableToDict(table, 2)
+    self.assertEquals(['aa:bb', 'cc:dd'], sorted(clients))
+    self.assertEquals(airport_snmp.AirportClient('aa:bb', *range(0, 22, 2)),
+        clients['aa:bb'])
+    self.assertEquals(3, clients['cc:dd'].rates)
+    self.assertEquals(21, clients['cc:dd'].txerr)
+
+  def testNoClients(self):
+    self.assertEquals({}, airport_snmp.tableToDict((), 0))
+
+  def testShortTable(self):
+    self.assertRaises(ValueError, airport_snmp.tableToDict, ('aa:bb', 1), 1)
+
+
+class AirportPollerTest(unittest.TestCase):
+  def setUp(self):
+    self.agent = fake_snmp_agent.FakeSnmpAgent(
+        fake_snmp_agent.airportMib(MACS))
+    self.agentPort = reactor.listenUDP(0, self.agent, interface='127.0.0.1')
+    self.poller = airport_snmp.AirportPoller('127.0.0.1',
+        snmp.SnmpClient(port=self.agentPort.getHost().port))
+
+  def tearDown(self):
+    self.poller.close()
+    return self.agentPort.stopListening()
+
+  def checkClients(self, clients):
+    self.assertEquals(sorted(MACS), sorted(clients))
+    self.assertEquals(2000, clients[MACS[0]].type)
+    self.assertEquals(12006, clients[MACS[6]].txerr)
+
+  def testOneRoundTrip(self):
+    self.patch(airport_snmp, 'MAX_REPETITIONS', 100)
+    d = self.poller.getData()
+    d.addCallback(self.checkClients)
+    d.addCallback(lambda _: self.assertEquals(1, self.agent.requests))
+    return d
+
+  def testTruncatedReplies(self):
+    self.agent.maxVarbinds = 10
+    d = self.poller.getData()
+    d.addCallback(self.checkClients)
+    d.addCallback(lambda _: self.assertEquals(
+        len(MACS) * airport_snmp.NUM_COLUMNS / 10 + 1, self.agent.requests))
+    return d
+
+  def testNoClients(self):
+    self.agent.mib = fake_snmp_agent.airportMib([])
+    d = self.poller.getData()
+    d.addCallback(self.assertEquals, {})
+    return d
+
+  def testClientTableShrank(self):
+    self.agent.mib[snmp.parseOid(airport_snmp.WIRELESS_NUMBER_OID)] = 8
+    d = self.poller.getData()
+    return self.assertFailure(d, snmp.DecodeError)
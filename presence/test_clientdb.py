@@ -0,0 +1,51 @@
+#!/usr/bin/trial
+
+import clientdb
+from twisted.trial import unittest
+
+
+class ClientRegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.path = self.mktemp()
+    self.db = clientdb.getDb(self.path)
+    self.db['00:11:22:33:44:55'] = '192.168.1.10'
+    self.registry = clientdb.ClientRegistry(self.path)
+
+  def testLoad(self):
+    self.assertEquals(frozenset(['00:11:22:33:44:55']), self.registry.macs)
+    self.assertTrue('00:11:22:33:44:55' in self.registry)
+    self.assertEquals(1, len(self.registry))
+
+  def testWriteThrough(self):
+    self.registry.register('aa:bb:cc:dd:ee:ff', '192.168.1.11')
+    self.assertTrue('aa:bb:cc:dd:ee:ff' in self.registry)
+    self.db.refresh()
+    self.assertEquals('192.168.1.11', self.db['aa:bb:cc:dd:ee:ff'])
+    self.assertTrue(self.registry.unregister('00:11:22:33:44:55'))
+    self.assertFalse(self.registry.unregister('00:11:22:33:44:55'))
+    self.db.refresh()
+    self.assertFalse('00:11:22:33:44:55' in self.db)
+    self.assertEquals(frozenset(['aa:bb:cc:dd:ee:ff']), self.registry.macs)
+
+  def testNoticesOtherWriters(self):
+    self.registry.macs
+    self.db['aa:bb:cc:dd:ee:ff'] = '192.168.1.11'
+    del self.db['00:11:22:33:44:55']
+    self.assertEquals(frozenset(['aa:bb:cc:dd:ee:ff']), self.registry.macs)
+
+  def testDoesNotRelistUnchangedDb(self):
+    self.registry.macs
+    self.patch(self.registry._db, 'keys', lambda: self.fail('relisted'))
+    self.assertEquals(frozenset(['00:11:22:33:44:55']), self.registry.macs)
+
+  def testUpdate(self):
+    self.registry.update({'aa:bb:cc:dd:ee:ff': '192.168.1.11'},
+        ['00:11:22:33:44:55', '00:11:22:33:44:66'])
+    self.assertEquals(frozenset(['aa:bb:cc:dd:ee:ff']), self.registry.macs)
+    db = clientdb.getDb(self.path)
+    self.assertEquals(['aa:bb:cc:dd:ee:ff'], db.keys())
+    self.assertEquals('192.168.1.11', db['aa:bb:cc:dd:ee:ff'])
+
+  def testGetRegistry(self):
+    self.assertIdentical(
+        clientdb.getRegistry(self.path), clientdb.getRegistry(self.path))
@@ -0,0 +1,119 @@
+#!/usr/bin/trial
+
+import neighbors
+from twisted.internet import task
+from twisted.trial import unittest
+
+HEADER = ('IP address       HW type     Flags       HW address            '
+          'Mask     Device\n')
+
+
+def arpLine(ip, mac, flags='0x2'):
+  return '%-16s 0x1         %-11s %s     *        eth0\n' % (ip, flags, mac)
+
+
+class NeighborTableTest(unittest.TestCase):
+  def setUp(self):
+    self.path = self.mktemp()
+    self.writeTable(arpLine('192.168.1.10', '00:11:22:AA:BB:CC'))
+    self.clock = task.Clock()
+    self.table = neighbors.NeighborTable(self.path, ttlSecs=5,
+        retrySecs=0.2, retries=3, reactor=self.clock)
+
+  def writeTable(self, *lines):
+    with open(self.path, 'w') as f:
+      f.write(HEADER + ''.join(lines))
+
+  def lookup(self, ip):
+    results = []
+    self.table.lookup(ip).addBoth(results.append)
+    return results
+
+  def testParse(self):
+    self.assertEquals({'192.168.1.10': '00:11:22:aa:bb:cc',
+                       '192.168.1.12': '00:11:22:33:44:66'},
+        neighbors.parseProcNetArp(HEADER +
+            arpLine('192.168.1.10', '00:11:22:AA:BB:CC') +
+            # Still resolving.
+            arpLine('192.168.1.11', '00:00:00:00:00:00', flags='0x0') +
+            # Permanent.
+            arpLine('192.168.1.12', '00:11:22:33:44:66', flags='0x6') +
+            'garbage\n'))
+
+  def testLookup(self):
+    self.assertEquals(['00:11:22:aa:bb:cc'], self.lookup('192.168.1.10'))
+
+  def testAnsweredFromCacheUntilTtl(self):
+    self.lookup('192.168.1.10')
+    self.writeTable(arpLine('192.168.1.10', '00:11:22:33:44:55'))
+    self.clock.advance(4)
+    self.assertEquals(['00:11:22:aa:bb:cc'], self.lookup('192.168.1.10'))
+    self.clock.advance(1)
+    self.assertEquals(['00:11:22:33:44:55'], self.lookup('192.168.1.10'))
+
+  def testMissRereads(self):
+    first = self.lookup('192.168.1.20')
+    second = self.lookup('192.168.1.20')
+    self.assertEquals([], first)
+    self.writeTable(arpLine('192.168.1.20', '00:11:22:33:44:77'))
+    self.clock.advance(0.2)
+    self.assertEquals(['00:11:22:33:44:77'], first)
+    self.assertEquals(['00:11:22:33:44:77'], second)
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testMissFails(self):
+    results = self.lookup('192.168.1.20')
+    self.clock.pump([0.2] * 3)
+    self.assertEquals(1, len(results))
+    results[0].trap(neighbors.NeighborNotFound)
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testMissesDontExtendEachOther(self):
+    first = self.lookup('192.168.1.20')
+    # A steady stream of other misses doesn't keep the first one waiting.
+    for i in range(3):
+      self.lookup('192.168.1.%d' % (30 + i))
+      self.clock.advance(0.2)
+    self.assertEquals(1, len(first))
+    first[0].trap(neighbors.NeighborNotFound)
+
+  def lookupFromCallback(self, ip, afterIp):
+    """Look up ip from the callback of a lookup of afterIp."""
+    results = []
+    self.table.lookup(afterIp).addCallback(
+        lambda _: self.table.lookup(ip).addBoth(results.append))
+    return results
+
+  def testCallbackLooksUpWaitingIp(self):
+    first = self.lookup('192.168.1.21')
+    second = self.lookupFromCallback('192.168.1.21', '192.168.1.20')
+    self.writeTable(arpLine('192.168.1.20', '00:11:22:33:44:77'))
+    self.clock.advance(0.2)
+    # The second lookup joins the first, and fails with it.
+    self.clock.pump([0.2] * 2)
+    self.assertEquals(1, len(first))
+    self.assertEquals(1, len(second))
+    second[0].trap(neighbors.NeighborNotFound)
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testCallbackLooksUpFailedIp(self):
+    first = self.lookup('192.168.1.21')
+    second = self.lookupFromCallback('192.168.1.21', '192.168.1.20')
+    self.clock.pump([0.2] * 2)
+    self.writeTable(arpLine('192.168.1.20', '00:11:22:33:44:77'))
+    self.clock.advance(0.2)
+    self.assertEquals(1, len(first))
+    # The second lookup gets rereads of its own.
+    self.assertEquals([], second)
+    self.clock.pump([0.2] * 3)
+    self.assertEquals(1, len(second))
+    second[0].trap(neighbors.NeighborNotFound)
+    self.assertEquals([], self.clock.getDelayedCalls())
+
+  def testMissingFile(self):
+    table = neighbors.NeighborTable(self.mktemp(), retries=1,
+        reactor=self.clock)
+    results = []
+    table.lookup('192.168.1.10').addErrback(results.append)
+    self.clock.advance(neighbors.RETRY_SECS)
+    results[0].trap(neighbors.NeighborNotFound)
@@ -0,0 +1,122 @@
+#!/usr/bin/trial
+
+import clientdb
+import json
+import neighbors
+import registration
+from twisted.internet import address
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.web.test import test_web
+import StringIO
+
+ARP_TABLE = (
+    'IP address       HW type     Flags       HW address            '
+    'Mask     Device\n'
+    '192.168.1.10     0x1         0x2         00:11:22:33:44:55     '
+    '*        eth0\n')
+
+
+class RegistrationTest(unittest.TestCase):
+  def setUp(self):
+    arpPath = self.mktemp()
+    with open(arpPath, 'w') as f:
+      f.write(ARP_TABLE)
+    self.clock = task.Clock()
+    self.registry = clientdb.getRegistry(self.mktemp())
+    self.root = registration.GetRegistrationResource(self.registry,
+        neighbors.NeighborTable(arpPath, reactor=self.clock),
+        apiToken='secret')
+
+  def render(self, child, ip='192.168.1.10', **args):
+    request = test_web.DummyRequest([''])
+    request.path = '/%s/' % child if child else '/'
+    request.client = address.IPv4Address('TCP', ip, 12345)
+    for name, value in args.items():
+      request.addArg(name, value)
+    self.root.getChildWithDefault(child, request).render(request)
+    return request
+
+  def testLookup(self):
+    request = self.render('')
+    self.assertTrue(request.finished)
+    page = ''.join(request.written)
+    self.assertIn('00:11:22:33:44:55', page)
+    self.assertIn('You are not registered.', page)
+
+  def testRegister(self):
+    request = self.render('register', action='register')
+    self.assertIn('registered.', ''.join(request.written))
+    self.assertIn('00:11:22:33:44:55', self.registry)
+
+  def testUnknownClient(self):
+    request = self.render('', ip='192.168.1.99')
+    self.clock.pump([neighbors.RETRY_SECS] * neighbors.RETRIES)
+    self.assertTrue(request.finished)
+    self.assertIn('failed to lookup your mac', ''.join(request.written))
+
+
+class RegistrationApiTest(unittest.TestCase):
+  def setUp(self):
+    self.registry = clientdb.getRegistry(self.mktemp())
+    self.registry.register('00:11:22:33:44:55', '192.168.1.10')
+    self.api = registration.RegistrationApi(self.registry, 'secret')
+
+  def call(self, method, body=None, token='secret'):
+    request = test_web.DummyRequest([''])
+    request.method = method
+    if token:
+      request.headers['authorization'] = 'Bearer ' + token
+    request.content = StringIO.StringIO(json.dumps(body))
+    return request, json.loads(self.api.render(request))
+
+  def testList(self):
+    request, reply = self.call('GET')
+    self.assertEquals({'macs': ['00:11:22:33:44:55']}, reply)
+
+  def testBadToken(self):
+    request, reply = self.call('GET', token='guess')
+    self.assertEquals(401, request.responseCode)
+    request, reply = self.call('GET', token=None)
+    self.assertEquals(401, request.responseCode)
+
+  def testBatch(self):
+    refreshes = []
+    refresh = self.registry.refresh
+    self.patch(self.registry, 'refresh',
+        lambda: refreshes.append(1) or refresh())
+    request, reply = self.call('POST', {
+        'register': ['00:11:22:33:44:66', 'AA:BB:CC:DD:EE:FF'],
+        'unregister': ['00:11:22:33:44:55', '00:11:22:33:44:77'],
+    })
+    self.assertEquals({
+        'registered': ['00:11:22:33:44:66', 'aa:bb:cc:dd:ee:ff'],
+        'unregistered': ['00:11:22:33:44:55'],
+        'count': 2,
+    }, reply)
+    self.assertEquals(frozenset(['00:11:22:33:44:66', 'aa:bb:cc:dd:ee:ff']),
+        self.registry.macs)
+    self.assertEquals([1], refreshes)
+
+  def testBadMacChangesNothing(self):
+    request, reply = self.call('POST', {
+        'register': {'00:11:22:33:44:66': 'laptop', 'nonsense': 'phone'}})
+    self.assertEquals(400, request.responseCode)
+    self.assertIn('nonsense', reply['error'])
+    self.assertEquals(frozenset(['00:11:22:33:44:55']), self.registry.macs)
+    # $ would match before a trailing newline.
+    request, reply = self.call('POST', {'register': ['00:11:22:33:44:66\n']})
+    self.assertEquals(400, request.responseCode)
+    self.assertEquals(frozenset(['00:11:22:33:44:55']), self.registry.macs)
+
+  def testBadValueChangesNothing(self):
+    for value in (u'caf\xe9', 42, None):
+      request, reply = self.call('POST', {
+          'register': {'00:11:22:33:44:66': value}})
+      self.assertEquals(400, request.responseCode)
+      self.assertIn('00:11:22:33:44:66', reply['error'])
+    self.assertEquals(frozenset(['00:11:22:33:44:55']), self.registry.macs)
+
+  def testBadBody(self):
+    request, reply = self.call('POST', ['00:11:22:33:44:66'])
+    self.assertEquals(400, request.responseCode)
@@ -0,0 +1,86 @@
+#!/usr/bin/trial
+
+import snmp
+from testing import fake_snmp_agent
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class CodecTest(unittest.TestCase):
+  def testIntegers(self):
+    for value in (0, 1, 127, 128, 255, 256, -1, -128, -129, 0x7FFFFFFF):
+      tag, decoded, end = snmp.decodeTlv(snmp.encodeInteger(value))
+      self.assertEquals((snmp.INTEGER, value), (tag, decoded))
+    self.assertEquals('\x02\x01\x7f', snmp.encodeInteger(127))
+    self.assertEquals('\x02\x02\x00\x80', snmp.encodeInteger(128))
+
+  def testOid(self):
+    oid = snmp.parseOid('.1.3.6.1.4.1.63.501.3.2.2.1')
+    self.assertEquals((1, 3, 6, 1, 4, 1, 63, 501, 3, 2, 2, 1), oid)
+    self.assertEquals('\x06\x0b\x2b\x06\x01\x04\x01\x3f\x83\x75\x03\x02\x02',
+        snmp.encodeOid(oid[:-1]))
+    self.assertEquals(oid, snmp.decodeTlv(snmp.encodeOid(oid))[1])
+    self.assertEquals('.1.3.6.1', snmp.formatOid((1, 3, 6, 1)))
+
+  def testLongLength(self):
+    value = 'x' * 300
+    self.assertEquals(value, snmp.decodeTlv(snmp.encodeValue(value))[1])
+
+  def testMessage(self):
+    varbinds = [((1, 3, 6, 1), 42), ((1, 3, 6, 2), 'hello'),
+        ((1, 3, 6, 3), None), ((1, 3, 6, 4), snmp.endOfMibView)]
+    packet = snmp.encodeMessage(snmp.RESPONSE, 1234, varbinds,
+        community='secret')
+    self.assertEquals(('secret', snmp.RESPONSE, 1234, 0, 0, varbinds),
+        snmp.decodeMessage(packet))
+
+  def testTruncated(self):
+    packet = snmp.encodeMessage(snmp.GET_REQUEST, 1, [((1, 3, 6), None)])
+    self.assertRaises(snmp.DecodeError, snmp.decodeMessage, packet[:-2])
+
+
+class SnmpClientTest(unittest.TestCase):
+  def setUp(self):
+    self.agent = fake_snmp_agent.FakeSnmpAgent({
+        (1, 3, 6, 1, 1): 10, (1, 3, 6, 1, 2): 'a', (1, 3, 6, 1, 3): 'b',
+        (1, 3, 6, 1, 4): 'c'})
+    self.agentPort = reactor.listenUDP(0, self.agent, interface='127.0.0.1')
+    self.client = snmp.SnmpClient(port=self.agentPort.getHost().port)
+
+  def tearDown(self):
+    self.client.close()
+    return self.agentPort.stopListening()
+
+  def testGet(self):
+    d = self.client.get('127.0.0.1', ['.1.3.6.1.1', '.1.3.6.1.9'])
+    d.addCallback(self.assertEquals,
+        [((1, 3, 6, 1, 1), 10), ((1, 3, 6, 1, 9), snmp.noSuchObject)])
+    return d
+
+  def testGetBulk(self):
+    d = self.client.getBulk('127.0.0.1', ['.1.3.6', '.1.3.6.1.1'],
+        nonRepeaters=1, maxRepetitions=2)
+    d.addCallback(self.assertEquals, [((1, 3, 6, 1, 1), 10),
+        ((1, 3, 6, 1, 2), 'a'), ((1, 3, 6, 1, 3), 'b')])
+    return d
+
+  def testRetry(self):
+    self.agent.dropRequests = 1
+    self.client._timeout = 0.1
+    d = self.client.getNext('127.0.0.1', ['.1.3.6.1.3'])
+    d.addCallback(self.assertEquals, [((1, 3, 6, 1, 4), 'c')])
+    d.addCallback(lambda _: self.assertEquals(2, self.agent.requests))
+    return d
+
+  def testTimeout(self):
+    clock = task.Clock()
+    clock.listenUDP = reactor.listenUDP
+    clock.resolve = reactor.resolve
+    client = snmp.SnmpClient(retries=2, port=9, reactor=clock)
+    d = client.get('127.0.0.1', ['.1.3.6.1.1'])
+    for _ in range(3):
+      clock.advance(snmp.TIMEOUT_SECS)
+    self.assertFailure(d, snmp.SnmpTimeout)
+    d.addBoth(lambda result: client.close() and result)
+    return d
@@ -0,0 +1,226 @@
+"""Speaks announcements without blocking the reactor.
+
+One long-lived worker process (tts_worker.py, started with
+reactor.spawnProcess) runs the TTS and the audio player, one message at a
+time so announcements don't talk over each other. Messages wait in a short
+queue: a newer message with the same key replaces a queued one, and when the
+queue is full the oldest message is dropped.
+
+Phrases that are spoken often can be rendered to audio files ahead of time,
+after which speaking them is just a playback.
+
+speaker = speaker.Speaker(cacheDir)
+speaker.prerender(['Closing the door.'])
+speaker.say('Closing the door.', key='garage')
+reactor.addSystemEventTrigger('before', 'shutdown', speaker.stop)
+"""
+
+import collections
+import hashlib
+import json
+import os
+import sys
+
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.python import log
+
+TTS_COMMAND = ('espeak',)
+PLAY_COMMAND = ('aplay', '-q')
+# Messages waiting to be spoken. Beyond this, the oldest are dropped.
+MAX_QUEUE = 3
+WORKER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'tts_worker.py')
+
+
+class _WorkerProtocol(protocol.ProcessProtocol):
+  """Passes the worker's reply lines to the speaker."""
+
+  def __init__(self, speaker):
+    self._speaker = speaker
+    self._buffer = ''
+
+  def outReceived(self, data):
+    self._buffer += data
+    while '\n' in self._buffer:
+      line, self._buffer = self._buffer.split('\n', 1)
+      self._speaker._handleReply(line)
+
+  def errReceived(self, data):
+    log.msg('speech worker: %s' % data.rstrip())
+
+  def processEnded(self, reason):
+    self._speaker._workerEnded(self, reason)
+
+
+class Speaker(object):
+
+  def __init__(self, cacheDir=None, tts=TTS_COMMAND, player=PLAY_COMMAND,
+      maxQueue=MAX_QUEUE, reactor=reactor):
+    """
+    Constructor.
+
+    Args:
+      cacheDir: directory to keep rendered phrases in, or None to always
+          synthesize.
+      tts: TTS command as a sequence. It's run with the text as the last
+          argument, or with "-w <file> <text>" to render to a file.
+      player: audio player command as a sequence. It's run with the file to
+          play as the last argument.
+      maxQueue: number of messages that may wait to be spoken.
+      reactor: reactor for testing.
+    """
+    self._cacheDir = cacheDir
+    self._tts = list(tts)
+    self._player = list(player)
+    self._maxQueue = maxQueue
+    self._reactor = reactor
+    # (key, text) waiting to be spoken.
+    self._queue = collections.deque()
+    # (text, path) waiting to be rendered, once nothing is waiting to be
+    # spoken.
+    self._renders = collections.deque()
+    # text -> rendered audio file.
+    self._cache = {}
+    self._worker = None
+    self._inFlight = None
+    self._idleWaiters = []
+    self._stopped = None
+
+  def say(self, text, key=None):
+    """Queue text to be spoken.
+
+    Args:
+      text: what to say.
+      key: a queued message with the same key is dropped in favor of this
+          one, e.g. the door the message is about. None never replaces
+          anything.
+    """
+    if self._stopped is not None:
+      return
+    if key is not None:
+      for queued in self._queue:
+        if queued[0] == key:
+          log.msg('not speaking superseded message: %s' % queued[1])
+          self._queue.remove(queued)
+          break
+    if len(self._queue) >= self._maxQueue:
+      log.msg('speech queue full, not speaking: %s' % self._queue.popleft()[1])
+    self._queue.append((key, text))
+    self._sendNext()
+
+  def prerender(self, phrases):
+    """Render phrases to audio files in the background, if they aren't
+    already in the cache.
+
+    Args:
+      phrases: iterable of strings
+    """
+    if self._cacheDir is None or self._stopped is not None:
+      return
+    if not os.path.isdir(self._cacheDir):
+      os.makedirs(self._cacheDir)
+    queued = set(text for text, _ in self._renders)
+    for text in phrases:
+      path = self.cachePath(text)
+      if os.path.exists(path):
+        self._cache[text] = path
+      elif text not in self._cache and text not in queued:
+        self._renders.append((text, path))
+        queued.add(text)
+    self._sendNext()
+
+  def cachePath(self, text):
+    """The file text is rendered to. Changing the TTS command (e.g. its voice)
+    changes the file name, so stale renderings aren't played."""
+    digest = hashlib.sha1(json.dumps(self._tts + [text])).hexdigest()
+    return os.path.join(self._cacheDir, digest + '.wav')
+
+  def whenIdle(self):
+    """
+    Returns:
+      Deferred that fires once nothing is being spoken, rendered or waiting.
+    """
+    if self._inFlight is None and not self._queue and not self._renders:
+      return defer.succeed(None)
+    d = defer.Deferred()
+    self._idleWaiters.append(d)
+    return d
+
+  def stop(self):
+    """Drop waiting messages and let the worker exit after the current one.
+
+    Returns:
+      Deferred that fires when the worker has exited.
+    """
+    self._queue.clear()
+    self._renders.clear()
+    if self._stopped is None:
+      self._stopped = defer.Deferred()
+      if self._worker is None:
+        self._stopped.callback(None)
+      else:
+        self._worker.transport.closeStdin()
+    d = defer.Deferred()
+    self._stopped.chainDeferred(d)
+    return d
+
+  def _sendNext(self):
+    if self._inFlight is not None:
+      return
+    if self._queue:
+      key, text = self._queue.popleft()
+      if text in self._cache:
+        request = {'play': self._cache[text]}
+      else:
+        request = {'say': text}
+    elif self._renders:
+      text, path = self._renders.popleft()
+      request = {'render': text, 'path': path}
+    else:
+      waiters, self._idleWaiters = self._idleWaiters, []
+      for d in waiters:
+        d.callback(None)
+      return
+    try:
+      worker = self._getWorker()
+    except EnvironmentError as e:
+      log.msg('failed to start the speech worker: %s' % e)
+      self._queue.clear()
+      self._renders.clear()
+      self._sendNext()
+      return
+    self._inFlight = request
+    worker.transport.write(json.dumps(request) + '\n')
+
+  def _getWorker(self):
+    if self._worker is None:
+      worker = _WorkerProtocol(self)
+      self._reactor.spawnProcess(worker, sys.executable,
+          [sys.executable, WORKER_PATH, json.dumps(self._tts),
+           json.dumps(self._player)], env=os.environ)
+      self._worker = worker
+    return self._worker
+
+  def _handleReply(self, line):
+    request, self._inFlight = self._inFlight, None
+    if line != 'ok':
+      log.msg('speech worker failed on %s: %s' % (json.dumps(request), line))
+    elif request and 'render' in request:
+      self._cache[request['render']] = request['path']
+    self._sendNext()
+
+  def _workerEnded(self, worker, reason):
+    if worker is not self._worker:
+      return
+    self._worker = None
+    if self._stopped is not None:
+      self._stopped.callback(None)
+      return
+    log.msg('speech worker exited: %s' % reason.getErrorMessage())
+    if self._inFlight is not None:
+      # Don't retry it; it may be what killed the worker.
+      self._inFlight = None
+    # Start a new worker if there's more to say.
+    self._sendNext()
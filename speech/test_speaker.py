@@ -0,0 +1,119 @@
+#!/usr/bin/trial
+
+import os
+import sys
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import speaker
+from testing import fake_tts
+
+FAKE_TTS = os.path.splitext(os.path.abspath(fake_tts.__file__))[0] + '.py'
+
+
+class SpeakerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = os.path.abspath(self.mktemp())
+    os.makedirs(self.tmpdir)
+    self.logPath = os.path.join(self.tmpdir, 'tts.log')
+    self.cacheDir = os.path.join(self.tmpdir, 'cache')
+    self.speakers = []
+
+  def tearDown(self):
+    return defer.gatherResults([s.stop() for s in self.speakers])
+
+  def makeSpeaker(self, **kwargs):
+    s = speaker.Speaker(self.cacheDir,
+        tts=[sys.executable, FAKE_TTS, self.logPath, 'tts'],
+        player=[sys.executable, FAKE_TTS, self.logPath, 'play'], **kwargs)
+    self.speakers.append(s)
+    return s
+
+  def spoken(self, _=None):
+    if not os.path.exists(self.logPath):
+      return []
+    with open(self.logPath) as f:
+      return f.read().splitlines()
+
+  @defer.inlineCallbacks
+  def testSay(self):
+    s = self.makeSpeaker()
+    s.say('hello')
+    yield s.whenIdle()
+    self.assertEquals(['say hello'], self.spoken())
+
+  @defer.inlineCallbacks
+  def testPrerenderedPhraseIsPlayed(self):
+    s = self.makeSpeaker()
+    s.prerender(['Closing the door.'])
+    yield s.whenIdle()
+    self.assertTrue(os.path.exists(s.cachePath('Closing the door.')))
+    s.say('Closing the door.')
+    s.say('Door closed.')
+    yield s.whenIdle()
+    self.assertEquals(['render Closing the door.', 'play Closing the door.',
+        'say Door closed.'], self.spoken())
+
+  @defer.inlineCallbacks
+  def testCacheIsKept(self):
+    s = self.makeSpeaker()
+    s.prerender(['Closing the door.'])
+    yield s.whenIdle()
+    yield s.stop()
+    s = self.makeSpeaker()
+    s.prerender(['Closing the door.'])
+    s.say('Closing the door.')
+    yield s.whenIdle()
+    self.assertEquals(['render Closing the door.', 'play Closing the door.'],
+        self.spoken())
+
+  @defer.inlineCallbacks
+  def testSpeechGoesBeforeRendering(self):
+    s = self.makeSpeaker()
+    s.say('hello')
+    s.prerender(['Closing the door.'])
+    s.say('Closing the door.')
+    yield s.whenIdle()
+    self.assertEquals(['say hello', 'say Closing the door.',
+        'render Closing the door.'], self.spoken())
+
+  @defer.inlineCallbacks
+  def testSupersededMessageIsDropped(self):
+    s = self.makeSpeaker()
+    # The first message is sent to the worker right away; the rest wait.
+    s.say('garage open', key='garage')
+    s.say('garage alert', key='garage')
+    s.say('shed open', key='shed')
+    s.say('garage closing', key='garage')
+    yield s.whenIdle()
+    self.assertEquals(['say garage open', 'say shed open',
+        'say garage closing'], self.spoken())
+
+  @defer.inlineCallbacks
+  def testQueueIsBounded(self):
+    s = self.makeSpeaker(maxQueue=2)
+    for text in ('a', 'b', 'c', 'd'):
+      s.say(text)
+    yield s.whenIdle()
+    self.assertEquals(['say a', 'say c', 'say d'], self.spoken())
+
+  @defer.inlineCallbacks
+  def testFailureDoesntStopTheQueue(self):
+    s = self.makeSpeaker()
+    s.say('fail')
+    s.say('hello')
+    yield s.whenIdle()
+    self.assertEquals(['say fail', 'say hello'], self.spoken())
+
+  @defer.inlineCallbacks
+  def testStopFinishesCurrentMessage(self):
+    s = self.makeSpeaker()
+    s.say('hello')
+    s.say('goodbye')
+    yield s.stop()
+    self.assertEquals(['say hello'], self.spoken())
+    s.say('too late')
+    yield s.whenIdle()
+    self.assertEquals(['say hello'], self.spoken())
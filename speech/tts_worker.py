@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# Long-lived speech worker started by speech.speaker.Speaker.
+#
+# Reads one JSON request per line on stdin, runs the TTS or audio player for
+# it, and writes one reply line ("ok" or "error <reason>") when it's done, so
+# the speaker knows when to send the next one. Requests:
+#   {"say": text}                synthesize and speak text
+#   {"render": text, "path": p}  synthesize text to the audio file p
+#   {"play": p}                  play the audio file p
+#
+# Usage: tts_worker.py <tts command as a JSON list> <player as a JSON list>
+
+import json
+import os
+import subprocess
+import sys
+
+
+def command(tts, player, request):
+  if 'render' in request:
+    return tts + ['-w', request['path'] + '.tmp', request['render']]
+  if 'play' in request:
+    return player + [request['play']]
+  return tts + [request['say']]
+
+
+def handle(tts, player, request):
+  cmd = command(tts, player, request)
+  status = subprocess.call(cmd)
+  if status != 0:
+    return 'error %s exited with %d' % (cmd[0], status)
+  if 'render' in request:
+    # Only a complete file ever shows up in the cache.
+    os.rename(request['path'] + '.tmp', request['path'])
+  return 'ok'
+
+
+def main():
+  tts = json.loads(sys.argv[1])
+  player = json.loads(sys.argv[2])
+  for line in iter(sys.stdin.readline, ''):
+    try:
+      reply = handle(tts, player, json.loads(line))
+    except (EnvironmentError, ValueError, KeyError) as e:
+      reply = 'error %s' % e
+    sys.stdout.write(reply.replace('\n', ' ') + '\n')
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  main()
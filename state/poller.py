@@ -0,0 +1,145 @@
+"""Service that polls a sensor at a rate that depends on the doors' states.
+
+While any watched door is open, alerting, closing or stuck, it polls every
+fastSecs.
+Otherwise it starts at slowSecs and backs off exponentially, up to maxSecs,
+for as long as nothing changes. Failed polls back off too. Every interval is
+jittered so pollers don't line up.
+
+poller = poller.AdaptivePoller(sensor.check, fastSecs=1, slowSecs=5,
+    maxSecs=60)
+poller.watch(statemach)
+poller.setServiceParent(application)
+"""
+
+import random
+
+from twisted.application import service
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import log
+
+# States in which a change needs to be seen quickly.
+FAST_STATES = frozenset(['door_open', 'alerting', 'door_closing',
+    'door_stuck'])
+BACKOFF = 2
+# Intervals are randomly up to this fraction shorter or longer.
+JITTER = 0.1
+
+
+class AdaptivePoller(service.Service):
+
+  def __init__(self, poll, fastSecs, slowSecs, maxSecs, backoff=BACKOFF,
+      jitter=JITTER, fastStates=FAST_STATES, clock=reactor,
+      random=random.random):
+    """
+    Constructor.
+
+    Args:
+      poll: called to poll. Returns a Deferred that fires with None if the
+          poll failed, or anything else if it succeeded. A poll that doesn't
+          return a Deferred was skipped, and neither succeeded nor failed.
+      fastSecs: seconds between polls while a watched door is in a fast
+          state.
+      slowSecs: seconds between polls after the doors leave the fast states.
+      maxSecs: the longest interval to back off to.
+      backoff: factor to back off by, per quiet poll or failed poll.
+      jitter: fraction to randomly lengthen or shorten intervals by.
+      fastStates: states to poll fast in.
+      clock: reactor for testing.
+      random: random.random for testing.
+    """
+    self._poll = poll
+    self.fastSecs = fastSecs
+    self.slowSecs = slowSecs
+    self.maxSecs = maxSecs
+    self._backoff = backoff
+    self._jitter = jitter
+    self._fastStates = fastStates
+    self._clock = clock
+    self._random = random
+    # Watched door -> its state.
+    self._states = {}
+    # Successful polls since a door changed state, and failed polls in a row.
+    self._quietPolls = 0
+    self._failures = 0
+    self._call = None
+
+  def watch(self, statemach):
+    """Poll according to statemach's state, as well as any others watched."""
+    self._states[statemach] = statemach.getState()
+    statemach.addStateListener(
+        lambda src, dst: self._stateChanged(statemach, dst))
+
+  def isFast(self):
+    return any(state in self._fastStates for state in self._states.values())
+
+  def interval(self):
+    """
+    Returns:
+      seconds until the next poll, before jitter.
+    """
+    if self.isFast():
+      secs = self.fastSecs
+    else:
+      secs = self.slowSecs * self._backoff ** max(self._quietPolls - 1, 0)
+    secs *= self._backoff ** self._failures
+    return min(secs, max(self.maxSecs, self.fastSecs))
+
+  def _stateChanged(self, statemach, state):
+    wasFast = self.isFast()
+    self._states[statemach] = state
+    self._quietPolls = 0
+    # Don't wait out a long idle interval when things get urgent.
+    if self.isFast() and not wasFast and self._call is not None:
+      self._call.cancel()
+      self._schedule()
+
+  def startService(self):
+    service.Service.startService(self)
+    self._call = self._clock.callLater(0, self._run)
+
+  def stopService(self):
+    service.Service.stopService(self)
+    if self._call is not None:
+      self._call.cancel()
+      self._call = None
+
+  def _schedule(self):
+    secs = self.interval()
+    secs *= 1 + self._jitter * (2 * self._random() - 1)
+    self._call = self._clock.callLater(secs, self._run)
+
+  def _run(self):
+    self._call = None
+    try:
+      d = self._poll()
+    except Exception:
+      d = defer.fail()
+    if not isinstance(d, defer.Deferred):
+      # Skipped.
+      self._next(None)
+      return
+    d.addCallbacks(self._pollDone, self._pollFailed)
+    d.addBoth(self._next)
+
+  def _pollDone(self, result):
+    if result is None:
+      self._failed()
+      return
+    self._failures = 0
+    if not self.isFast() and self.interval() < self.maxSecs:
+      self._quietPolls += 1
+
+  def _pollFailed(self, failure):
+    log.err(failure, 'poll raised an exception')
+    self._failed()
+
+  def _failed(self):
+    if self.interval() < self.maxSecs:
+      self._failures += 1
+    log.msg('poll failed, next in about %ss' % self.interval())
+
+  def _next(self, _):
+    if self.running:
+      self._schedule()
@@ -0,0 +1,113 @@
+"""Routes events and chat commands to one StateMachine per door.
+
+registry = registry.DoorRegistry()
+registry.addDoor('garage', garage_statemach)
+registry.addDoor('shed', shed_statemach)
+presence_toggle = airport_clientmonitor.StatemachToggle(registry)
+commander = xmpp.ChatCommandReceiverProtocol(registry, subscribers, passwd)
+"""
+
+import collections
+
+from twisted.python import log
+
+COMMAND_PREFIX = 'command_'
+
+
+class DoorRegistry(object):
+  """Presence events apply to every door. Chat commands take an optional door
+  id, and apply to every door if it's omitted."""
+
+  def __init__(self):
+    self._doors = collections.OrderedDict()
+
+  def addDoor(self, doorId, statemach):
+    if doorId in self._doors:
+      raise ValueError('duplicate door id "%s"' % doorId)
+    self._doors[doorId] = statemach
+
+  def getDoor(self, doorId):
+    return self._doors[doorId]
+
+  def doorIds(self):
+    return self._doors.keys()
+
+  def __len__(self):
+    return len(self._doors)
+
+  def someone_home(self):
+    for statemach in self._doors.itervalues():
+      statemach.someone_home()
+
+  def everyone_left(self):
+    for statemach in self._doors.itervalues():
+      statemach.everyone_left()
+
+  def getState(self, doorId=None):
+    """
+    Args:
+      doorId: door to get the state of, or None for all doors.
+    Returns:
+      string to reply to the user
+    """
+    if doorId is not None:
+      if doorId not in self._doors:
+        return self._unknownDoor(doorId)
+      return self._doors[doorId].getState()
+    if len(self._doors) == 1:
+      return self._doors.values()[0].getState()
+    return ', '.join('%s: %s' % (doorId, statemach.getState())
+        for doorId, statemach in self._doors.iteritems())
+
+  def snoozeAlert(self, duration, doorId=None):
+    """Snooze the alert on one door, or on every door with a pending timeout.
+
+    Args:
+      duration: seconds to snooze.
+      doorId: door to snooze, or None for all doors.
+    Returns:
+      string to reply to the user
+    """
+    if doorId is not None:
+      if doorId not in self._doors:
+        return self._unknownDoor(doorId)
+      return self._doors[doorId].snoozeAlert(duration)
+    replies = [statemach.snoozeAlert(duration)
+        for statemach in self._doors.itervalues()
+        if statemach.pendingTimeout]
+    if not replies:
+      return 'no timeout pending'
+    return '\n'.join(reply for reply in replies if reply)
+
+  def can(self, event_name):
+    return any(statemach.can(event_name)
+        for statemach in self._doors.itervalues())
+
+  def __getattr__(self, attr):
+    if not attr.startswith(COMMAND_PREFIX) or not self.can(attr):
+      raise AttributeError('Unknown attribute "%s"' % attr)
+    return lambda **kwargs: self._dispatchCommand(attr, **kwargs)
+
+  def _dispatchCommand(self, event_name, sender=None, args=None):
+    """Fire a chat command event on the door named by the first argument, or
+    on every door that accepts it."""
+    args = [arg for arg in (args or []) if arg]
+    if args:
+      doorId = args.pop(0)
+      if doorId not in self._doors:
+        return self._unknownDoor(doorId)
+      doors = [self._doors[doorId]]
+    else:
+      doors = self._doors.values()
+    replies = []
+    for statemach in doors:
+      if statemach.can(event_name):
+        reply = getattr(statemach, event_name)(sender=sender, args=args)
+        if reply:
+          replies.append(reply)
+    return '\n'.join(replies)
+
+  def _unknownDoor(self, doorId):
+    msg = 'unknown door "%s" (doors: %s)' % (doorId, ', '.join(self._doors))
+    log.msg(msg)
+    return msg
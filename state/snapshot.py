@@ -0,0 +1,69 @@
+"""Saves the doors' state machines to a file, so a restart can pick up where
+it left off instead of starting over in the ok state.
+
+The file is JSON, {door id: StateMachine.snapshot()}, rewritten whenever a
+snapshot changes. It's written to a temporary file and renamed over the old
+one, so a crash leaves either the old snapshot or the new one.
+
+snapshots = snapshot.SnapshotFile(path)
+snapshots.watch('garage', statemach)  # restores, then saves on changes
+"""
+
+import json
+import os
+
+from twisted.python import log
+
+
+class SnapshotFile(object):
+
+  def __init__(self, path):
+    self.path = path
+    self._snapshots = self.load()
+
+  def load(self):
+    """
+    Returns:
+      {door id: snapshot} from the file, or {} if it's missing or unreadable.
+    """
+    try:
+      with open(self.path) as f:
+        snapshots = json.load(f)
+    except IOError:
+      return {}
+    except ValueError:
+      log.msg('ignoring corrupt state snapshot %s' % self.path)
+      return {}
+    if not isinstance(snapshots, dict):
+      log.msg('ignoring corrupt state snapshot %s' % self.path)
+      return {}
+    return snapshots
+
+  def watch(self, doorId, statemach):
+    """Restore statemach from its last snapshot, and save it on changes."""
+    saved = self._snapshots.get(doorId)
+    if saved:
+      try:
+        statemach.restore(saved)
+      except (KeyError, TypeError, ValueError):
+        log.err(None, 'ignoring bad state snapshot for %s' % doorId)
+    statemach.addSnapshotListener(
+        lambda: self.update(doorId, statemach.snapshot()))
+
+  def update(self, doorId, snapshot):
+    """Save a door's snapshot, unless it's unchanged."""
+    if self._snapshots.get(doorId) == snapshot:
+      return
+    self._snapshots[doorId] = snapshot
+    try:
+      self._write()
+    except (IOError, OSError):
+      log.err(None, 'failed to save state snapshot %s' % self.path)
+
+  def _write(self):
+    tmpPath = self.path + '.tmp'
+    with open(tmpPath, 'w') as f:
+      json.dump(self._snapshots, f, sort_keys=True)
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(tmpPath, self.path)
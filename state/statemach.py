@@ -1,12 +1,29 @@
 import fysom
-import logging
-import os
+from logs import logger
+from metrics import instruments
 from twisted.internet import reactor
-from twisted.python import log
 
 # When someone is home, how long until alerting about an open door.
 DOOR_OPEN_TIMEOUT_SECS = 15 * 60
 ALERT_TIMEOUT_SECS = 3 * 60
+# How long after pressing the button the door should be closed.
+CLOSE_CONFIRM_SECS = 30
+# Presses after the first before giving up, each waiting CLOSE_BACKOFF times
+# longer for the door to close.
+CLOSE_RETRIES = 2
+CLOSE_BACKOFF = 2
+# Reminders that the door is stuck open, at doubling intervals.
+STUCK_REMINDER_SECS = 10 * 60
+# Restored timers that came due while we were down wait this long, so the
+# sensors get a chance to report first.
+RESTORE_GRACE_SECS = 5
+
+_log = logger.Logger('statemach')
+
+
+def _noOp(**kwargs):
+  """Stands in for an event that would be a self transition."""
+  pass
 
 
 class StateMachine():
@@ -15,14 +32,20 @@ class StateMachine():
   - nobody_home         - door closed, nobody home
   - door_opened         - door open, someone home
   - alerting            - door open, nobody home or open too long
-  - door_closing        - close door command sent
-  - door_stuck (TODO)
+  - door_closing        - close door command sent, waiting for the sensor
+  - door_stuck          - door still open after all the button presses, not
+                          seen by the sensor since the last press, or the
+                          button presser failed
   """
+  STATES = ('ok', 'nobody_home', 'door_open', 'alerting', 'door_closing',
+      'door_stuck')
 
   def __init__(self, broadcaster, doorControl,
       doorOpenTimeoutSecs=DOOR_OPEN_TIMEOUT_SECS,
       alertTimeoutSecs=ALERT_TIMEOUT_SECS,
-      callLater=reactor.callLater, system=os.system): 
+      callLater=reactor.callLater, speaker=None, doorId=None,
+      closeConfirmSecs=CLOSE_CONFIRM_SECS, closeRetries=CLOSE_RETRIES,
+      stuckReminderSecs=STUCK_REMINDER_SECS, seconds=reactor.seconds):
     """
     Constructor.
 
@@ -31,8 +54,19 @@ class StateMachine():
           someone is home. After this period of time, an alert will fire.
       alertTimeoutSeconds: Number of seconds after an alert fires until the
           door is automatically closed.
-      callLater: reactor.callLater callback for testing.
-      system: os.system callback for testing.
+      callLater: reactor.callLater callback for testing, or a shared
+          TimerWheel's callLater.
+      speaker: speech.speaker.Speaker to announce alerts on, or None.
+      doorId: name of the door, prefixed to messages when there's more than
+          one door.
+      closeConfirmSecs: Number of seconds after pressing the button until
+          pressing it again, if the sensor has read the door open since the
+          press. Doubles with each press.
+      closeRetries: Number of times to press the button again before giving
+          up and alerting that the door is stuck.
+      stuckReminderSecs: Number of seconds until the first reminder that the
+          door is stuck. Doubles with each reminder.
+      seconds: reactor.seconds callback for testing.
     """
     self.broadcaster = broadcaster
     self.doorControl = doorControl
@@ -40,13 +74,40 @@ class StateMachine():
     self.alertTimeoutSecs = alertTimeoutSecs
     self.pendingTimeout = None
     self._callLater = callLater
-    self._system = system
+    self._speaker = speaker
+    self.doorId = doorId
+    self._messagePrefix = '%s: ' % doorId if doorId else ''
+    self.closeConfirmSecs = closeConfirmSecs
+    self.closeRetries = closeRetries
+    self.stuckReminderSecs = stuckReminderSecs
+    self._closeAttempts = 0
+    self._stuckReminders = 0
+    # When the button was last pressed, and (time, door open) of the last
+    # sensor reading.
+    self._lastPress = None
+    self._lastReading = None
+    # Button presses so far, to tell whether a press's result is stale.
+    self._presses = 0
+    # What to say on entering door_stuck, if not stuckMessage().
+    self._stuckMessage = None
+    self._stateListeners = []
+    self._snapshotListeners = []
+    self._seconds = seconds
+    labels = {'door': doorId} if doorId else None
+    self._transitions = instruments.counter('state_transitions_total',
+        'State changes of the door state machine.', labels)
+    self._transitionSeconds = instruments.histogram(
+        'state_transition_seconds',
+        'Time taken by events that change the state, callbacks included.',
+        labels)
     self.state = fysom.Fysom({
         'initial': 'ok',
+        'compiled': True,
         'events': [
           dict(name='everyone_left', src=['ok', 'nobody_home'], dst='nobody_home'),
           dict(name='everyone_left', src=['door_open', 'alerting'], dst='alerting'),
           dict(name='everyone_left', src=['door_closing'], dst='door_closing'),
+          dict(name='everyone_left', src=['door_stuck'], dst='door_stuck'),
 
           # Note: someone_home event happens during every airport poll, so it's
           # important not to leave many states.
@@ -54,33 +115,45 @@ class StateMachine():
           dict(name='someone_home', src=['alerting'], dst='alerting'),
           dict(name='someone_home', src=['door_open'], dst='door_open'),
           dict(name='someone_home', src=['door_closing'], dst='door_closing'),
+          dict(name='someone_home', src=['door_stuck'], dst='door_stuck'),
 
           dict(name='door_opened', src=['ok', 'door_open'], dst='door_open'),
           dict(name='door_opened', src=['nobody_home', 'alerting'], dst='alerting'),
           dict(name='door_opened', src=['door_closing'], dst='door_closing'),
+          dict(name='door_opened', src=['door_stuck'], dst='door_stuck'),
 
           dict(name='timeout', src=['door_open', 'nobody_home'], dst='alerting'),
           dict(name='timeout', src=['alerting'], dst='door_closing'),
-          # TODO:
-          #dict(name='timeout', src='door_closing', dst='door_stuck'),
+          dict(name='timeout', src=['door_closing'], dst='door_stuck'),
 
           # Currently only one command: close the door
-          dict(name='command_close_door', src=['alerting', 'door_open', 'door_closing'], dst='door_closing'),
+          dict(name='command_close_door', src=['alerting', 'door_open', 'door_closing', 'door_stuck'], dst='door_closing'),
           dict(name='command_close_door', src=['nobody_home'], dst='nobody_home'),
           dict(name='command_close_door', src=['ok'], dst='ok'),
 
-          dict(name='door_closed', src=['ok', 'alerting', 'door_open', 'door_closing'], dst='ok'),
+          dict(name='door_closed', src=['ok', 'alerting', 'door_open', 'door_closing', 'door_stuck'], dst='ok'),
           dict(name='door_closed', src=['nobody_home'], dst='nobody_home'),
         ],
         'callbacks': {
           'onchangestate': self.logStateChange,
-          'onleave_state_alerting': self.abortNoOpStateTransition,
-          'onleave_state_door_closing': self.abortNoOpStateTransition,
           'ondoor_open': self.startDoorOpenTimer,
           'onalerting': self.setAlertCondition,
           'ondoor_closing': self.closeDoor,
+          'ondoor_stuck': self.setStuckCondition,
           'ondoor_closed': self.handleDoorClosed,
         }})
+    # States in which each event is a self transition without callbacks.
+    self._noOpStates = self.state.noops()
+    for event in self._noOpStates:
+      setattr(self.state, event, self._timed(getattr(self.state, event)))
+
+  def _timed(self, fire):
+    """Wrap an event to record how long it takes."""
+    def timedFire(**kwargs):
+      start = self._seconds()
+      fire(**kwargs)
+      self._transitionSeconds.observe(self._seconds() - start)
+    return timedFire
 
   def getState(self):
     return self.state.current
@@ -89,26 +162,145 @@ class StateMachine():
     return self.state.can(event_name)
 
   def __getattr__(self, attr):
+    # Fast path for events that wouldn't do anything, e.g. someone_home on
+    # every airport poll while the door is closed.
+    if self.state.current in self._noOpStates.get(attr, ()):
+      return _noOp
     if self.can(attr):
       return getattr(self.state, attr)
     raise AttributeError('Unknown attribute "%s"' % attr)
 
   def logAndSpeakMessage(self, message):
-    log.msg('speaking %s' % message, logLevel=logging.INFO)
-    self._system('espeak "%s" &' % message)
+    _log.info('speaking %(text)s', text=message)
+    if self._speaker:
+      # A newer announcement about this door replaces a queued one.
+      self._speaker.say(message, key=('door', self.doorId))
 
-  def logStateChange(self, e):
-    log.msg(
-        'event %s: changing state: %s -> %s' % (e.event, e.src, e.dst),
-        logLevel=logging.INFO)
-
-  def abortNoOpStateTransition(self, e):
-    if e.src == e.dst:
-      log.msg(
-          'event %s: already in state %s, not transitioning' % (e.event, e.src),
-          logLevel=logging.INFO)
+  def spokenMessages(self):
+    """The messages logAndSpeakMessage is called with, for pre-rendering."""
+    return [self.alertMessage(), self.closingMessage(), self.stuckMessage(),
+        self.unconfirmedMessage(), self.buttonFailedMessage()]
+
+  def alertMessage(self):
+    return self._messagePrefix + (
+        'DOOR ALERT! Timeout in %s seconds (reply "snooze" to snooze)' % (
+        self.alertTimeoutSecs))
+
+  def closingMessage(self):
+    return self._messagePrefix + 'Closing the door.'
+
+  def stuckMessage(self):
+    return self._messagePrefix + (
+        'DOOR STUCK! Still open after pressing the button %d times. Close it '
+        'by hand, or reply "close_door" to try again.' % (
+        self.closeRetries + 1))
+
+  def unconfirmedMessage(self):
+    return self._messagePrefix + (
+        'DOOR STUCK? The sensor has not seen the door since pressing the '
+        'button, so it was not pressed again. Check the door, or reply '
+        '"close_door" to try again.')
+
+  def buttonFailedMessage(self):
+    return self._messagePrefix + (
+        'DOOR STUCK? The button presser failed to press the button. Close '
+        'the door by hand, or reply "close_door" to try again.')
+
+  def sensorReading(self, doorOpen):
+    """Record a reading of the door sensor. Called on every reading, unlike
+    door_opened and door_closed."""
+    self._lastReading = (self._seconds(), doorOpen)
+
+  def _seenOpenSincePress(self):
+    """Whether the last sensor reading was after the last button press, and
+    saw the door open."""
+    if self._lastReading is None or self._lastPress is None:
       return False
-    return True
+    readTime, doorOpen = self._lastReading
+    return doorOpen and readTime > self._lastPress
+
+  def addStateListener(self, listener):
+    """Call listener(src, dst) after every state change."""
+    self._stateListeners.append(listener)
+
+  def logStateChange(self, e):
+    _log.info('%(prefix)sevent %(event)s: changing state: %(src)s -> %(dst)s',
+        prefix=self._messagePrefix, event=e.event, src=e.src, dst=e.dst)
+    self._transitions.inc()
+    for listener in self._stateListeners:
+      listener(e.src, e.dst)
+    self._snapshotChanged()
+
+  def addSnapshotListener(self, listener):
+    """Call listener() whenever snapshot() would return something new."""
+    self._snapshotListeners.append(listener)
+
+  def _snapshotChanged(self):
+    for listener in self._snapshotListeners:
+      listener()
+
+  def _timeoutCallbacks(self):
+    """Returns {state: the method pendingTimeout calls in that state}."""
+    return {
+        'door_open': self.timeout,
+        'alerting': self.timeout,
+        'door_closing': self.closeNotConfirmed,
+        'door_stuck': self.remindStuck,
+    }
+
+  def snapshot(self):
+    """
+    Returns:
+      a dict of JSON types with the state and when its timeout is due, for
+      restore() after a restart.
+    """
+    deadline = None
+    if self.pendingTimeout:
+      deadline = self.pendingTimeout.getTime()
+    return {
+        'state': self.getState(),
+        'deadline': deadline,
+        'closeAttempts': self._closeAttempts,
+        'stuckReminders': self._stuckReminders,
+    }
+
+  def restore(self, snapshot):
+    """Pick up where a snapshot() left off, before any events.
+
+    The state is set without callbacks, so nothing is announced again. The
+    timeout resumes with whatever time it had left.
+    """
+    assert not self.pendingTimeout
+    # Check all of it before changing anything, so a bad snapshot leaves the
+    # state machine as it was.
+    if not isinstance(snapshot, dict):
+      raise ValueError('snapshot is not a dict: %r' % (snapshot,))
+    state = snapshot.get('state')
+    if state not in self.STATES:
+      raise ValueError('unknown state %r' % (state,))
+    closeAttempts = snapshot.get('closeAttempts', 0)
+    stuckReminders = snapshot.get('stuckReminders', 0)
+    for count in (closeAttempts, stuckReminders):
+      if not isinstance(count, (int, long)) or count < 0:
+        raise ValueError('bad count %r' % (count,))
+    callback = self._timeoutCallbacks().get(state)
+    deadline = snapshot.get('deadline')
+    if callback and not isinstance(deadline, (int, long, float)):
+      # Without it nothing would ever move the door out of state.
+      raise ValueError('bad deadline %r for state %s' % (deadline, state))
+
+    self.state.current = state
+    self._closeAttempts = closeAttempts
+    self._stuckReminders = stuckReminders
+    if state == 'door_closing':
+      # Only readings from after the restart count.
+      self._lastPress = self._seconds()
+    if callback:
+      remaining = deadline - self._seconds()
+      self.pendingTimeout = self._callLater(
+          max(remaining, RESTORE_GRACE_SECS), callback)
+    _log.info('%(prefix)srestored state %(state)s', prefix=self._messagePrefix,
+        state=state)
 
   def startDoorOpenTimer(self, e):
     if self.pendingTimeout:
@@ -126,8 +318,7 @@ class StateMachine():
       assert e.src == 'door_open'
       self.pendingTimeout.cancel()
 
-    message = 'DOOR ALERT! Timeout in %s seconds (reply "snooze" to snooze)' % (
-        self.alertTimeoutSecs)
+    message = self.alertMessage()
     self.logAndSpeakMessage(message)
     self.broadcaster.sendAllSubscribers(message)
     self.pendingTimeout = self._callLater(self.alertTimeoutSecs,
@@ -139,15 +330,92 @@ class StateMachine():
     self.state.timeout()
 
   def closeDoor(self, e):
-    message = 'Closing the door.'
+    message = self.closingMessage()
     if self.pendingTimeout:
       self.pendingTimeout.cancel()
       self.pendingTimeout = None
     self.logAndSpeakMessage(message)
     self.broadcaster.sendAllSubscribers(message)
-    self.doorControl.hitButton()
+    self._closeAttempts = 0
+    self._pressButton()
     return 'close door command issued'
-    # TODO: setup a timeout until door_stuck
+
+  def _pressButton(self):
+    """Press the button and wait for the sensor to see the door close."""
+    self._lastPress = self._seconds()
+    wait = self.closeConfirmSecs * CLOSE_BACKOFF ** self._closeAttempts
+    self._closeAttempts += 1
+    self.pendingTimeout = self._callLater(wait, self.closeNotConfirmed)
+    self._presses += 1
+    d = self.doorControl.hitButton()
+    d.addCallback(self._checkPress, self._presses)
+    d.addErrback(self._pressErrored, self._presses)
+
+  def _checkPress(self, reached, press):
+    if not reached:
+      self._pressFailed(press, 'the servo did not reach the button')
+    return reached
+
+  def _pressErrored(self, failure, press):
+    self._pressFailed(press, failure.getErrorMessage())
+
+  def _pressFailed(self, press, reason):
+    _log.error('%(prefix)sbutton press failed: %(reason)s',
+        prefix=self._messagePrefix, reason=reason)
+    # The press can fail right away (e.g. the Maestro is unplugged), while
+    # still entering door_closing. Escalate once that transition is over, so
+    # listeners see the state changes in order.
+    self._callLater(0, self._giveUpOnPress, press)
+
+  def _giveUpOnPress(self, press):
+    """Give up waiting for the door to close: the button wasn't pressed."""
+    if press != self._presses or self.getState() != 'door_closing':
+      # The door closed, or the button was pressed again since.
+      return
+    self.pendingTimeout.cancel()
+    self.pendingTimeout = None
+    self._stuckMessage = self.buttonFailedMessage()
+    self.state.timeout()
+
+  def closeNotConfirmed(self):
+    assert self.pendingTimeout
+    self.pendingTimeout = None
+    if self._closeAttempts > self.closeRetries:
+      self.state.timeout()
+    elif not self._seenOpenSincePress():
+      # The door may well have closed, with the sensor failing to say so.
+      # Pressing again could open it.
+      _log.warning('%(prefix)sno sensor reading of the door open since '
+          'pressing the button, not pressing it again',
+          prefix=self._messagePrefix)
+      self._stuckMessage = self.unconfirmedMessage()
+      self.state.timeout()
+    else:
+      _log.info('%(prefix)sdoor still open after %(presses)d button '
+          'press(es), pressing it again', prefix=self._messagePrefix,
+          presses=self._closeAttempts)
+      self._pressButton()
+      self._snapshotChanged()
+
+  def setStuckCondition(self, e):
+    message = self._stuckMessage or self.stuckMessage()
+    self._stuckMessage = None
+    self.logAndSpeakMessage(message)
+    self.broadcaster.sendAllSubscribers(message)
+    self._stuckReminders = 0
+    self.pendingTimeout = self._callLater(self.stuckReminderSecs,
+        self.remindStuck)
+
+  def remindStuck(self):
+    assert self.pendingTimeout
+    self._stuckReminders += 1
+    message = self._messagePrefix + 'DOOR STILL STUCK open (reminder %d)' % (
+        self._stuckReminders)
+    self.logAndSpeakMessage(message)
+    self.broadcaster.sendAllSubscribers(message)
+    self.pendingTimeout = self._callLater(
+        self.stuckReminderSecs * 2 ** self._stuckReminders, self.remindStuck)
+    self._snapshotChanged()
 
   def snoozeAlert(self, duration):
     """Reset the timer.
@@ -160,9 +428,10 @@ class StateMachine():
     if self.pendingTimeout:
       # TODO: if snoozed, give a 2-minute warning that the snooze will expire
       self.pendingTimeout.reset(duration)
-      message = 'snoozed, will timeout in %d seconds' % duration
+      message = self._messagePrefix + 'snoozed, will timeout in %d seconds' % duration
       self.broadcaster.sendAllSubscribers(message)
-      log.msg(message, logLevel=logging.INFO)
+      _log.info('%(text)s', text=message)
+      self._snapshotChanged()
       # We already broadcasted the snooze, don't return a message.
       return ''
     else:
@@ -173,10 +442,11 @@ class StateMachine():
       self.pendingTimeout.cancel()
       self.pendingTimeout = None
 
-    message = 'Door closed.'
+    message = self._messagePrefix + 'Door closed.'
     # Notify that the door is closed if we came from:
     # - door_closing, because that means closeDoor() got called.
-    # - alerting, to notify that the alert is no longer relevant.
-    if e.src == 'door_closing' or e.src == 'alerting':
+    # - alerting or door_stuck, to notify that the alert is no longer
+    #   relevant.
+    if e.src in ('door_closing', 'alerting', 'door_stuck'):
       self.broadcaster.sendAllSubscribers(message)
-    log.msg(message, logLevel=logging.INFO)
+    _log.info('%(text)s', text=message)
@@ -0,0 +1,116 @@
+#!/usr/bin/trial
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+import poller
+
+
+class FakeStatemach(object):
+  def __init__(self, state='ok'):
+    self.state = state
+    self.listeners = []
+
+  def getState(self):
+    return self.state
+
+  def addStateListener(self, listener):
+    self.listeners.append(listener)
+
+  def changeState(self, state):
+    src, self.state = self.state, state
+    for listener in self.listeners:
+      listener(src, state)
+
+
+class AdaptivePollerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.polls = []
+    self.results = []
+
+  def poll(self):
+    self.polls.append(self.clock.seconds())
+    if self.results:
+      result = self.results.pop(0)
+    else:
+      result = True
+    if isinstance(result, Exception):
+      raise result
+    if result == 'skip':
+      return None
+    return defer.succeed(result)
+
+  def makePoller(self, *statemachs, **kwargs):
+    kwargs.setdefault('random', lambda: 0.5)
+    p = poller.AdaptivePoller(self.poll, fastSecs=1, slowSecs=5, maxSecs=40,
+        clock=self.clock, **kwargs)
+    for statemach in statemachs:
+      p.watch(statemach)
+    p.startService()
+    self.addCleanup(p.stopService)
+    return p
+
+  def testBacksOffWhileQuiet(self):
+    self.makePoller(FakeStatemach('ok'))
+    self.clock.pump([0] + [5] * 40)
+    self.assertEquals([0, 5, 15, 35, 75, 115, 155, 195], self.polls)
+
+  def testFastWhileDoorOpen(self):
+    self.makePoller(FakeStatemach('door_open'))
+    self.clock.pump([0] + [1] * 4)
+    self.assertEquals([0, 1, 2, 3, 4], self.polls)
+
+  def testFastWhileDoorStuck(self):
+    # So a manual close is noticed right away.
+    self.makePoller(FakeStatemach('door_stuck'))
+    self.clock.pump([0] + [1] * 4)
+    self.assertEquals([0, 1, 2, 3, 4], self.polls)
+
+  def testAnyDoorMakesItFast(self):
+    garage = FakeStatemach('ok')
+    shed = FakeStatemach('nobody_home')
+    self.makePoller(garage, shed)
+    self.clock.pump([0] + [5] * 8)
+    self.assertEquals([0, 5, 15, 35], self.polls)
+    # Urgent: poll right away at the fast rate instead of waiting 40s.
+    shed.changeState('alerting')
+    self.clock.pump([1] * 3)
+    self.assertEquals([0, 5, 15, 35, 41, 42, 43], self.polls)
+    # Back to the slow rate, starting over.
+    shed.changeState('nobody_home')
+    self.clock.pump([1] * 20)
+    self.assertEquals([0, 5, 15, 35, 41, 42, 43, 44, 49, 59], self.polls)
+
+  def testFailuresBackOff(self):
+    self.results = [None, None, None, None, None, None, True]
+    self.makePoller(FakeStatemach('door_closing'))
+    self.clock.pump([0] + [1] * 200)
+    self.assertEquals([0, 2, 6, 14, 30, 62, 102, 103, 104],
+        self.polls[:9])
+
+  def testExceptionsBackOff(self):
+    self.results = [ValueError('oops'), True]
+    self.makePoller(FakeStatemach('door_open'))
+    self.clock.pump([0] + [1] * 4)
+    self.assertEquals([0, 2, 3, 4], self.polls)
+    self.assertEquals(1, len(self.flushLoggedErrors(ValueError)))
+
+  def testSkippedPollDoesntCount(self):
+    self.results = ['skip', 'skip', True]
+    self.makePoller(FakeStatemach('ok'))
+    self.clock.pump([0] + [5] * 4)
+    self.assertEquals([0, 5, 10, 15], self.polls)
+
+  def testJitter(self):
+    self.makePoller(FakeStatemach('door_open'), random=lambda: 1.0)
+    self.clock.pump([0, 1.1, 1.1])
+    self.assertEquals([0, 1.1, 2.2], self.polls)
+
+  def testStop(self):
+    p = self.makePoller(FakeStatemach('ok'))
+    self.clock.advance(0)
+    p.stopService()
+    self.assertEquals([], self.clock.getDelayedCalls())
@@ -0,0 +1,85 @@
+#!/usr/bin/trial
+
+import registry
+from twisted.trial import unittest
+
+
+class FakeStatemach(object):
+  def __init__(self, state='ok', pendingTimeout=None):
+    self.state = state
+    self.pendingTimeout = pendingTimeout
+    self.called = []
+
+  def can(self, event_name):
+    return event_name == 'command_close_door'
+
+  def getState(self):
+    return self.state
+
+  def someone_home(self):
+    self.called.append('someone_home')
+
+  def everyone_left(self):
+    self.called.append('everyone_left')
+
+  def snoozeAlert(self, duration):
+    self.called.append(('snoozeAlert', duration))
+    return ''
+
+  def command_close_door(self, sender=None, args=None):
+    self.called.append(('command_close_door', sender, args))
+    return 'closing'
+
+
+class DoorRegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.garage = FakeStatemach()
+    self.shed = FakeStatemach('alerting', pendingTimeout=object())
+    self.registry = registry.DoorRegistry()
+    self.registry.addDoor('garage', self.garage)
+    self.registry.addDoor('shed', self.shed)
+
+  def testPresenceFansOut(self):
+    self.registry.everyone_left()
+    self.registry.someone_home()
+    for door in (self.garage, self.shed):
+      self.assertEquals(['everyone_left', 'someone_home'], door.called)
+
+  def testGetState(self):
+    self.assertEquals('garage: ok, shed: alerting', self.registry.getState())
+    self.assertEquals('alerting', self.registry.getState(doorId='shed'))
+    self.assertTrue(self.registry.getState(doorId='barn').startswith(
+        'unknown door "barn"'))
+
+  def testGetStateSingleDoor(self):
+    single = registry.DoorRegistry()
+    single.addDoor('garage', self.garage)
+    self.assertEquals('ok', single.getState())
+
+  def testSnoozeOnlyPendingDoors(self):
+    self.assertEquals('', self.registry.snoozeAlert(60))
+    self.assertEquals([], self.garage.called)
+    self.assertEquals([('snoozeAlert', 60)], self.shed.called)
+
+  def testSnoozeNothingPending(self):
+    self.shed.pendingTimeout = None
+    self.assertEquals('no timeout pending', self.registry.snoozeAlert(60))
+
+  def testCommandByDoorId(self):
+    self.assertTrue(self.registry.can('command_close_door'))
+    self.assertEquals('closing', self.registry.command_close_door(
+        sender='foo@example.com', args=['shed']))
+    self.assertEquals([], self.garage.called)
+    self.assertEquals(
+        [('command_close_door', 'foo@example.com', [])], self.shed.called)
+
+  def testCommandAllDoors(self):
+    self.assertEquals('closing\nclosing', self.registry.command_close_door(
+        sender='foo@example.com', args=['']))
+    self.assertEquals(1, len(self.garage.called))
+    self.assertEquals(1, len(self.shed.called))
+
+  def testUnknownCommand(self):
+    self.assertFalse(self.registry.can('command_bogus'))
+    self.assertRaises(AttributeError, getattr, self.registry, 'command_bogus')
+    self.assertRaises(AttributeError, getattr, self.registry, 'bogus')
@@ -0,0 +1,85 @@
+#!/usr/bin/trial
+
+import json
+import os
+
+from twisted.trial import unittest
+
+import snapshot
+
+
+class FakeStatemach(object):
+  def __init__(self, state='ok'):
+    self.state = state
+    self.restored = None
+    self.listeners = []
+
+  def snapshot(self):
+    return {'state': self.state, 'deadline': None}
+
+  def restore(self, saved):
+    if saved['state'] == 'door_ajar':
+      raise ValueError('unknown state')
+    self.restored = saved
+
+  def addSnapshotListener(self, listener):
+    self.listeners.append(listener)
+
+  def changeState(self, state):
+    self.state = state
+    for listener in self.listeners:
+      listener()
+
+
+class SnapshotFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.path = self.mktemp()
+
+  def testMissingFile(self):
+    statemach = FakeStatemach()
+    snapshot.SnapshotFile(self.path).watch('garage', statemach)
+    self.assertEquals(None, statemach.restored)
+    self.assertFalse(os.path.exists(self.path))
+
+  def testSaveAndRestore(self):
+    snapshots = snapshot.SnapshotFile(self.path)
+    garage = FakeStatemach()
+    shed = FakeStatemach()
+    snapshots.watch('garage', garage)
+    snapshots.watch('shed', shed)
+    garage.changeState('door_open')
+    shed.changeState('alerting')
+    self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    restored = FakeStatemach()
+    snapshot.SnapshotFile(self.path).watch('shed', restored)
+    self.assertEquals('alerting', restored.restored['state'])
+
+  def testUnchangedNotWritten(self):
+    snapshots = snapshot.SnapshotFile(self.path)
+    statemach = FakeStatemach()
+    snapshots.watch('garage', statemach)
+    statemach.changeState('door_open')
+    os.remove(self.path)
+    statemach.changeState('door_open')
+    self.assertFalse(os.path.exists(self.path))
+
+  def testCorruptFile(self):
+    with open(self.path, 'w') as f:
+      f.write('{"garage": {"state": "door')
+    statemach = FakeStatemach()
+    snapshot.SnapshotFile(self.path).watch('garage', statemach)
+    self.assertEquals(None, statemach.restored)
+
+  def testBadSnapshot(self):
+    with open(self.path, 'w') as f:
+      json.dump({'garage': {'state': 'door_ajar'}}, f)
+    statemach = FakeStatemach()
+    snapshot.SnapshotFile(self.path).watch('garage', statemach)
+    self.assertEquals(None, statemach.restored)
+    self.assertEquals(1, len(self.flushLoggedErrors(ValueError)))
+    # It's overwritten by the next change.
+    statemach.changeState('ok')
+    self.assertEquals({'garage': {'state': 'ok', 'deadline': None}},
+        json.load(open(self.path)))
@@ -1,9 +1,11 @@
 #!/usr/bin/trial
 
-import os
+import fysom
 import mox
 import statemach
 from doorcontrol import maestro
+from speech import speaker
+from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
@@ -15,14 +17,15 @@ class StateMachineTest(unittest.TestCase):
   def setUp(self):
     self.clock = task.Clock()
     self.m = mox.Mox()
-    self.m.StubOutWithMock(os, 'system')
-    os.system(mox.IgnoreArg()).MultipleTimes().AndReturn(0)
+    self.mockSpeaker = self.m.CreateMock(speaker.Speaker)
+    self.mockSpeaker.say(mox.IgnoreArg(), key=mox.IgnoreArg()).MultipleTimes()
 
     self.mockBroadcaster = self.m.CreateMockAnything()
     self.mockDoorControl = self.m.CreateMock(maestro.DoorControl)
     self.statemach = statemach.StateMachine(
         self.mockBroadcaster, self.mockDoorControl,
-        callLater=self.clock.callLater, system=os.system)
+        callLater=self.clock.callLater, speaker=self.mockSpeaker,
+        seconds=self.clock.seconds)
 
   def testStartState(self):
     self.assertEquals('ok', self.statemach.getState())
@@ -45,7 +48,7 @@ class StateMachineTest(unittest.TestCase):
 
   def expectDoorClosing(self):
     self.expectDoorClosingNotice()
-    self.mockDoorControl.hitButton()
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
 
   def testCloseDoorCommand(self):
     self.expectDoorClosing()
@@ -55,6 +58,245 @@ class StateMachineTest(unittest.TestCase):
     self.statemach.command_close_door()
     self.m.VerifyAll()
 
+  def testSpokenMessages(self):
+    spoken = []
+
+    class RecordingSpeaker(object):
+      def say(self, text, key=None):
+        spoken.append((text, key))
+
+    sm = statemach.StateMachine(self.mockBroadcaster, self.mockDoorControl,
+        callLater=self.clock.callLater, speaker=RecordingSpeaker(),
+        doorId='shed')
+    self.mockBroadcaster.sendAllSubscribers(mox.IgnoreArg()).MultipleTimes()
+    self.mockDoorControl.hitButton().MultipleTimes().AndReturn(
+        defer.succeed(True))
+    failingDoorControl = self.m.CreateMock(maestro.DoorControl)
+    failingDoorControl.hitButton().AndReturn(defer.succeed(False))
+    self.m.ReplayAll()
+    sm.everyone_left()
+    sm.door_opened()
+    sm.command_close_door()
+    for secs in [statemach.CLOSE_CONFIRM_SECS * 2 ** i for i in range(3)]:
+      self.clock.advance(secs - 1)
+      sm.sensorReading(True)
+      self.clock.advance(1)
+    self.assertEquals('door_stuck', sm.getState())
+    # Stuck again, this time without the sensor seeing the door.
+    sm.command_close_door()
+    self.clock.advance(statemach.CLOSE_CONFIRM_SECS)
+    self.assertEquals('door_stuck', sm.getState())
+    # And with the button presser failing.
+    sm.doorControl = failingDoorControl
+    sm.command_close_door()
+    self.clock.advance(0)
+    self.assertEquals('door_stuck', sm.getState())
+    self.assertEquals(set(sm.spokenMessages()),
+        set(text for text, key in spoken))
+    self.assertEquals(set([('door', 'shed')]), set(key for text, key in spoken))
+    self.assertTrue(spoken[1][0].endswith('Closing the door.'))
+
+  def expectDoorStuckNotice(self):
+    self.mockBroadcaster.sendAllSubscribers(mox.Regex(r'DOOR STUCK!'))
+
+  def waitWithDoorOpen(self, *waits):
+    """Advance the clock by each wait, with the sensor reading the door open
+    just before the end of each."""
+    for wait in waits:
+      self.clock.advance(wait - 1)
+      self.statemach.sensorReading(True)
+      self.clock.advance(1)
+
+  def testCloseConfirmed(self):
+    self.expectDoorClosing()
+    self.expectDoorClosedNotice()
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    self.clock.advance(statemach.CLOSE_CONFIRM_SECS - 1)
+    self.statemach.door_closed()
+    self.assertEquals('ok', self.statemach.getState())
+    self.assertEquals([], self.clock.getDelayedCalls())
+    self.m.VerifyAll()
+
+  def testCloseRetriedWithBackoff(self):
+    self.expectDoorClosing()
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
+    self.expectDoorClosedNotice()
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    self.waitWithDoorOpen(statemach.CLOSE_CONFIRM_SECS)
+    # The second press waits twice as long.
+    self.clock.advance(statemach.CLOSE_CONFIRM_SECS * 2 - 1)
+    self.assertEquals('door_closing', self.statemach.getState())
+    self.statemach.sensorReading(True)
+    self.clock.advance(1)
+    self.statemach.door_closed()
+    self.m.VerifyAll()
+
+  def testDoorStuck(self):
+    self.expectDoorClosing()
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
+    self.expectDoorStuckNotice()
+    self.mockBroadcaster.sendAllSubscribers(mox.Regex(r'reminder 1'))
+    self.mockBroadcaster.sendAllSubscribers(mox.Regex(r'reminder 2'))
+    self.expectDoorClosedNotice()
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    self.waitWithDoorOpen(statemach.CLOSE_CONFIRM_SECS,
+        statemach.CLOSE_CONFIRM_SECS * 2, statemach.CLOSE_CONFIRM_SECS * 4)
+    self.assertEquals('door_stuck', self.statemach.getState())
+    # Nothing moves it out of door_stuck but the door closing or a command.
+    self.statemach.everyone_left()
+    self.statemach.door_opened()
+    self.statemach.someone_home()
+    self.assertEquals('door_stuck', self.statemach.getState())
+    # Reminders back off too.
+    self.clock.advance(statemach.STUCK_REMINDER_SECS)
+    self.clock.advance(statemach.STUCK_REMINDER_SECS * 2)
+    self.statemach.door_closed()
+    self.assertEquals('ok', self.statemach.getState())
+    self.assertEquals([], self.clock.getDelayedCalls())
+    self.m.VerifyAll()
+
+  def testCloseDoorAfterStuck(self):
+    self.expectDoorClosing()
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
+    self.expectDoorStuckNotice()
+    self.expectDoorClosing()
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    self.waitWithDoorOpen(statemach.CLOSE_CONFIRM_SECS,
+        statemach.CLOSE_CONFIRM_SECS * 2, statemach.CLOSE_CONFIRM_SECS * 4)
+    self.statemach.command_close_door()
+    self.assertEquals('door_closing', self.statemach.getState())
+    # Back to the first timeout.
+    self.assertEquals(statemach.CLOSE_CONFIRM_SECS,
+        self.statemach.pendingTimeout.getTime() - self.clock.seconds())
+    self.m.VerifyAll()
+
+  def testNotPressedAgainWithoutReading(self):
+    self.expectDoorClosing()
+    self.mockBroadcaster.sendAllSubscribers(
+        mox.Regex(r'DOOR STUCK\? The sensor has not seen the door'))
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.sensorReading(True)
+    self.statemach.command_close_door()
+    # The sensor stopped answering right after the press: the door may have
+    # closed.
+    self.clock.advance(statemach.CLOSE_CONFIRM_SECS)
+    self.assertEquals('door_stuck', self.statemach.getState())
+    self.m.VerifyAll()
+
+  def testNotPressedAgainWhenReadClosed(self):
+    self.expectDoorClosing()
+    self.mockBroadcaster.sendAllSubscribers(mox.Regex(r'DOOR STUCK\?'))
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    self.clock.advance(1)
+    # A closed reading that didn't make it to door_closed, e.g. the toggle
+    # missed it.
+    self.statemach.sensorReading(False)
+    self.clock.advance(statemach.CLOSE_CONFIRM_SECS)
+    self.assertEquals('door_stuck', self.statemach.getState())
+    self.m.VerifyAll()
+
+  def testButtonNotReached(self):
+    pressed = defer.Deferred()
+    self.expectDoorClosingNotice()
+    self.mockDoorControl.hitButton().AndReturn(pressed)
+    self.mockBroadcaster.sendAllSubscribers(
+        mox.Regex(r'DOOR STUCK\? The button presser failed'))
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    pressed.callback(False)
+    self.clock.advance(0)
+    self.assertEquals('door_stuck', self.statemach.getState())
+    # Only the stuck reminder is pending, not the close confirmation.
+    self.assertEquals([self.statemach.remindStuck],
+        [call.func for call in self.clock.getDelayedCalls()])
+    self.m.VerifyAll()
+
+  def testButtonFailed(self):
+    self.expectDoorClosingNotice()
+    self.mockDoorControl.hitButton().AndReturn(
+        defer.fail(maestro.MaestroError('not connected')))
+    self.mockBroadcaster.sendAllSubscribers(
+        mox.Regex(r'DOOR STUCK\? The button presser failed'))
+    changes = []
+    self.statemach.addStateListener(
+        lambda src, dst: changes.append((src, dst)))
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    # Stuck only once door_closing has been entered.
+    self.assertEquals('door_closing', self.statemach.getState())
+    self.clock.advance(0)
+    self.assertEquals('door_stuck', self.statemach.getState())
+    self.assertEquals([('ok', 'door_open'), ('door_open', 'door_closing'),
+        ('door_closing', 'door_stuck')], changes)
+    self.m.VerifyAll()
+
+  def testStaleButtonResultIgnored(self):
+    pressed = defer.Deferred()
+    self.expectDoorClosingNotice()
+    self.mockDoorControl.hitButton().AndReturn(pressed)
+    self.expectDoorClosedNotice()
+
+    self.m.ReplayAll()
+    self.statemach.door_opened()
+    self.statemach.command_close_door()
+    self.statemach.door_closed()
+    pressed.callback(False)
+    self.assertEquals('ok', self.statemach.getState())
+    self.m.VerifyAll()
+
+  def testStateListener(self):
+    changes = []
+    self.statemach.addStateListener(lambda src, dst: changes.append(dst))
+    self.m.ReplayAll()
+    self.mockSpeaker.say('pymox MultipleTimes() needs a zero-times option',
+        key=None)
+    self.statemach.someone_home()
+    self.statemach.door_opened()
+    self.statemach.door_opened()
+    self.statemach.door_closed()
+    self.assertEquals(['door_open', 'ok'], changes)
+
+  def testTransitionMetrics(self):
+    self.statemach = statemach.StateMachine(
+        self.mockBroadcaster, self.mockDoorControl,
+        callLater=self.clock.callLater, speaker=self.mockSpeaker,
+        doorId='metrics', seconds=self.clock.seconds)
+    transitions = self.statemach._transitions.value
+    timed = self.statemach._transitionSeconds.count
+    self.m.ReplayAll()
+    self.mockSpeaker.say('pymox MultipleTimes() needs a zero-times option',
+        key=None)
+    self.statemach.door_opened()
+    self.statemach.someone_home()
+    self.statemach.door_closed()
+    self.assertEquals(transitions + 2, self.statemach._transitions.value)
+    # Events that wouldn't change the state aren't timed either.
+    self.assertEquals(timed + 2, self.statemach._transitionSeconds.count)
+
   def testSnoozeAlert(self):
     self.expectAlertNotice()
     self.expectSnoozeNotice()
@@ -84,10 +326,83 @@ class StateMachineTest(unittest.TestCase):
   def testSnoozeAlertNoTimeoutPending(self):
     self.assertEquals('no timeout pending', self.statemach.snoozeAlert(10))
 
+  def restarted(self, downSecs):
+    """Returns a new StateMachine restored from this one's snapshot."""
+    snapshot = self.statemach.snapshot()
+    self.clock = task.Clock()
+    self.clock.advance(snapshot['deadline'] - statemach.ALERT_TIMEOUT_SECS +
+        downSecs)
+    restored = statemach.StateMachine(
+        self.mockBroadcaster, self.mockDoorControl,
+        callLater=self.clock.callLater, speaker=self.mockSpeaker,
+        seconds=self.clock.seconds)
+    restored.restore(snapshot)
+    return restored
+
+  def testSnapshotRestore(self):
+    self.expectAlertNotice()
+    # Only the timeout after the restart, not the alert again.
+    self.expectDoorClosing()
+
+    self.m.ReplayAll()
+    self.statemach.everyone_left()
+    self.statemach.door_opened()
+    self.statemach = self.restarted(60)
+    self.assertEquals('alerting', self.statemach.getState())
+    self.clock.advance(statemach.ALERT_TIMEOUT_SECS - 61)
+    self.assertEquals('alerting', self.statemach.getState())
+    self.clock.advance(1)
+    self.assertEquals('door_closing', self.statemach.getState())
+    self.m.VerifyAll()
+
+  def testRestoreOverdue(self):
+    self.expectAlertNotice()
+    self.expectDoorClosing()
+
+    self.m.ReplayAll()
+    self.statemach.everyone_left()
+    self.statemach.door_opened()
+    self.statemach = self.restarted(statemach.ALERT_TIMEOUT_SECS * 2)
+    # The sensors get a chance to report that the door closed first.
+    self.clock.advance(statemach.RESTORE_GRACE_SECS - 1)
+    self.assertEquals('alerting', self.statemach.getState())
+    self.clock.advance(1)
+    self.assertEquals('door_closing', self.statemach.getState())
+    self.m.VerifyAll()
+
+  def testRestoreUnknownState(self):
+    self.assertRaises(ValueError, self.statemach.restore,
+        {'state': 'door_ajar', 'deadline': None})
+
+  def testRestoreBadSnapshotChangesNothing(self):
+    for snapshot in ([], {'state': 'alerting'},
+        {'state': 'door_closing', 'deadline': '100'},
+        {'state': 'door_stuck', 'deadline': 100, 'stuckReminders': None}):
+      self.assertRaises(ValueError, self.statemach.restore, snapshot)
+      self.assertEquals('ok', self.statemach.getState())
+      self.assertIdentical(None, self.statemach.pendingTimeout)
+
+  def testSnapshotListener(self):
+    self.expectAlertNotice()
+    self.expectSnoozeNotice()
+    snapshots = []
+    self.statemach.addSnapshotListener(
+        lambda: snapshots.append(self.statemach.snapshot()))
+
+    self.m.ReplayAll()
+    self.statemach.everyone_left()
+    self.statemach.door_opened()
+    self.statemach.snoozeAlert(1000)
+    self.assertEquals(['nobody_home', 'alerting', 'alerting'],
+        [snapshot['state'] for snapshot in snapshots])
+    self.assertEquals([None, statemach.ALERT_TIMEOUT_SECS, 1000],
+        [snapshot['deadline'] for snapshot in snapshots])
+    self.m.VerifyAll()
+
   def expectAlertAndDoorClosure(self):
     self.expectAlertNotice()
     self.expectDoorClosingNotice()
-    self.mockDoorControl.hitButton()
+    self.mockDoorControl.hitButton().AndReturn(defer.succeed(True))
 
   def testNobodyHomeDoorOpenAlert(self):
     self.expectAlertAndDoorClosure()
@@ -137,9 +452,111 @@ class StateMachineTest(unittest.TestCase):
 
   def testDoorClosedWhileSomeoneHome(self):
     self.m.ReplayAll()
-    os.system('pymox MultipleTimes() needs a zero-times option')
+    self.mockSpeaker.say('pymox MultipleTimes() needs a zero-times option',
+        key=None)
     self.statemach.door_opened()
     self.statemach.door_closed()
     self.m.VerifyAll()
 
-  # TODO: test someone_home repeatedly?
+  def testSomeoneHomeRepeatedly(self):
+    fired = []
+    self.statemach.state.someone_home = lambda **kw: fired.append(kw)
+    self.m.ReplayAll()
+    self.mockSpeaker.say('pymox MultipleTimes() needs a zero-times option',
+        key=None)
+    # Self transitions never reach fysom.
+    for _ in range(3):
+      self.statemach.someone_home()
+    self.statemach.door_opened()
+    self.statemach.someone_home()
+    self.assertEquals([], fired)
+    # Leaving nobody_home is a real transition.
+    self.statemach.door_closed()
+    self.statemach.everyone_left()
+    self.statemach.someone_home()
+    self.assertEquals([{}], fired)
+    self.m.VerifyAll()
+
+
+class CompiledFysomTest(unittest.TestCase):
+  """Compiled mode must behave exactly like the default mode."""
+
+  def makeFsm(self, compiled, calls):
+    def record(name, ret=None):
+      def callback(e):
+        calls.append((name, e.event, e.src, e.dst, getattr(e, 'msg', None)))
+        return ret
+      return callback
+    return fysom.Fysom({
+        'initial': 'green',
+        'compiled': compiled,
+        'events': [
+          {'name': 'warn', 'src': 'green', 'dst': 'yellow'},
+          {'name': 'warn', 'src': 'yellow', 'dst': 'yellow'},
+          {'name': 'panic', 'src': ['green', 'yellow'], 'dst': 'red'},
+          {'name': 'calm', 'src': 'red', 'dst': 'yellow'},
+          {'name': 'clear', 'src': 'yellow', 'dst': 'green'},
+        ],
+        'callbacks': {
+          'onbeforewarn': record('onbeforewarn'),
+          'onleaveyellow': record('onleaveyellow'),
+          'onleavered': record('onleavered', ret=False),
+          'onenteryellow': record('onenteryellow'),
+          'onred': record('onred'),
+          'onchangestate': record('onchangestate'),
+          'onafterpanic': record('onafterpanic'),
+          'oncalm': record('oncalm'),
+        }})
+
+  def fireAll(self, fsm):
+    fsm.warn()
+    fsm.warn()
+    fsm.panic(msg='killer bees')
+    # onleavered returns False, so calm waits for transition().
+    fsm.calm()
+    self.assertEquals('red', fsm.current)
+    self.assertFalse(fsm.can('clear'))
+    fsm.transition()
+    fsm.clear()
+
+  def testSameCallbacks(self):
+    default_calls = []
+    compiled_calls = []
+    default = self.makeFsm(False, default_calls)
+    compiled = self.makeFsm(True, compiled_calls)
+    self.fireAll(default)
+    self.fireAll(compiled)
+    self.assertEquals(default_calls, compiled_calls)
+    self.assertEquals(default.current, compiled.current)
+
+  def testCan(self):
+    fsm = self.makeFsm(True, [])
+    self.assertTrue(fsm.can('warn'))
+    self.assertFalse(fsm.can('calm'))
+    self.assertFalse(fsm.can('bogus'))
+    self.assertRaises(fysom.FysomError, fsm.calm)
+
+  def testNestedEvents(self):
+    seen = []
+    def onyellow(e):
+      e.fsm.panic()
+      seen.append((e.event, e.src, e.dst))
+    fsm = fysom.Fysom({
+        'initial': 'green',
+        'compiled': True,
+        'events': [
+          {'name': 'warn', 'src': 'green', 'dst': 'yellow'},
+          {'name': 'panic', 'src': 'yellow', 'dst': 'red'},
+        ],
+        'callbacks': {'onyellow': onyellow}})
+    fsm.warn()
+    self.assertEquals('red', fsm.current)
+    self.assertEquals([('warn', 'green', 'yellow')], seen)
+
+  def testRecompile(self):
+    calls = []
+    fsm = self.makeFsm(True, calls)
+    fsm.onchangestate = lambda e: calls.append('replaced')
+    fsm.compile()
+    fsm.panic()
+    self.assertTrue('replaced' in calls)
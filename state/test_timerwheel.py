@@ -0,0 +1,83 @@
+#!/usr/bin/trial
+
+import timerwheel
+from twisted.internet import error
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class TimerWheelTest(unittest.TestCase):
+  def setUp(self):
+    self.clock = task.Clock()
+    # Small wheels so tests exercise the cascades.
+    self.wheel = timerwheel.TimerWheel(resolution=1, slotsPerLevel=4,
+        numLevels=3, seconds=self.clock.seconds)
+    self.fired = []
+
+  def advance(self, secs):
+    for _ in range(secs):
+      self.clock.advance(1)
+      self.wheel.tick()
+
+  def fire(self, name):
+    self.fired.append((name, self.clock.seconds()))
+
+  def testFiresOnTime(self):
+    for delay in (1, 3, 4, 5, 15, 16, 17, 63, 64, 100):
+      self.wheel.callLater(delay, self.fire, delay)
+    self.assertEquals(10, len(self.wheel))
+    self.advance(200)
+    self.assertEquals(
+        [(delay, delay) for delay in (1, 3, 4, 5, 15, 16, 17, 63, 64, 100)],
+        self.fired)
+    self.assertEquals(0, len(self.wheel))
+
+  def testFractionalDelayFiresLate(self):
+    self.clock.advance(0.5)
+    timer = self.wheel.callLater(1, self.fire, 'x')
+    self.assertEquals(2, timer.getTime())
+    self.advance(2)
+    self.assertEquals([('x', 2.5)], self.fired)
+
+  def testCancel(self):
+    timer = self.wheel.callLater(20, self.fire, 'x')
+    self.advance(10)
+    self.assertTrue(timer.active())
+    timer.cancel()
+    self.assertFalse(timer.active())
+    self.advance(20)
+    self.assertEquals([], self.fired)
+    self.assertEquals(0, len(self.wheel))
+    self.assertRaises(error.AlreadyCancelled, timer.cancel)
+
+  def testReset(self):
+    timer = self.wheel.callLater(5, self.fire, 'x')
+    self.advance(4)
+    timer.reset(30)
+    self.assertEquals(34, timer.getTime())
+    self.advance(29)
+    self.assertEquals([], self.fired)
+    self.advance(1)
+    self.assertEquals([('x', 34)], self.fired)
+    self.assertRaises(error.AlreadyCalled, timer.reset, 1)
+
+  def testDelay(self):
+    timer = self.wheel.callLater(5, self.fire, 'x')
+    timer.delay(10)
+    self.advance(15)
+    self.assertEquals([('x', 15)], self.fired)
+
+  def testCallbackCancelsTimerDueSameTick(self):
+    other = self.wheel.callLater(3, self.fire, 'other')
+    self.wheel.callLater(3, lambda: other.active() and other.cancel())
+    self.advance(3)
+    # Either the other timer fired first, or it got cancelled.
+    self.assertTrue(self.fired == [] or self.fired == [('other', 3)])
+    self.assertEquals(0, len(self.wheel))
+
+  def testMissedTicks(self):
+    self.wheel.callLater(2, self.fire, 'x')
+    self.wheel.callLater(7, self.fire, 'y')
+    self.clock.advance(10)
+    self.wheel.tick()
+    self.assertEquals(['x', 'y'], [name for name, _ in self.fired])
@@ -0,0 +1,50 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+import toggle
+
+
+class RecordingToggle(toggle.EdgeTriggeredToggle):
+  def __init__(self, *args, **kwargs):
+    toggle.EdgeTriggeredToggle.__init__(self, *args, **kwargs)
+    self.fired = []
+
+  def fire(self, value):
+    self.fired.append(value)
+
+
+class EdgeTriggeredToggleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+
+  def testFiresOnEdges(self):
+    t = RecordingToggle(seconds=self.clock.seconds)
+    results = [t(value) for value in (False, False, True, 1, True, 0, None)]
+    self.assertEquals([True, False, True, False, False, True, False], results)
+    self.assertEquals([False, True, False], t.fired)
+    self.assertEquals(False, t.value)
+
+  def testNeverResyncsByDefault(self):
+    t = RecordingToggle(seconds=self.clock.seconds)
+    t(True)
+    self.clock.advance(10**6)
+    t(True)
+    self.assertEquals([True], t.fired)
+
+  def testResync(self):
+    t = RecordingToggle(resyncSecs=60, seconds=self.clock.seconds)
+    t(True)
+    self.clock.advance(59)
+    t(True)
+    self.clock.advance(1)
+    t(True)
+    t(True)
+    # An edge restarts the resync period.
+    self.clock.advance(30)
+    t(False)
+    self.clock.advance(59)
+    t(False)
+    self.clock.advance(1)
+    t(False)
+    self.assertEquals([True, True, False, False], t.fired)
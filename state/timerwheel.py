@@ -0,0 +1,181 @@
+"""Hierarchical timer wheel.
+
+Runs the timeouts of many state machines off one periodic tick instead of a
+reactor DelayedCall each. Scheduling, cancelling and resetting a timer are
+O(1), and each tick only touches the timers that are due (plus an amortized
+cascade of the higher levels).
+
+wheel = timerwheel.TimerWheel()
+wheel_service = internet.TimerService(timerwheel.RESOLUTION_SECS, wheel.tick)
+sm = statemach.StateMachine(broadcaster, doorControl,
+    callLater=wheel.callLater)
+"""
+
+import math
+
+from twisted.internet import error
+from twisted.internet import reactor
+from twisted.python import log
+
+# Seconds per tick; timers fire up to this much late.
+RESOLUTION_SECS = 1.0
+# Level N holds timers due in less than SLOTS_PER_LEVEL**(N+1) ticks.
+SLOTS_PER_LEVEL = 64
+NUM_LEVELS = 4
+
+
+class WheelTimer(object):
+  """A pending call on a TimerWheel. Provides the parts of IDelayedCall that
+  StateMachine uses: getTime, cancel, reset, delay and active."""
+  __slots__ = ('_wheel', 'deadline', 'func', 'args', 'kw', 'level', 'index',
+      'cancelled', 'called')
+
+  def __init__(self, wheel, deadline, func, args, kw):
+    self._wheel = wheel
+    self.deadline = deadline
+    self.func = func
+    self.args = args
+    self.kw = kw
+    self.level = None
+    self.index = None
+    self.cancelled = False
+    self.called = False
+
+  def getTime(self):
+    """Returns the time (in seconds) at which this call will fire."""
+    return self._wheel.tickToSeconds(self.deadline)
+
+  def cancel(self):
+    self._checkActive()
+    self.cancelled = True
+    self._wheel._remove(self)
+
+  def reset(self, secondsFromNow):
+    """Reschedule to fire secondsFromNow seconds from now."""
+    self._checkActive()
+    self._wheel._remove(self)
+    self.deadline = self._wheel.secondsToDeadline(secondsFromNow)
+    self._wheel._insert(self)
+
+  def delay(self, secondsLater):
+    """Postpone by secondsLater seconds."""
+    self._checkActive()
+    self._wheel._remove(self)
+    self.deadline = max(self._wheel.now + 1, self.deadline + int(
+        math.ceil(secondsLater / self._wheel.resolution)))
+    self._wheel._insert(self)
+
+  def active(self):
+    return not (self.cancelled or self.called)
+
+  def _checkActive(self):
+    if self.cancelled:
+      raise error.AlreadyCancelled()
+    if self.called:
+      raise error.AlreadyCalled()
+
+
+class TimerWheel(object):
+
+  def __init__(self, resolution=RESOLUTION_SECS, slotsPerLevel=SLOTS_PER_LEVEL,
+      numLevels=NUM_LEVELS, seconds=reactor.seconds):
+    """
+    Constructor.
+
+    Args:
+      resolution: seconds per tick.
+      slotsPerLevel: number of slots in each level of the wheel.
+      numLevels: number of levels. Timers further out than
+          slotsPerLevel**numLevels ticks are parked in the top level and
+          cascaded until they're in range.
+      seconds: reactor.seconds callback for testing.
+    """
+    self.resolution = float(resolution)
+    self._slotsPerLevel = slotsPerLevel
+    self._seconds = seconds
+    self._epoch = seconds()
+    self._levels = [[set() for _ in range(slotsPerLevel)]
+        for _ in range(numLevels)]
+    self._pending = 0
+    # Ticks since the epoch that have been processed.
+    self.now = 0
+
+  def __len__(self):
+    """Number of pending timers."""
+    return self._pending
+
+  def tickToSeconds(self, tick):
+    return self._epoch + tick * self.resolution
+
+  def secondsToDeadline(self, secondsFromNow):
+    elapsed = self._seconds() - self._epoch + secondsFromNow
+    return max(self.now + 1, int(math.ceil(elapsed / self.resolution)))
+
+  def callLater(self, delay, func, *args, **kw):
+    """Same interface as reactor.callLater.
+
+    Returns:
+      a WheelTimer
+    """
+    timer = WheelTimer(self, self.secondsToDeadline(delay), func, args, kw)
+    self._insert(timer)
+    self._pending += 1
+    return timer
+
+  def tick(self):
+    """Fire all timers that are due. Call this every resolution seconds."""
+    target = int((self._seconds() - self._epoch) / self.resolution)
+    while self.now < target:
+      self.now += 1
+      self._advance()
+
+  def _advance(self):
+    now = self.now
+    # Move timers down from every level whose period just wrapped, starting
+    # from the top so they can fall through several levels in one tick.
+    granularity = 1
+    cascade = []
+    for level in range(1, len(self._levels)):
+      granularity *= self._slotsPerLevel
+      if now % granularity:
+        break
+      cascade.append((level, granularity))
+    for level, granularity in reversed(cascade):
+      slots = self._levels[level]
+      index = (now // granularity) % self._slotsPerLevel
+      bucket = slots[index]
+      slots[index] = set()
+      for timer in bucket:
+        self._insert(timer)
+
+    slots = self._levels[0]
+    index = now % self._slotsPerLevel
+    due = slots[index]
+    slots[index] = set()
+    for timer in due:
+      # Callbacks may cancel or reset other timers that are due this tick.
+      if not timer.active() or timer.deadline != now:
+        continue
+      timer.called = True
+      self._pending -= 1
+      try:
+        timer.func(*timer.args, **timer.kw)
+      except:
+        log.err()
+
+  def _insert(self, timer):
+    remaining = timer.deadline - self.now
+    level = 0
+    granularity = 1
+    while (remaining >= granularity * self._slotsPerLevel and
+        level < len(self._levels) - 1):
+      level += 1
+      granularity *= self._slotsPerLevel
+    timer.level = level
+    timer.index = (timer.deadline // granularity) % self._slotsPerLevel
+    self._levels[level][timer.index].add(timer)
+
+  def _remove(self, timer):
+    self._levels[timer.level][timer.index].discard(timer)
+    if timer.cancelled:
+      self._pending -= 1
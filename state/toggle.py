@@ -0,0 +1,49 @@
+"""Base class for the callbacks that pollers use to drive the state machine.
+
+Pollers call their toggle with what they observed on every poll. The toggle
+only fires an event when the observed value changes, plus (optionally) every
+resyncSecs in case the state machine missed an edge.
+
+class StatemachToggle(toggle.EdgeTriggeredToggle):
+  def fire(self, doorOpen):
+    ...
+"""
+
+from twisted.internet import reactor
+
+
+class EdgeTriggeredToggle(object):
+
+  def __init__(self, resyncSecs=None, seconds=reactor.seconds):
+    """
+    Constructor.
+
+    Args:
+      resyncSecs: fire even if the value didn't change when it was last fired
+          this many seconds ago. None to only fire on changes.
+      seconds: reactor.seconds callback for testing.
+    """
+    self.resyncSecs = resyncSecs
+    self._seconds = seconds
+    self.value = None
+    self._lastFired = None
+
+  def __call__(self, value):
+    """Fire if the value changed, or if it's time to resync.
+
+    Returns:
+      boolean - whether the toggle fired
+    """
+    value = bool(value)
+    now = self._seconds()
+    if value == self.value and not (self.resyncSecs is not None and
+        now - self._lastFired >= self.resyncSecs):
+      return False
+    self.value = value
+    self._lastFired = now
+    self.fire(value)
+    return True
+
+  def fire(self, value):
+    """Subclasses implement this to act on the value."""
+    raise NotImplementedError
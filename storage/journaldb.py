@@ -0,0 +1,243 @@
+"""A small key-value store: a dict in memory, persisted to an append-only
+journal file.
+
+Each write() appends its batch of changes as one line of JSON and fsyncs
+once, so a batch is on disk entirely or not at all; a torn last line is
+ignored. Lookups never touch the disk. Once the journal holds many more
+batches than there are keys, it's compacted: the contents are written to a
+new file that is renamed over the journal.
+
+Other processes (e.g. edit_clientdb.py) can share the journal. Writers hold
+an flock on it, and refresh() picks up what others wrote.
+
+db = journaldb.openDb(path)  # migrates the DirDBM at path, if there is one
+db['a'] = '1'
+db.write({'b': '2', 'a': None})  # sets b and deletes a, with one fsync
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+
+from twisted.persisted import dirdbm
+from twisted.python import log
+
+JOURNAL_SUFFIX = '.journal'
+# What a DirDBM directory is renamed to once it's been migrated.
+MIGRATED_SUFFIX = '.dirdbm-migrated'
+# Compact once there are this many times more batches than keys...
+COMPACT_RATIO = 4
+# ...and at least this many batches.
+COMPACT_MIN_BATCHES = 100
+
+
+def _str(value):
+  """JSON decodes to unicode, but the callers deal in str."""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  return value
+
+
+def openDb(path):
+  """Open the JournalDB for path, at path + JOURNAL_SUFFIX.
+
+  If path is a DirDBM directory, its entries are copied into the journal and
+  the directory is renamed to path + MIGRATED_SUFFIX, so it's migrated once.
+  """
+  db = JournalDB(path + JOURNAL_SUFFIX)
+  if os.path.isdir(path):
+    old = dirdbm.DirDBM(path)
+    entries = dict((key, old[key]) for key in old.keys())
+    db.write(entries)
+    os.rename(path, path + MIGRATED_SUFFIX)
+    log.msg('migrated %d entries from %s to %s' % (
+        len(entries), path, db.path))
+  return db
+
+
+class JournalDB(object):
+  """Supports the mapping interface of a DirDBM: in, len, iteration, keys,
+  items, get, item access, assignment and deletion, and clear. Values can be
+  anything JSON can encode except None."""
+
+  def __init__(self, path, compactRatio=COMPACT_RATIO,
+      compactMinBatches=COMPACT_MIN_BATCHES):
+    """
+    Constructor.
+
+    Args:
+      path: journal file, created if it doesn't exist.
+      compactRatio: compact once the journal has this many times more
+          batches than there are keys...
+      compactMinBatches: ...and at least this many batches.
+    """
+    self.path = path
+    self._compactRatio = compactRatio
+    self._compactMinBatches = compactMinBatches
+    self._file = None
+    self._open()
+
+  def _open(self):
+    """(Re)open the journal and read it from the start."""
+    if self._file is not None:
+      self._file.close()
+    self._file = open(self.path, 'a+b')
+    self._data = {}
+    # Bytes of the journal applied to _data, and the batches in them.
+    self._offset = 0
+    self._batches = 0
+    self._readNew()
+
+  def _readNew(self):
+    """
+    Returns:
+      whether any batches were appended since the last read.
+    """
+    self._file.seek(self._offset)
+    data = self._file.read()
+    # Anything after the last newline is a batch still being written, or
+    # torn by a crash.
+    end = data.rfind('\n') + 1
+    if not end:
+      return False
+    for line in data[:end].splitlines():
+      try:
+        changes = json.loads(line)
+      except ValueError:
+        log.msg('skipping corrupt batch in %s: %r' % (self.path, line))
+        continue
+      self._apply(changes)
+    self._offset += end
+    return True
+
+  def _apply(self, changes):
+    for key, value in changes.iteritems():
+      if value is None:
+        self._data.pop(_str(key), None)
+      else:
+        self._data[_str(key)] = _str(value)
+    self._batches += 1
+
+  def _replaced(self):
+    """Whether the journal was compacted by another process."""
+    try:
+      return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+    except OSError:
+      return True
+
+  def refresh(self):
+    """Pick up changes written by other processes.
+
+    Returns:
+      whether there were any.
+    """
+    if self._replaced():
+      self._open()
+      return True
+    if os.fstat(self._file.fileno()).st_size == self._offset:
+      return False
+    return self._readNew()
+
+  @contextlib.contextmanager
+  def _locked(self):
+    """Hold the journal's lock, with everything written before it applied."""
+    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+    while self._replaced():
+      self._open()
+      fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+    try:
+      self._readNew()
+      yield
+    finally:
+      fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+  def write(self, changes):
+    """Apply a batch of changes, and append it to the journal.
+
+    Args:
+      changes: dict of key -> new value, or None to delete the key.
+    """
+    if not changes:
+      return
+    line = json.dumps(changes, separators=(',', ':')) + '\n'
+    with self._locked():
+      if os.fstat(self._file.fileno()).st_size > self._offset:
+        # Left by a writer that crashed.
+        self._file.truncate(self._offset)
+      self._file.write(line)
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self._offset += len(line)
+      self._apply(changes)
+      if self._batches >= max(self._compactMinBatches,
+          self._compactRatio * len(self._data)):
+        self._compact()
+
+  def compact(self):
+    """Rewrite the journal as a single batch."""
+    with self._locked():
+      self._compact()
+
+  def _compact(self):
+    tmpPath = self.path + '.tmp'
+    data = ''
+    if self._data:
+      data = json.dumps(self._data, separators=(',', ':')) + '\n'
+    # The new journal is locked before it's renamed into place, so nobody
+    # can append to it before we've caught up.
+    new = open(tmpPath, 'a+b')
+    fcntl.flock(new.fileno(), fcntl.LOCK_EX)
+    new.truncate(0)
+    new.write(data)
+    new.flush()
+    os.fsync(new.fileno())
+    os.rename(tmpPath, self.path)
+    dirFd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+    try:
+      os.fsync(dirFd)
+    finally:
+      os.close(dirFd)
+    # Closing the old journal releases its lock, and other writers waiting
+    # for it find that it was replaced, then wait for the new one.
+    old, self._file = self._file, new
+    old.close()
+    self._offset = len(data)
+    self._batches = 1 if self._data else 0
+
+  def close(self):
+    self._file.close()
+
+  def __contains__(self, key):
+    return key in self._data
+
+  def __len__(self):
+    return len(self._data)
+
+  def __iter__(self):
+    return iter(self._data)
+
+  def __getitem__(self, key):
+    return self._data[key]
+
+  def get(self, key, default=None):
+    return self._data.get(key, default)
+
+  def keys(self):
+    return self._data.keys()
+
+  def items(self):
+    return self._data.items()
+
+  def __setitem__(self, key, value):
+    if value is None:
+      raise TypeError('None values are not supported')
+    self.write({key: value})
+
+  def __delitem__(self, key):
+    if key not in self._data:
+      raise KeyError(key)
+    self.write({key: None})
+
+  def clear(self):
+    self.write(dict.fromkeys(self._data))
@@ -0,0 +1,146 @@
+#!/usr/bin/trial
+
+import fcntl
+import os
+
+from twisted.persisted import dirdbm
+from twisted.trial import unittest
+
+import journaldb
+
+
+class JournalDBTest(unittest.TestCase):
+  def setUp(self):
+    self.path = self.mktemp()
+    self.db = journaldb.JournalDB(self.path)
+
+  def tearDown(self):
+    self.db.close()
+
+  def reopen(self, **kwargs):
+    db = journaldb.JournalDB(self.path, **kwargs)
+    self.addCleanup(db.close)
+    return db
+
+  def lines(self):
+    with open(self.path) as f:
+      return f.read().splitlines()
+
+  def testMapping(self):
+    self.db['a'] = '1'
+    self.db['b'] = '2'
+    del self.db['a']
+    self.assertTrue('b' in self.db)
+    self.assertFalse('a' in self.db)
+    self.assertEquals(1, len(self.db))
+    self.assertEquals(['b'], self.db.keys())
+    self.assertEquals(['b'], list(self.db))
+    self.assertEquals([('b', '2')], self.db.items())
+    self.assertEquals('2', self.db['b'])
+    self.assertEquals(None, self.db.get('a'))
+    self.assertRaises(KeyError, self.db.__getitem__, 'a')
+    self.assertRaises(KeyError, self.db.__delitem__, 'a')
+    self.assertRaises(TypeError, self.db.__setitem__, 'a', None)
+    self.db.clear()
+    self.assertEquals([], self.reopen().keys())
+
+  def testReopen(self):
+    self.db['a'] = '1'
+    self.db.write({'b': '2', 'c': '3', 'a': None})
+    db = self.reopen()
+    self.assertEquals({'b': '2', 'c': '3'}, dict(db.items()))
+    self.assertTrue(isinstance(db.keys()[0], str))
+    # One line per batch.
+    self.assertEquals(2, len(self.lines()))
+
+  def testTornBatchIgnored(self):
+    self.db['a'] = '1'
+    with open(self.path, 'a') as f:
+      f.write('{"b":"2","c":')
+    db = self.reopen()
+    self.assertEquals(['a'], db.keys())
+    # The next write replaces it.
+    db['d'] = '4'
+    self.assertEquals(['{"a":"1"}', '{"d":"4"}'], self.lines())
+
+  def testCorruptBatchSkipped(self):
+    with open(self.path, 'a') as f:
+      f.write('nonsense\n{"a":"1"}\n')
+    self.assertEquals(['a'], self.reopen().keys())
+
+  def testCompaction(self):
+    db = self.reopen(compactRatio=2, compactMinBatches=4)
+    for i in range(3):
+      db['a'] = str(i)
+    self.assertEquals(3, len(self.lines()))
+    db['b'] = 'x'
+    self.assertEquals(['{"a":"2","b":"x"}'], self.lines())
+    self.assertFalse(os.path.exists(self.path + '.tmp'))
+    db['c'] = 'y'
+    self.assertEquals({'a': '2', 'b': 'x', 'c': 'y'},
+        dict(self.reopen().items()))
+
+  def testSharedBetweenWriters(self):
+    other = self.reopen()
+    self.db['a'] = '1'
+    self.assertFalse('a' in other)
+    self.assertTrue(other.refresh())
+    self.assertEquals('1', other['a'])
+    self.assertFalse(other.refresh())
+    # Writes apply what others wrote first.
+    other['b'] = '2'
+    self.db['c'] = '3'
+    self.assertEquals(['a', 'b', 'c'], sorted(self.db.keys()))
+
+  def testCompactedByAnotherWriter(self):
+    self.db['a'] = '1'
+    other = self.reopen()
+    other['b'] = '2'
+    other.compact()
+    self.db['c'] = '3'
+    self.assertTrue(other.refresh())
+    self.assertEquals(['a', 'b', 'c'], sorted(other.keys()))
+    self.assertEquals(['a', 'b', 'c'], sorted(self.reopen().keys()))
+
+  def testCompactedJournalLockedUntilCaughtUp(self):
+    self.db['a'] = '1'
+    rename = os.rename
+
+    def renameAndAppend(src, dst):
+      rename(src, dst)
+      with open(dst, 'ab') as f:
+        # Writers can't get the lock on the new journal yet...
+        self.assertRaises(IOError, fcntl.flock, f.fileno(),
+            fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # ...but if one appended anyway, it wouldn't be skipped.
+        f.write('{"b":"2"}\n')
+
+    self.patch(os, 'rename', renameAndAppend)
+    self.db.compact()
+    self.assertTrue(self.db.refresh())
+    self.assertEquals(['a', 'b'], sorted(self.db.keys()))
+
+
+class OpenDbTest(unittest.TestCase):
+  def testMigratesDirDBM(self):
+    path = self.mktemp()
+    old = dirdbm.DirDBM(path)
+    old['00:11:22:33:44:55'] = '192.168.1.10'
+    old['a@example.com'] = ''
+    db = journaldb.openDb(path)
+    self.assertEquals({'00:11:22:33:44:55': '192.168.1.10',
+        'a@example.com': ''}, dict(db.items()))
+    db.close()
+    self.assertFalse(os.path.exists(path))
+    self.assertTrue(os.path.isdir(path + journaldb.MIGRATED_SUFFIX))
+    # Only once.
+    db = journaldb.openDb(path)
+    self.assertEquals(2, len(db))
+    db.close()
+
+  def testNew(self):
+    path = self.mktemp()
+    db = journaldb.openDb(path)
+    self.assertEquals(0, len(db))
+    self.assertTrue(os.path.exists(path + journaldb.JOURNAL_SUFFIX))
+    db.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# Benchmark of decoding the Airport client table, comparing tableToDict with
+# the old implementation that popped cells off the front of a list.
+#
+# Run from the top of the source tree:
+#   python testing/airport_snmp_bench.py
+
+import sys
+import timeit
+sys.path.append('.')
+
+from presence import airport_snmp
+
+STATION_COUNTS = (10, 100, 1000, 5000)
+
+
+def popTableToDict(table, num):
+  """The old tableToDict, minus the per-client debug logging."""
+  table = list(table)
+  clients = []
+  clientTable = {}
+  for _ in range(num):
+    data = table.pop(0).lower()
+    clients.append(data)
+    clientTable[data] = {}
+  for cmd in airport_snmp.CLIENT_FIELDS:
+    for i in range(num):
+      clientTable[clients[i]][cmd] = table.pop(0)
+  return clientTable
+
+
+def makeTable(num):
+  macs = tuple('00:1B:%02X:%02X:%02X:%02X' % (
+      (i >> 24) & 0xFF, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+      for i in range(num))
+  return macs + tuple(range(num * len(airport_snmp.CLIENT_FIELDS)))
+
+
+def main():
+  print '%8s %14s %14s' % ('stations', 'pop (msec)', 'stride (msec)')
+  for num in STATION_COUNTS:
+    table = makeTable(num)
+    repeat = max(1, 2000 / num)
+    results = []
+    for fn in (popTableToDict, airport_snmp.tableToDict):
+      secs = min(timeit.repeat(lambda: fn(table, num), number=repeat, repeat=3))
+      results.append(secs / repeat * 1000)
+    print '%8d %14.3f %14.3f' % ((num,) + tuple(results))
+
+
+if __name__ == '__main__':
+  main()
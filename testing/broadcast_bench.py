@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Benchmark of broadcasting to many subscribers over a loopback XMPP stream,
+# comparing the queued template broadcast with the old implementation that
+# built and serialized an element per subscriber inside the caller.
+#
+# Run from the top of the source tree:
+#   python testing/broadcast_bench.py
+
+import sys
+import timeit
+sys.path.append('.')
+
+from chatcontrol import xmpp
+from twisted.internet import task
+from twisted.test import proto_helpers
+from twisted.words.protocols.jabber import xmlstream
+from twisted.words.xish import domish
+from wokkel import subprotocols
+
+SUBSCRIBER_COUNTS = (10, 100, 1000, 5000)
+TEXT = 'Door opened while someone is home. Closing it in 300 seconds.'
+
+
+class OldChatBroadcastProtocol(xmpp.ChatBroadcastProtocol):
+  """The old sendAllSubscribers, minus the logging."""
+
+  def sendAllSubscribers(self, text):
+    for subscriber in self.subscribers.keys():
+      msg = domish.Element((None, 'message'))
+      msg['to'] = subscriber
+      msg['type'] = 'chat'
+      msg.addElement('body', content=text)
+      self.send(msg)
+
+
+def loopbackStream(handler):
+  """Attach handler to an authenticated stream that writes to a string."""
+  factory = xmlstream.XmlStreamFactory(xmlstream.Authenticator())
+  manager = subprotocols.StreamManager(factory)
+  xs = factory.buildProtocol(None)
+  xs.transport = proto_helpers.StringTransport()
+  manager._connected(xs)
+  manager._authd(xs)
+  handler.setHandlerParent(manager)
+  return xs.transport
+
+
+def makeSubscribers(num):
+  return dict(('user%d@example.com' % i, '') for i in range(num))
+
+
+def main():
+  print '%11s %13s %13s %13s' % (
+      'subscribers', 'old (msec)', 'new (msec)', 'caller (msec)')
+  for num in SUBSCRIBER_COUNTS:
+    subscribers = makeSubscribers(num)
+    clock = task.Clock()
+    old = OldChatBroadcastProtocol(subscribers)
+    oldTransport = loopbackStream(old)
+    # Coalescing would drop the repeats, and batching only adds idle time.
+    new = xmpp.ChatBroadcastProtocol(subscribers, batchSize=num,
+        coalesceSecs=0, callLater=clock.callLater, seconds=clock.seconds)
+    newTransport = loopbackStream(new)
+
+    def runOld():
+      old.sendAllSubscribers(TEXT)
+      oldTransport.clear()
+
+    def runNew():
+      new.sendAllSubscribers(TEXT)
+      clock.advance(0)
+      newTransport.clear()
+
+    def runNewCaller():
+      new.sendAllSubscribers(TEXT)
+      new._queue.clear()
+      new._drainCall.cancel()
+      new._drainCall = None
+
+    repeat = max(1, 5000 / num)
+    results = []
+    for fn in (runOld, runNew, runNewCaller):
+      secs = min(timeit.repeat(fn, number=repeat, repeat=3))
+      results.append(secs / repeat * 1000)
+    print '%11d %13.3f %13.3f %13.3f' % ((num,) + tuple(results))
+
+
+if __name__ == '__main__':
+  main()
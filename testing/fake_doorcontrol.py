@@ -1,8 +1,21 @@
+from doorcontrol import maestro
+from twisted.internet import defer
 from twisted.python import log
 
 class FakePololuMicroMaestro(object):
+  def __init__(self):
+    self.target = 0
+
   def setAngle(self, angle):
     log.msg('servo angle changed to %s' % angle)
+    self.target = maestro.angleToTarget(angle)
 
   def goHome(self):
     log.msg('servo returned to home')
+    self.target = 0
+
+  def getPosition(self, channel=0):
+    return defer.succeed(self.target)
+
+  def getErrors(self):
+    return defer.succeed(0)
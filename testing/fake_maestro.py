@@ -0,0 +1,156 @@
+"""Pretends to be a Pololu Maestro on the other end of a pty.
+
+maestro.MaestroService (or serialport.SerialPort) can open fake.portName like
+the real command port. The fake understands the compact protocol commands
+the driver sends, and can run the servo and delay commands of a Maestro
+script.
+
+fake = fake_maestro.FakeMaestro()
+fake.loadScript(maestro.buttonScript())
+service = maestro.MaestroService(device, fake.portName)
+"""
+
+import os
+import tty
+
+from twisted.internet import abstract
+from twisted.internet import fdesc
+from twisted.internet import reactor
+from twisted.python import log
+
+from doorcontrol import maestro
+
+CHANNELS = 6
+# Bytes following each command byte.
+_COMMAND_ARGS = {
+    maestro.SET_TARGET: 3,
+    maestro.GET_POSITION: 1,
+    maestro.GET_ERRORS: 0,
+    maestro.GO_HOME: 0,
+    maestro.STOP_SCRIPT: 0,
+    maestro.RESTART_SCRIPT: 1,
+    maestro.GET_SCRIPT_STATUS: 0,
+}
+
+
+def _encodeWord(value):
+  return chr(value & 0xFF) + chr((value >> 8) & 0xFF)
+
+
+class FakeMaestro(abstract.FileDescriptor):
+
+  connected = 1
+
+  def __init__(self, reactor=reactor):
+    abstract.FileDescriptor.__init__(self, reactor)
+    self._master, self._slave = os.openpty()
+    tty.setraw(self._slave)
+    fdesc.setNonBlocking(self._master)
+    self.portName = os.ttyname(self._slave)
+    # Servo positions, in quarter microseconds. 0 means off.
+    self.positions = [0] * CHANNELS
+    # Every command received, as (command byte, argument bytes).
+    self.commands = []
+    self.errors = 0
+    # Set to ignore targets, like a servo that can't move.
+    self.stuck = False
+    # Set to ignore queries, like a wedged controller.
+    self.silent = False
+    self._buffer = ''
+    # Words of each subroutine of the loaded script.
+    self._subroutines = []
+    self._scriptCall = None
+    self.scriptRunning = False
+    self.startReading()
+
+  def loadScript(self, script):
+    """Load a script, like the Maestro Control Center does."""
+    self._subroutines = []
+    for line in script.splitlines():
+      words = line.split('#')[0].split()
+      if words[:1] == ['sub']:
+        self._subroutines.append([])
+      elif self._subroutines:
+        self._subroutines[-1].extend(words)
+
+  def fileno(self):
+    return self._master
+
+  def doRead(self):
+    return fdesc.readFromFD(self._master, self._dataReceived)
+
+  def writeSomeData(self, data):
+    return fdesc.writeToFD(self._master, data)
+
+  def _dataReceived(self, data):
+    self._buffer += data
+    while self._buffer:
+      command = ord(self._buffer[0])
+      if command not in _COMMAND_ARGS:
+        log.msg('fake maestro: unknown command 0x%02x' % command)
+        self.errors |= 0x08  # serial protocol error
+        self._buffer = self._buffer[1:]
+        continue
+      size = _COMMAND_ARGS[command]
+      if len(self._buffer) < size + 1:
+        return
+      args = [ord(c) for c in self._buffer[1:size + 1]]
+      self._buffer = self._buffer[size + 1:]
+      self.commands.append((command, args))
+      self._handle(command, args)
+
+  def _setTarget(self, channel, target):
+    if not self.stuck:
+      self.positions[channel] = target
+
+  def _handle(self, command, args):
+    if command == maestro.SET_TARGET:
+      self._setTarget(args[0], args[1] | (args[2] << 7))
+    elif command == maestro.GO_HOME:
+      self.positions = [0] * CHANNELS
+    elif command == maestro.RESTART_SCRIPT:
+      self._stopScript()
+      self.scriptRunning = True
+      self._runScript(list(self._subroutines[args[0]]), [])
+    elif command == maestro.STOP_SCRIPT:
+      self._stopScript()
+    elif self.silent:
+      return
+    elif command == maestro.GET_POSITION:
+      self.write(_encodeWord(self.positions[args[0]]))
+    elif command == maestro.GET_ERRORS:
+      errors, self.errors = self.errors, 0
+      self.write(_encodeWord(errors))
+    elif command == maestro.GET_SCRIPT_STATUS:
+      self.write('\x00' if self.scriptRunning else '\x01')
+
+  def _runScript(self, words, stack):
+    """Run words until a delay, which continues the rest later."""
+    self._scriptCall = None
+    while words:
+      word = words.pop(0)
+      if word in ('quit', 'return'):
+        break
+      elif word == 'servo':
+        channel = stack.pop()
+        self._setTarget(channel, stack.pop())
+      elif word == 'delay':
+        self._scriptCall = self.reactor.callLater(stack.pop() / 1000.0,
+            self._runScript, words, stack)
+        return
+      else:
+        stack.append(int(word))
+    self.scriptRunning = False
+
+  def _stopScript(self):
+    if self._scriptCall and self._scriptCall.active():
+      self._scriptCall.cancel()
+    self._scriptCall = None
+    self.scriptRunning = False
+
+  def close(self):
+    self._stopScript()
+    self.stopReading()
+    self.stopWriting()
+    os.close(self._master)
+    os.close(self._slave)
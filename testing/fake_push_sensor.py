@@ -0,0 +1,111 @@
+#!/usr/bin/twistd -ny
+# Simulated door sensor that pushes readings to gdoormon like the Arduino does
+# when it's set up to push, for testing push_server without an Arduino:
+#
+#   deps/bin/twistd -ny testing/fake_push_sensor.py
+#
+# It randomly opens and closes the door, pushes a burst of readings on every
+# change and a heartbeat in between, and logs how long each push took.
+
+import random
+import StringIO
+
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.python import log
+from twisted.web import client
+from twisted.web import http_headers
+
+PUSH_URL = 'http://127.0.0.1:8080/sensor/'
+PUSH_TOKEN = 'changeme'
+HEARTBEAT_SECS = 60
+BURST_SIZE = 5
+OPEN_CM = 150
+CLOSED_CM = 4
+
+
+class FakePushSensor(object):
+  """POSTs bursts of readings to a push_server.SensorPushResource.
+
+  Attributes:
+    distance: cm the fake rangefinder reads.
+    pushes: number of pushes sent.
+  """
+
+  def __init__(self, url=PUSH_URL, token=PUSH_TOKEN, distance=CLOSED_CM,
+      noise=1, heartbeatSecs=HEARTBEAT_SECS, reactor=reactor):
+    """
+    Args:
+      url: where to POST readings.
+      token: gdoormon's arduino_push_token.
+      distance: initial distance.
+      noise: readings are randomly off by up to this many cm.
+      heartbeatSecs: push this often even if the distance doesn't change.
+      reactor: reactor for testing.
+    """
+    self.url = url
+    self.token = token
+    self.distance = distance
+    self.noise = noise
+    self.pushes = 0
+    self._reactor = reactor
+    self._agent = client.Agent(reactor)
+    self._heartbeat = task.LoopingCall(self.push)
+    self._heartbeat.clock = reactor
+    self._heartbeatSecs = heartbeatSecs
+
+  def start(self):
+    self._heartbeat.start(self._heartbeatSecs)
+
+  def stop(self):
+    if self._heartbeat.running:
+      self._heartbeat.stop()
+
+  def setDistance(self, distance):
+    """Move the door, and push the change right away."""
+    self.distance = distance
+    return self.push()
+
+  def burst(self):
+    return '\n'.join(str(max(0, self.distance +
+        random.randint(-self.noise, self.noise)))
+        for _ in range(BURST_SIZE)) + '\n'
+
+  def push(self):
+    """
+    Returns:
+      Deferred firing with the response code.
+    """
+    self.pushes += 1
+    start = self._reactor.seconds()
+    d = self._agent.request('POST', self.url,
+        http_headers.Headers({'Content-Type': ['text/plain'],
+            'Authorization': ['Bearer ' + self.token]}),
+        client.FileBodyProducer(StringIO.StringIO(self.burst())))
+    d.addCallback(self._handleResponse, start)
+    d.addErrback(self._handleError)
+    return d
+
+  def _handleResponse(self, response, start):
+    log.msg('pushed %d cm in %.1fms: %d' % (self.distance,
+        (self._reactor.seconds() - start) * 1000, response.code))
+    d = client.readBody(response)
+    d.addCallback(lambda _: response.code)
+    return d
+
+  def _handleError(self, failure):
+    log.msg('push failed: %s' % failure.getErrorMessage())
+
+
+def moveDoorRandomly(sensor):
+  sensor.setDistance(random.choice([OPEN_CM, CLOSED_CM]))
+  reactor.callLater(random.uniform(5, 30), moveDoorRandomly, sensor)
+
+
+if __name__ == '__builtin__':
+  # Running under twistd.
+  from twisted.application import service
+  application = service.Application('fake_push_sensor')
+  sensor = FakePushSensor()
+  reactor.callWhenRunning(sensor.start)
+  reactor.callWhenRunning(moveDoorRandomly, sensor)
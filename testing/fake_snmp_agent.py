@@ -0,0 +1,100 @@
+#!/usr/bin/twistd -ny
+# Fake SNMP agent that serves an Airport client table, for testing the
+# presence poller without an Airport:
+#
+#   deps/bin/twistd -ny testing/fake_snmp_agent.py
+#
+# then poll it with:
+#   airport_snmp.AirportPoller('127.0.0.1', snmp.SnmpClient(port=1161))
+
+import bisect
+
+from presence import airport_snmp
+from presence import snmp
+from twisted.internet import protocol
+from twisted.python import log
+
+FAKE_AGENT_PORT = 1161
+
+
+def airportMib(macs):
+  """Build the oid -> value map an Airport with the given clients serves.
+
+  Args:
+    macs: list of mac address strings
+  Returns:
+    dict {oid_tuple: value}
+  """
+  numberOid = snmp.parseOid(airport_snmp.WIRELESS_NUMBER_OID)
+  tableOid = snmp.parseOid(airport_snmp.WIRELESS_CLIENT_TABLE_OID)
+  mib = {numberOid: len(macs)}
+  for row, mac in enumerate(macs):
+    index = tuple(int(octet, 16) for octet in mac.split(':'))
+    mib[tableOid + (1,) + index] = mac.upper()
+    for column in range(2, airport_snmp.NUM_COLUMNS + 1):
+      mib[tableOid + (column,) + index] = column * 1000 + row
+  # Something after the table, so walks don't hit endOfMibView.
+  mib[tableOid[:-1] + (2,)] = 'after the table'
+  return mib
+
+
+class FakeSnmpAgent(protocol.DatagramProtocol):
+  """Answers GET, GETNEXT and GETBULK from a dict of oid -> value.
+
+  Attributes:
+    maxVarbinds: truncate replies to this many varbinds, like an agent
+        whose replies don't fit in a packet.
+    dropRequests: number of requests to ignore before answering.
+    requests: number of requests received.
+  """
+  noisy = False
+
+  def __init__(self, mib, maxVarbinds=None):
+    self.mib = mib
+    self.maxVarbinds = maxVarbinds
+    self.dropRequests = 0
+    self.requests = 0
+
+  def _getNext(self, oid):
+    oids = sorted(self.mib)
+    i = bisect.bisect_right(oids, oid)
+    if i == len(oids):
+      return oid, snmp.endOfMibView
+    return oids[i], self.mib[oids[i]]
+
+  def datagramReceived(self, data, address):
+    self.requests += 1
+    if self.dropRequests:
+      self.dropRequests -= 1
+      return
+    (community, pduType, requestId, errorStatus, errorIndex,
+        varbinds) = snmp.decodeMessage(data)
+    oids = [oid for oid, _ in varbinds]
+    if pduType == snmp.GET_REQUEST:
+      results = [(oid, self.mib.get(oid, snmp.noSuchObject)) for oid in oids]
+    elif pduType == snmp.GET_NEXT_REQUEST:
+      results = [self._getNext(oid) for oid in oids]
+    elif pduType == snmp.GET_BULK_REQUEST:
+      nonRepeaters, maxRepetitions = errorStatus, errorIndex
+      results = [self._getNext(oid) for oid in oids[:nonRepeaters]]
+      repeaters = oids[nonRepeaters:]
+      for _ in range(maxRepetitions):
+        row = [self._getNext(oid) for oid in repeaters]
+        results.extend(row)
+        repeaters = [oid for oid, _ in row]
+    else:
+      log.msg('fake agent ignoring pdu type 0x%x' % pduType)
+      return
+    if self.maxVarbinds is not None:
+      results = results[:self.maxVarbinds]
+    self.transport.write(snmp.encodeMessage(
+        snmp.RESPONSE, requestId, results, community=community), address)
+
+
+if __name__ == '__builtin__':
+  # Running under twistd.
+  from twisted.application import internet
+  from twisted.application import service
+  application = service.Application('fake_snmp_agent')
+  agent = FakeSnmpAgent(airportMib(['00:11:22:33:44:55', 'aa:bb:cc:dd:ee:ff']))
+  internet.UDPServer(FAKE_AGENT_PORT, agent).setServiceParent(application)
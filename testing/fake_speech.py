@@ -0,0 +1,9 @@
+from twisted.python import log
+
+
+class FakeSpeaker(object):
+  def say(self, text, key=None):
+    log.msg('saying: %s' % text)
+
+  def prerender(self, phrases):
+    log.msg('prerendering: %s' % ', '.join(phrases))
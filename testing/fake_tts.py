@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# Stands in for the TTS and the audio player in speech tests. Appends a line
+# per run to a log file:
+#   fake_tts.py <log> tts <text>            -> "say <text>"
+#   fake_tts.py <log> tts -w <file> <text>  -> "render <text>", and writes
+#                                              text to file
+#   fake_tts.py <log> play <file>           -> "play <contents of file>"
+# Exits with 1 when the text is "fail".
+
+import sys
+
+
+def main(args):
+  logPath, mode = args[:2]
+  args = args[2:]
+  if mode == 'play':
+    with open(args[0]) as f:
+      text = f.read()
+    line = 'play %s' % text
+  elif args[0] == '-w':
+    text = args[2]
+    with open(args[1], 'w') as f:
+      f.write(text)
+    line = 'render %s' % text
+  else:
+    text = args[0]
+    line = 'say %s' % text
+  with open(logPath, 'a') as f:
+    f.write(line + '\n')
+  return 1 if text == 'fail' else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# Microbenchmark of fysom event dispatch, interpreted vs. compiled mode.
+#
+# Run from the top of the source tree:
+#   python testing/fysom_bench.py
+
+import gc
+import sys
+import timeit
+sys.path.append('.')
+
+import fysom
+
+NUM_EVENTS = 20000
+# Fewer events for the garbage count: get_objects() with gc disabled is slow.
+GARBAGE_EVENTS = 1000
+
+
+def noop(e):
+  pass
+
+
+def makeFsm(compiled):
+  return fysom.Fysom({
+      'initial': 'ok',
+      'compiled': compiled,
+      'events': [
+        dict(name='poll', src='ok', dst='ok'),
+        dict(name='open', src='ok', dst='door_open'),
+        dict(name='close', src='door_open', dst='ok'),
+      ],
+      'callbacks': {
+        'onchangestate': noop,
+        'ondoor_open': noop,
+        'onclose': noop,
+      }})
+
+
+def selfLoop(fsm):
+  fsm.poll()
+
+
+def toggle(fsm):
+  fsm.open()
+  fsm.close()
+
+
+def garbage(fn, fsm, n):
+  """Returns the number of gc-tracked objects left behind by n calls."""
+  gc.collect()
+  gc.disable()
+  try:
+    before = len(gc.get_objects())
+    for _ in xrange(n):
+      fn(fsm)
+    return len(gc.get_objects()) - before
+  finally:
+    gc.enable()
+
+
+def main():
+  print '%-10s %-10s %12s %12s' % (
+      'mode', 'workload', 'usec/event', 'garbage/%d' % GARBAGE_EVENTS)
+  for compiled in (False, True):
+    mode = 'compiled' if compiled else 'default'
+    for name, fn, events in (('self-loop', selfLoop, 1), ('toggle', toggle, 2)):
+      fsm = makeFsm(compiled)
+      # Leave gc on: collecting the default mode's garbage is part of its cost.
+      secs = min(timeit.repeat(lambda: fn(fsm), setup=gc.enable,
+          number=NUM_EVENTS, repeat=3))
+      usecs = secs / (NUM_EVENTS * events) * 1e6
+      print '%-10s %-10s %12.3f %12d' % (
+          mode, name, usecs, garbage(fn, fsm, GARBAGE_EVENTS))
+
+
+if __name__ == '__main__':
+  main()
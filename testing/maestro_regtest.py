@@ -2,9 +2,17 @@
 from doorcontrol import maestro
 from twisted.application import internet
 from twisted.application import service
+from twisted.python import log
 
 application = service.Application("registration_regtest")
 
-control = maestro.DoorControl(maestro.PololuMicroMaestro())
-button_masher = internet.TimerService(5, control.hitButton)
+device = maestro.PololuMicroMaestro()
+maestro.MaestroService(device).setServiceParent(application)
+control = maestro.DoorControl(device)
+
+def hitButton():
+  d = control.hitButton()
+  d.addCallback(lambda pressed: log.msg('servo reached the button: %s' % pressed))
+
+button_masher = internet.TimerService(5, hitButton)
 button_masher.setServiceParent(application)
@@ -4,25 +4,23 @@
 
 from twisted.application import internet
 from twisted.application import service
-from twisted.python import log
 from doorcontrol import maestro
 from state import statemach
 from testing import fake_chatcontrol
 from testing import fake_doorcontrol
 from testing import fake_doorsensor
 from testing import fake_presence
+from testing import fake_speech
 
 application = service.Application("statemach_regtest")
 
 fake_broadcaster = fake_chatcontrol.FakeChatBroadcastProtocol()
 door_controller = maestro.DoorControl(fake_doorcontrol.FakePololuMicroMaestro())
 
-def fakeOsSystem(command):
-  log.msg('os.system("%s")' % command)
-
 # All times should be relative primes.
 sm = statemach.StateMachine(fake_broadcaster, door_controller,
-    doorOpenTimeoutSecs=2.1, alertTimeoutSecs=1.3, system=fakeOsSystem)
+    doorOpenTimeoutSecs=2.1, alertTimeoutSecs=1.3,
+    speaker=fake_speech.FakeSpeaker())
 
 fake_presence_service = internet.TimerService(
     3.55, fake_presence.randomPresence, sm)
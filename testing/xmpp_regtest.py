@@ -1,10 +1,12 @@
 #!/usr/bin/twistd -ny
 import os
+import tempfile
 from presence import registration
 from twisted.application import internet
 from twisted.application import service
 from twisted.words.protocols.jabber import jid
 from wokkel import client
+from chatcontrol import subscriberdb
 from chatcontrol import xmpp
 from chatcontrol import test_xmpp
 
@@ -26,7 +28,8 @@ xmppclient = client.XMPPClient(jid.internJID('%s/%s' % (USER, app_name)), PASSWD
 xmppclient.logTraffic = True
 xmppclient.setServiceParent(sc)
 
-subscribers = {}
+subscribers = subscriberdb.SubscriberIndex(subscriberdb.getDb(
+    os.path.join(tempfile.mkdtemp(), 'subscribers')))
 broadcaster = xmpp.ChatBroadcastProtocol(subscribers)
 broadcaster.setHandlerParent(xmppclient)
 